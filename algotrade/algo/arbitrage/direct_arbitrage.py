@@ -12,6 +12,7 @@ from algotrade.algotrade import AlgoTrade
 from algotrade.common.data_models import (BookUpdate, CurrencyPair, Order,
                                           Quote)
 from algotrade.common.enums import MarketName, Side
+from algotrade.common.fixed_point import fixed_points_from_config
 from algotrade.common.utils import calc_spread
 
 
@@ -40,6 +41,7 @@ class DirectArbitrageFinder:
         self._last_buysell: dict[CurrencyPair, tuple[Order, Order, datetime]] = {}
         self._writer = DirectArbitrageCSVWriter(config)
         self._aggressiveness = config['algos']['direct_arbitrage']["aggressiveness"]
+        self._fixed_points = fixed_points_from_config(config)
 
     def _min_ask_max_bid(
         self, pair
@@ -151,7 +153,7 @@ class DirectArbitrageFinder:
             size=size,
             pair=pair,
             side=side,
-            limit_price=limit_price,
+            limit_price=self._round_price(pair, side, limit_price),
             market=market,
             timeout=self._config["max_order_lifetime"],
         )
@@ -205,10 +207,19 @@ class DirectArbitrageFinder:
             pair=pair,
             side=side,
             market=market,
-            limit_price=price,
+            limit_price=self._round_price(pair, side, price),
             timeout=self._market_order_timeout,
         )
 
+    def _round_price(self, pair: CurrencyPair, side: Side, price: float) -> float | int:
+        """
+        Returns:
+            `price` as a whole number of ticks (rounded on the passive side) if `pair` is in fixed-point mode,
+            `price` itself otherwise
+        """
+        fixed = self._fixed_points.get(pair)
+        return price if fixed is None else fixed.round_ticks(price, side)
+
     async def _fill_with_market(self, uuids: list[UUID]):
         """
         emmits a cancelreplace of partially filled (0 to 1) order and replaces it with a market order for the remaining size (base leg) to fill.
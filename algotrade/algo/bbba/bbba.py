@@ -6,7 +6,7 @@ from algotrade.algotrade import AlgoTrade
 from algotrade.algo.bbba.price_server import PriceServer
 from algotrade.common.enums import MarketName, Side
 from algotrade.common.data_models import CurrencyPair, BookUpdate, OrderStatusUpdate, OrderStatusUpdateType, Quote
-from algotrade.order_book.order_book import L2OrderBook, diff
+from algotrade.order_book.order_book import BookDiffView, L2OrderBook
 
 
 @dataclass
@@ -56,6 +56,7 @@ class BBBA:
         self._ref_price: dict[Side, float] = {}
         self._book = L2OrderBook()  # empty
         self._own_orders = L2OrderBook()  # empty
+        self._book_ex_own = BookDiffView(self._book, self._own_orders)  # the book without own orders, no copies
         self._algotrade = algotrade
         self._price_q = price_q
 
@@ -127,10 +128,9 @@ class BBBA:
         if not self._ref_price_initialized() or not self._book_initialized() or not self._own_orders_initialized():
             return
         for side in Side:
-            d = diff(self._book, self._own_orders)
             own_best = self._own_best(side)[0]  # the price only
             price = None
-            tob = d.get_tob(side)[0]  # the price only
+            tob = self._book_ex_own.get_tob(side)[0]  # the price only
             if abs(tob - own_best) > self._top_shift or SIGN[side]*(tob - SIGN[side]*own_best) > 0:
                 price = tob + SIGN[side]*(self._top_shift + self.get_noise())
             else:
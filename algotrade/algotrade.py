@@ -1,15 +1,27 @@
-from typing import Callable, Coroutine
+import os
+from typing import Callable, Coroutine, Hashable
 from uuid import UUID
 
+from loguru import logger
+
 from algotrade.broker import Broker
-from algotrade.common.data_models import Order
+from algotrade.common.data_models import CurrencyPair, Order, Quote
 from algotrade.common.enums import (AdapterName, AdapterTopic, BrokerTopic,
-                                    ConnectorTopic)
+                                    ConnectorTopic, MarketName, QueuePolicy,
+                                    TopicPriority, TraceStage)
+from algotrade.common.queues import QueueStats
+from algotrade.common.tracing import LatencyTracer
 from algotrade.config import get_config
 from algotrade.connect.adapter.adapter import Adapter
 from algotrade.connect.adapter.talos import Talos
-from algotrade.connect.connector.connector import Connector
-from algotrade.pubsub import PubSub
+from algotrade.connect.connector.connector import ConnectionStats, Connector
+from algotrade.connect.connector.pool import ConnectorPool
+from algotrade.journal import Journal, Replay
+from algotrade.order_book.consolidated_book import ConsolidatedBook
+from algotrade.order_book.factory import (book_factories_from_config,
+                                          consolidated_tick_sizes_from_config)
+from algotrade.order_book.order_book import OrderBook
+from algotrade.pubsub import Pattern, PubSub
 
 config = get_config()
 
@@ -23,6 +35,14 @@ def _adapters_have_unique_names(adapters: list[Adapter]):
         return True
 
 
+def _quote_key(quote: Quote) -> tuple[CurrencyPair, MarketName]:
+    return quote.pair, quote.market
+
+
+def _quote_pair(quote: Quote) -> CurrencyPair:
+    return quote.pair
+
+
 class AlgoTrade:
     """
     An object that is used to create a composite system of a Broker which communicates with some `Adapter` objects.
@@ -33,6 +53,7 @@ class AlgoTrade:
     UPDATE_TOPICS = {
         'quote': BrokerTopic.QUOTE_UPDATE, 
         'book': BrokerTopic.BOOK_UPDATE, 
+        'consolidated_book': BrokerTopic.CONSOLIDATED_BOOK_UPDATE,
         'order_status': BrokerTopic.ORDER_STATUS_UPDATE,
         # 'trade': BrokerTopic.TRADE_UPDATE,
         'panic': BrokerTopic.PANIC
@@ -40,21 +61,85 @@ class AlgoTrade:
 
     def __init__(self, config: dict | None = None):
         config = config if config is not None else get_config()
-        ps = PubSub()  # create the global `PubSub` object
+        pubsub_config = config.get('pubsub', {})
+        ps = PubSub(  # create the global `PubSub` object
+            pubsub_config.get('capacity', 0), 
+            QueuePolicy(pubsub_config.get('policy', QueuePolicy.BLOCK.value)),
+            pubsub_config.get('starvation_limit', 64),
+        )
+        self._book_batch_size = pubsub_config.get('book_batch_size', 0)
+        self._metrics_period = pubsub_config.get('metrics_period', 0)
+        self._tracer = LatencyTracer() if config.get('tracing', {}).get('enabled', False) else None
         adapters = self._create_adapters(ps, config)
-        connectors = self._create_connectors(ps, adapters)
-        broker = Broker(ps)
+        connectors = self._create_connectors(ps, adapters, config)
+        broker = Broker(
+            ps,
+            book_factories_from_config(config),
+            tracer=self._tracer,
+            consolidated_tick_sizes=consolidated_tick_sizes_from_config(config),
+        )
         self._subscribe_coros = self._subscribe_all(adapters, connectors, broker, ps)
+        if self._metrics_period:
+            ps.enable_metrics()
+        if pubsub_config.get('direct_dispatch', False):
+            self._set_direct_dispatch(ps, adapters)
+        if pubsub_config.get('prioritize_control', False):
+            self._set_control_priority(ps)
+        if pubsub_config.get('conflate_quotes', False):
+            ps.conflate(AdapterTopic.QUOTE_UPDATE, _quote_key)
+            ps.conflate(BrokerTopic.QUOTE_UPDATE, _quote_key)
+        if pubsub_config.get('partition_quotes', False):
+            ps.partition(BrokerTopic.QUOTE_UPDATE, _quote_pair, pubsub_config.get('max_in_flight', 8))
         self._ps = ps
         self._connectors = connectors
         self._broker = broker
+        self._journal = None
+        journal_config = config.get('journal', {})
+        if journal_config.get('path'):
+            self._journal = Journal(journal_config['path'], journal_config.get('max_file_bytes', 64 * 2**20))
+            self._journal.attach(ps)
+        self._checkpoint_config = config.get('checkpoint', {})
+        if self._checkpoint_config.get('path') and os.path.exists(self._checkpoint_config['path']):
+            n = broker.restore(self._checkpoint_config['path'])
+            logger.info(f"restored {n} order books from {self._checkpoint_config['path']}")
 
     def run(self):
         """
         Returns:
             A list of coroutines to run concurrently.
         """
-        return self._subscribe_coros + [connector.connect() for connector in self._connectors]
+        coros = self._subscribe_coros + [connector.connect() for connector in self._connectors]
+        if self._metrics_period:
+            coros.append(self._ps.log_metrics(self._metrics_period))
+        if self._checkpoint_config.get('path'):
+            coros.append(self._broker.run_checkpoints(self._checkpoint_config['path'], self._checkpoint_config['period']))
+        return coros
+
+    def replay(self, path: str, paced: bool = False, speed: float = 1.0) -> list[Coroutine]:
+        """
+        Drives the system with the events a journal recorded from the connectors instead of connecting to the markets,
+        see `Replay`. Payloads to send are discarded. The journal to replay must not be the one this system writes to
+        Args:
+            path: path prefix of the journal files, the [journal] path of the recording system
+            paced: whether to replay at recorded pace instead of as fast as possible
+            speed: the pace multiplier when paced
+        Returns:
+            A list of coroutines to run concurrently, instead of `run`'s. The last one returns the `Replay` once
+            the whole journal was replayed and consumed
+        """
+        replay = Replay(path, self._ps, paced=paced, speed=speed)
+
+        async def run_replay() -> Replay:
+            await replay.run()
+            return replay
+        return self._subscribe_coros + [connector.discard_out() for connector in self._connectors] + [run_replay()]
+
+    def close(self):
+        """
+        Writes the pending journal records, if journaling
+        """
+        if self._journal is not None:
+            self._journal.close()
 
     async def subscribe_handler(self, update_topic: str, handler: Callable[..., Coroutine]):
         """
@@ -64,19 +149,98 @@ class AlgoTrade:
                 must be one of:
                 1. 'quote'
                 2. 'book' 
-                3. 'order_status'
-                4. 'panic'
+                3. 'consolidated_book' - the handler receives the updated pair's `ConsolidatedBook`
+                4. 'order_status'
+                5. 'panic'
             handler: to be performed uppon the event represented by the update_topic string
         """
+        if update_topic == 'panic':  # panics are published per (pair, market) as well
+            await self._ps.subscribe_pattern((BrokerTopic.PANIC,), handler)
+            return
+        if self._tracer is not None and update_topic in ('quote', 'order_status'):
+            handler = self._tracer.traced(handler)
         await self._ps.subscribe(self.UPDATE_TOPICS[update_topic], handler)
 
     def get_order(self, uuid: UUID) -> Order:
         return self._broker.get_order(uuid)
 
+    def get_book(self, pair: CurrencyPair, market: MarketName) -> OrderBook | None:
+        return self._broker.get_book(pair, market)
+
+    def get_consolidated_book(self, pair: CurrencyPair) -> ConsolidatedBook | None:
+        return self._broker.get_consolidated_book(pair)
+
+    def get_conflated_count(self) -> int:
+        """
+        Returns:
+            the number of quotes skipped since a fresher quote of the same pair and market arrived before they were consumed
+        """
+        return self._ps.conflated(AdapterTopic.QUOTE_UPDATE) + self._ps.conflated(BrokerTopic.QUOTE_UPDATE)
+
+    def get_metrics(self) -> dict[Hashable, dict]:
+        """
+        Returns:
+            per topic metrics, see `PubSub.metrics_snapshot`. Empty unless [pubsub] metrics_period is set
+        """
+        return self._ps.metrics_snapshot()
+
+    def get_queue_stats(self) -> dict[Hashable, QueueStats]:
+        """
+        Returns:
+            the size, capacity, high-water mark and number of dropped events of each topic's queue
+            and of each connector's queue of payloads to send, keyed by ('connector', adapter name), or by
+            ('connector', adapter name, connection name) for adapters with several connections
+        """
+        stats = self._ps.queue_stats()
+        for connector in self._connectors:
+            if isinstance(connector, ConnectorPool):
+                for name, connection_stats in connector.queue_stats().items():
+                    stats[('connector', connector.get_adapter_name(), name)] = connection_stats
+            else:
+                stats[('connector', connector.get_adapter_name())] = connector.queue_stats()
+        return stats
+
+    def get_connection_stats(self, reset: bool = False) -> dict[tuple, ConnectionStats]:
+        """
+        Args:
+            reset: whether to start measuring the rates over after taking the stats
+        Returns:
+            the health and message rates of each websocket, keyed by (adapter name,) or by
+            (adapter name, connection name) for adapters with several connections, see `ConnectorPool`
+        """
+        stats = {}
+        for connector in self._connectors:
+            if isinstance(connector, ConnectorPool):
+                for name, connection_stats in connector.connection_stats(reset).items():
+                    stats[(connector.get_adapter_name(), name)] = connection_stats
+            else:
+                stats[(connector.get_adapter_name(),)] = connector.connection_stats(reset)
+        return stats
+
+    def get_latency_trace(self, reset: bool = False) -> dict[TraceStage, dict]:
+        """
+        Args:
+            reset: whether to start measuring over after taking the trace
+        Returns:
+            the summary of the nanoseconds spent in each stage from a received message to the orders it triggered on
+            the wire, see `LatencyTracer`. Empty unless [tracing] enabled is set
+        """
+        return self._tracer.summary(reset) if self._tracer is not None else {}
+
+    def get_book_age(self, pair: CurrencyPair, market: MarketName) -> float | None:
+        """
+        Returns:
+            seconds since the order book of `pair` on `market` was last updated, None if there is no such book.
+            Books restored from a checkpoint on startup report the age they had when saved plus the downtime
+        """
+        return self._broker.get_book_age(pair, market)
+
     async def cancel_orders(self, uuids: list[UUID]):
         await self._broker.cancel_orders(uuids)
 
     async def publish_orders(self, orders: list[Order]):
+        if self._tracer is not None:
+            self._tracer.on_decision(orders)
         await self._broker.publish_orders(orders)
     
     def is_order_live(self, uuid: UUID):
@@ -106,33 +270,60 @@ class AlgoTrade:
         adapters_map = {AdapterName.TALOS: Talos}
         for adapter_str in config['adapters']['use']:
             adapter_name = AdapterName(adapter_str)
-            res.append(adapters_map[adapter_name](ps, config))
+            res.append(adapters_map[adapter_name](ps, config, tracer=self._tracer))
         return res
         
-    def _create_connectors(self, ps: PubSub, adapters: list[Adapter]):
+    def _create_connectors(self, ps: PubSub, adapters: list[Adapter], config: dict) -> list[Connector | ConnectorPool]:
         """
         Creates a list of connectors associated with a list of input adapters and a `PubSub` object to be used for later subscriptions
         Args:
             A list of adapters for which to create connectors for.
+            config: global config dictionary, an adapter with [adapters.<name>] connections > 1 gets a `ConnectorPool`
+                of connections - 1 market data connections and an order connection
         Returns
             A list of connectors to be used by the input adapters. The i'th connector is created for the i'th adapter from the input list
         """
-        return [
-            Connector(
+        res: list[Connector | ConnectorPool] = []
+        for adapter in adapters:
+            adapter_config = config['adapters'].get(adapter.get_name().value, {})
+            connections = adapter_config.get('connections', 1)
+            raw = adapter_config.get('raw_frames', False)
+            if connections > 1:
+                res.append(ConnectorPool(
+                    adapter.get_uri(),
+                    adapter.get_name(),
+                    ps,
+                    adapter.get_shard_key,
+                    connections - 1,
+                    adapter.generate_headers,
+                    merge_payloads=adapter.merge_payloads,
+                    get_subscription_key=adapter.get_subscription_key,
+                    renew_subscription=adapter.renew_subscription,
+                    is_market_data=adapter.is_market_data,
+                    raw=raw,
+                    tracer=self._tracer,
+                ))
+                continue
+            res.append(Connector(
                 adapter.get_uri(),
                 adapter.get_name(),
                 ps,
-                adapter.generate_headers
-            )
-            for adapter in adapters
-        ]
+                adapter.generate_headers,
+                merge_payloads=adapter.merge_payloads,
+                get_subscription_key=adapter.get_subscription_key,
+                renew_subscription=adapter.renew_subscription,
+                is_market_data=adapter.is_market_data,
+                raw=raw,
+                tracer=self._tracer,
+            ))
+        return res
         
     def _create_adapters_connectors(self, ps: PubSub, config: dict):
         adapters = self._create_adapters(ps, config)
-        connectors = self._create_connectors(ps, adapters)
+        connectors = self._create_connectors(ps, adapters, config)
         return adapters, connectors
 
-    def _subscribe_adapters_connectors(self, adapters: list[Adapter], connectors:list[Connector], ps: PubSub) -> list[Coroutine]:
+    def _subscribe_adapters_connectors(self, adapters: list[Adapter], connectors: list[Connector | ConnectorPool], ps: PubSub) -> list[Coroutine]:
         coros = []
         for adapter, connector in zip(adapters, connectors):
             coros.append(ps.subscribe((AdapterTopic.PAYLOAD_OUT, adapter.get_name()), connector.on_payload_out))
@@ -140,7 +331,29 @@ class AlgoTrade:
             coros.append(ps.subscribe((ConnectorTopic.PAYLOAD_IN, adapter.get_name()), adapter.on_payload_recv_in))
         return coros
 
-    def _subscribe_all(self, adapters: list[Adapter], connectors: list[Connector], broker: Broker, ps: PubSub) -> list[Coroutine]:
+    def _set_control_priority(self, ps: PubSub):
+        """
+        Consumes order updates and panics ahead of pending market data
+        """
+        ps.set_priority(AdapterTopic.ORDER_UPDATE, TopicPriority.HIGH)
+        ps.set_priority(BrokerTopic.ORDER_STATUS_UPDATE, TopicPriority.HIGH)
+        ps.set_priority(BrokerTopic.PANIC, TopicPriority.HIGH)
+        ps.set_priority(Pattern((BrokerTopic.PANIC,)), TopicPriority.HIGH)
+
+    def _set_direct_dispatch(self, ps: PubSub, adapters: list[Adapter]):
+        """
+        Dispatches the topics on the path from a market data payload to outgoing orders inline
+        """
+        ps.set_direct(AdapterTopic.QUOTE_UPDATE)
+        ps.set_direct(AdapterTopic.BOOK_UPDATE)
+        ps.set_direct(BrokerTopic.QUOTE_UPDATE)
+        ps.set_direct(BrokerTopic.BOOK_UPDATE)
+        for adapter in adapters:
+            ps.set_direct((ConnectorTopic.PAYLOAD_IN, adapter.get_name()))
+            for market in adapter.get_markets():
+                ps.set_direct((BrokerTopic.ORDERS_OUT, market))
+
+    def _subscribe_all(self, adapters: list[Adapter], connectors: list[Connector | ConnectorPool], broker: Broker, ps: PubSub) -> list[Coroutine]:
         coros = []
         coros += self._subscribe_adapters_connectors(adapters, connectors, ps)
         assert self._adapters_markets_disjoint(adapters)
@@ -151,11 +364,15 @@ class AlgoTrade:
                 # listen only to events relevent to the `Adapters` markets:
                 coros.append(ps.subscribe((BrokerTopic.CANCEL_ORDERS_OUT, market), adapter.on_cancel_orders_out))
                 coros.append(ps.subscribe((BrokerTopic.ORDERS_OUT, market), adapter.on_orders_out))
-                # listen to all panic events:
-                coros.append(ps.subscribe(BrokerTopic.PANIC, adapter.on_panic))
+                coros.append(ps.subscribe((BrokerTopic.BOOK_RESYNC, market), adapter.on_book_resync))
+            # listen to all panic events, published as BrokerTopic.PANIC or (BrokerTopic.PANIC, pair, market):
+            coros.append(ps.subscribe_pattern((BrokerTopic.PANIC,), adapter.on_panic))
                     
         # Adapter -> Broker  
-        coros.append(ps.subscribe(AdapterTopic.BOOK_UPDATE, broker.on_book_update))  # listen to all book update events
+        if self._book_batch_size:  # listen to all book update events
+            coros.append(ps.subscribe_batch(AdapterTopic.BOOK_UPDATE, broker.on_book_updates, self._book_batch_size))
+        else:
+            coros.append(ps.subscribe(AdapterTopic.BOOK_UPDATE, broker.on_book_update))
         coros.append(ps.subscribe(AdapterTopic.QUOTE_UPDATE, broker.on_quote_update))  # listen to all quote update events
         coros.append(ps.subscribe(AdapterTopic.ORDER_UPDATE, broker.on_order_update)) # listen to all order update events
         return coros    
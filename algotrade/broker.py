@@ -1,9 +1,20 @@
+import asyncio
+import os
+import time
 from uuid import UUID
 
+from loguru import logger
+
 from algotrade.common.data_models import (BookUpdate, CurrencyPair, Order,
-                                          OrderStatusUpdate, Trade, Quote)
-from algotrade.common.enums import BrokerTopic, MarketName
-from algotrade.order_book.order_book import L2OrderBook
+                                          OrderStatusUpdate, Trade, Quote,
+                                          Update)
+from algotrade.common.enums import BrokerTopic, MarketName, Side
+from algotrade.common.tracing import LatencyTracer
+from algotrade.order_book import snapshot
+from algotrade.order_book.consolidated_book import ConsolidatedBook
+from algotrade.order_book.factory import BookFactory, BookFactoryKey
+from algotrade.order_book.order_book import (BookChecksum, L2OrderBook,
+                                             OrderBook)
 from algotrade.orders_manager import OrdersManager
 from algotrade.pnl_monitor import PnLMonitor
 from algotrade.pubsub import PubSub
@@ -19,31 +30,182 @@ class Broker:
         (BrokerTopic.CANCEL_ORDERS_OUT, order.market)
         (BrokerTopic.ORDERS_OUT, market)
         BrokerTopic.BOOK_UPDATE
+        BrokerTopic.CONSOLIDATED_BOOK_UPDATE
+        (BrokerTopic.BOOK_RESYNC, market)
         BrokerTopic.QUOTE_UPDATE
         BrokerTopic.ORDER_STATUS_UPDATE
     """
-    def __init__(self, ps: PubSub):
+    def __init__(
+        self, 
+        ps: PubSub, 
+        book_factories: dict[BookFactoryKey, BookFactory] | None = None,
+        checksums: dict[MarketName, BookChecksum] | None = None,
+        tracer: LatencyTracer | None = None,
+        consolidated_tick_sizes: dict[CurrencyPair, float] | None = None,
+    ):
+        """
+        Args:
+            ps: the global `PubSub` object
+            book_factories: maps a pair, or a (pair, market) to override a single market, to the callable creating
+                its order books (one per market). Pairs not in the map use `L2OrderBook`
+            checksums: the checksum algorithm of each market's book updates, see `BookUpdate.checksum`, e.g. based on
+                `kraken_checksum`. Checksums of other markets are not verified
+            tracer: stamps the traced quotes and order status updates, see `LatencyTracer`. Not tracing if None
+            consolidated_tick_sizes: the tick size of each pair whose consolidated book keeps a depth index, see
+                `ConsolidatedBook`
+        """
         self._ps = ps
         self._orders_manager = OrdersManager(ps)
         self._pnl_monitor = PnLMonitor(ps, self._orders_manager)
-        self._order_book: dict[tuple[CurrencyPair, MarketName], L2OrderBook] = {}
+        self._order_book: dict[tuple[CurrencyPair, MarketName], OrderBook] = {}
+        self._book_factories: dict[BookFactoryKey, BookFactory] = dict(book_factories) if book_factories else {}
+        self._book_updated_at: dict[tuple[CurrencyPair, MarketName], float] = {}  # unix time of last book update
+        self._book_sequence: dict[tuple[CurrencyPair, MarketName], int] = {}  # sequence of last applied update
+        self._resyncing: set[tuple[CurrencyPair, MarketName]] = set()  # books waiting for a snapshot
+        self._consolidated: dict[CurrencyPair, ConsolidatedBook] = {}
+        self._checksums: dict[MarketName, BookChecksum] = dict(checksums) if checksums else {}
+        self._tracer = tracer
+        self._consolidated_tick_sizes = dict(consolidated_tick_sizes) if consolidated_tick_sizes else {}
 
     async def on_book_update(self, update: BookUpdate):
-        book = self._order_book.setdefault((update.pair, update.market), L2OrderBook())
-        book.update(update.bids, update.asks)
-        await self._ps.publish(BrokerTopic.BOOK_UPDATE, update)
+        """
+        Applies `update` to its book. Incremental updates are verified against the book's sequence and checksum:
+        on a sequence gap, a checksum mismatch or a depth capped book that lost levels, the book is cleared and
+        a resync of it is requested from its market. Incremental updates are then ignored until a snapshot arrives.
+        The pair's consolidated book is published only while `BrokerTopic.CONSOLIDATED_BOOK_UPDATE` has consumers,
+        such that its events do not pile up unconsumed.
+        """
+        if await self._apply_book_update(update):
+            await self._ps.publish(BrokerTopic.BOOK_UPDATE, update)
+            if self._ps.has_consumers(BrokerTopic.CONSOLIDATED_BOOK_UPDATE):
+                await self._ps.publish(BrokerTopic.CONSOLIDATED_BOOK_UPDATE, self._consolidated[update.pair])
+
+    async def on_book_updates(self, updates: list[BookUpdate]):
+        """
+        Applies a batch of updates as `on_book_update` does, but publishes each pair's consolidated book once
+        per batch rather than once per update. Consolidated books are only published while the topic has consumers
+        """
+        pairs = {}
+        for update in updates:
+            if await self._apply_book_update(update):
+                await self._ps.publish(BrokerTopic.BOOK_UPDATE, update)
+                pairs[update.pair] = None
+        if not self._ps.has_consumers(BrokerTopic.CONSOLIDATED_BOOK_UPDATE):
+            return
+        for pair in pairs:
+            await self._ps.publish(BrokerTopic.CONSOLIDATED_BOOK_UPDATE, self._consolidated[pair])
+
+    async def _apply_book_update(self, update: BookUpdate) -> bool:
+        """
+        Returns:
+            True if `update` was applied to its book, False if it was ignored or the book is being resynced
+        """
+        key = (update.pair, update.market)
+        if not update.snapshot:
+            if key in self._resyncing:
+                return False
+            last = self._book_sequence.get(key)
+            if update.sequence is not None and last is not None:
+                if update.sequence <= last:  # duplicate or stale
+                    return False
+                if update.sequence != last + 1:
+                    await self._resync(key, f"sequence gap {last} -> {update.sequence}")
+                    return False
+        book = self._get_or_create_book(update.pair, update.market)
+        book.update(update.bids, update.asks, snapshot=update.snapshot)
+        consolidated = self._get_or_create_consolidated_book(update.pair)
+        consolidated.on_market_update(update.market, book, update.bids, update.asks, update.snapshot)
+        self._resyncing.discard(key)
+        if update.sequence is not None:
+            self._book_sequence[key] = update.sequence
+        checksum = self._checksums.get(update.market)
+        if update.checksum is not None and checksum is not None and checksum(update.pair, book) != update.checksum:
+            await self._resync(key, "checksum mismatch")
+            return False
+        if not (book.is_complete(Side.BUY) and book.is_complete(Side.SELL)):
+            await self._resync(key, "levels dropped by the depth cap are needed")
+            return False
+        self._book_updated_at[key] = time.time()
+        return True
 
     async def on_quote_update(self, update: Quote):
         # TODO additional ops?
+        if self._tracer is not None and update.trace is not None:
+            self._tracer.on_broker(update.trace)
         await self._ps.publish(BrokerTopic.QUOTE_UPDATE, update)
     
     async def on_order_update(self, update: OrderStatusUpdate):
+        if self._tracer is not None and update.trace is not None:
+            self._tracer.on_broker(update.trace)
         await self._orders_manager.on_order_update(update)
         await self._ps.publish(BrokerTopic.ORDER_STATUS_UPDATE, update)
 
     async def on_trade(self, trade: Trade):
         self._orders_manager.on_trade_in(trade)
 
+    def set_book_factory(self, pair: CurrencyPair, factory: BookFactory, market: MarketName | None = None):
+        """
+        Sets the order book backend of `pair`, or of `pair` on `market` only, for books created from now on.
+        Existing books are kept.
+        """
+        self._book_factories[pair if market is None else (pair, market)] = factory
+
+    def get_book(self, pair: CurrencyPair, market: MarketName) -> OrderBook | None:
+        return self._order_book.get((pair, market))
+
+    def get_consolidated_book(self, pair: CurrencyPair) -> ConsolidatedBook | None:
+        """
+        Returns:
+            the books of `pair` on all markets merged into one, None if no book of `pair` was updated yet
+        """
+        return self._consolidated.get(pair)
+
+    def get_book_age(self, pair: CurrencyPair, market: MarketName) -> float | None:
+        """
+        Returns:
+            seconds since the book of `pair` on `market` was last updated (including updates received before
+            a restart, for books restored from a checkpoint), None if there is no such book
+        """
+        updated_at = self._book_updated_at.get((pair, market))
+        return None if updated_at is None else time.time() - updated_at
+
+    def checkpoint(self, path: str):
+        """
+        Saves all order books to a binary snapshot file at `path`
+        """
+        snapshot.save(path, self._order_book, self._book_updated_at)
+
+    def restore(self, path: str) -> int:
+        """
+        Restores order books from a binary snapshot file created by `checkpoint`. Books keep the update time
+        they had when saved, such that `get_book_age` reports their true staleness. Restored books await a snapshot
+        as resynced ones do: incremental updates, which would apply on top of the missed ones, are ignored until then.
+        Returns:
+            the number of restored books
+        """
+        snapshots = snapshot.load(path)
+        for snap in snapshots:
+            book = self._get_or_create_book(snap.pair, snap.market)
+            snap.restore_into(book)
+            self._get_or_create_consolidated_book(snap.pair).on_market_update(snap.market, book, snapshot=True)
+            self._book_updated_at[(snap.pair, snap.market)] = snap.updated_at
+            self._resyncing.add((snap.pair, snap.market))
+        return len(snapshots)
+
+    async def run_checkpoints(self, path: str, period: float):
+        """
+        Periodically saves all order books to `path`. The snapshot is serialized on the event loop, so books are
+        consistent, and written to disk in an executor so the loop does not block on IO
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(period)
+            data = snapshot.dumps(self._order_book, self._book_updated_at)
+            try:
+                await loop.run_in_executor(None, snapshot.write, path, data)
+            except OSError as e:
+                logger.warning(f"order books checkpoint to {path} failed: {e}")
+
     def is_order_live(self, uuid):
         return self._orders_manager.is_live(uuid)
 
@@ -64,4 +226,28 @@ class Broker:
         order = self._orders_manager.get_order(uuids[0])
         await self._ps.publish((BrokerTopic.CANCEL_ORDERS_OUT, order.market), uuids)
 
+    async def _resync(self, key: tuple[CurrencyPair, MarketName], reason: str):
+        """
+        Clears the book of `key` and requests a fresh snapshot of it from its market
+        """
+        pair, market = key
+        logger.warning(f"resyncing the {pair} order book of {market.value}: {reason}")
+        if key in self._order_book:
+            self._order_book[key].clear()
+        if pair in self._consolidated:
+            self._consolidated[pair].remove_market(market)
+        self._book_sequence.pop(key, None)
+        self._resyncing.add(key)
+        await self._ps.publish((BrokerTopic.BOOK_RESYNC, market), Update(pair, market))
+
+    def _get_or_create_book(self, pair: CurrencyPair, market: MarketName) -> OrderBook:
+        key = (pair, market)
+        if key not in self._order_book:
+            factory = self._book_factories.get(key) or self._book_factories.get(pair, L2OrderBook)
+            self._order_book[key] = factory()
+        return self._order_book[key]
 
+    def _get_or_create_consolidated_book(self, pair: CurrencyPair) -> ConsolidatedBook:
+        if pair not in self._consolidated:
+            self._consolidated[pair] = ConsolidatedBook(pair, self._consolidated_tick_sizes.get(pair))
+        return self._consolidated[pair]
@@ -0,0 +1,435 @@
+"""
+Compact binary encoding of PubSub events (topic and data) for passing them between processes.
+
+Record layout (little endian):
+    data type (uint8), topic length (uint16), topic, data
+
+Topics are encoded recursively (tuples, enums, currency pairs, strings, ints) and cached per topic, so encoding a
+topic on the hot path is a dict lookup. `Quote`, `BookUpdate`, `OrderStatusUpdate`, `Order`, `Frame`, UUIDs, strings,
+bytes and lists of those have fixed struct layouts. Prices and sizes are float64 or int64 (fixed-point mode), marked per field by
+a bit mask. Datetimes travel as int64 microseconds since the epoch, naive in UTC. Anything else falls back to pickle.
+Latency traces are local to the process and are not encoded.
+"""
+import pickle
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from functools import lru_cache
+from typing import Hashable
+from uuid import UUID
+
+from algotrade.common.data_models import (BookUpdate, CurrencyPair, Frame,
+                                          Order, OrderStatusUpdate,
+                                          OrderStatusUpdateType, Quote)
+from algotrade.common.enums import (AdapterName, AdapterTopic, BrokerTopic,
+                                    ConnectorTopic, Currency, MarketName, Side)
+
+
+class CodecError(Exception):
+    pass
+
+
+# enum classes that may appear in topics and data, by code. Append only, codes are part of the format
+_ENUMS: list[type[Enum]] = [
+    MarketName, Currency, Side, AdapterName, AdapterTopic, BrokerTopic, ConnectorTopic, OrderStatusUpdateType,
+]
+_ENUM_CODE = {cls: code for code, cls in enumerate(_ENUMS)}
+_MEMBERS = [list(cls) for cls in _ENUMS]
+_MEMBER_INDEX = {member: i for members in _MEMBERS for i, member in enumerate(members)}
+_NONE_INDEX = 255
+# identifies the enum layout records are encoded with. Members are encoded by index, so a member inserted in the
+# middle of an enum changes the meaning of stored records: stores of records (e.g. the journal) keep this id to
+# refuse records of another layout rather than decode them to the wrong members
+FORMAT_ID = zlib.crc32(repr([(cls.__name__, [member.name for member in cls]) for cls in _ENUMS]).encode())
+
+_EPOCH = datetime(1970, 1, 1)
+_NO_TIME = -(1 << 63)
+_NO_SEQUENCE = -1
+
+# data type codes
+_NONE, _QUOTE, _BOOK_UPDATE, _ORDER_STATUS_UPDATE, _ORDER, _LIST, _STR, _UUID, _PICKLE, _BYTES, _FRAME = range(11)
+
+_RECORD = struct.Struct('<BH')
+_LENGTH = struct.Struct('<I')
+_TEXT_LENGTH = struct.Struct('<H')
+_NO_TEXT = 0xFFFF
+_BOOK_HEADER = struct.Struct('<BBBBqqqII')
+_STATUS_HEADER = struct.Struct('<BBBBBBB16sq')
+_ORDER_HEADER = struct.Struct('<BBBBBBB16s')
+_QUOTE_HEADER = struct.Struct('<qq')  # timestamp, sequence
+_FRAME_HEADER = struct.Struct('<q?')  # receive time, whether the payload is bytes
+
+_topic_bytes: dict[Hashable, bytes] = {}
+_topics: dict[bytes, Hashable] = {}
+
+
+def encode(topic: Hashable, data: object) -> bytes:
+    """
+    Returns:
+        the record of event `data` published to `topic`
+    """
+    code, body = _encode_data(data)
+    topic_bytes = _topic_bytes.get(topic)
+    if topic_bytes is None:
+        topic_bytes = _topic_bytes[topic] = _encode_topic(topic)
+    return _RECORD.pack(code, len(topic_bytes)) + topic_bytes + body
+
+
+def decode(record: bytes | memoryview) -> tuple[Hashable, object]:
+    """
+    Returns:
+        the (topic, data) of an event encoded by `encode`
+    """
+    code, topic_length = _RECORD.unpack_from(record, 0)
+    offset = _RECORD.size
+    topic_bytes = bytes(record[offset:offset + topic_length])
+    topic = _topics.get(topic_bytes)
+    if topic is None:
+        topic, _ = _decode_topic(topic_bytes, 0)
+        _topics[topic_bytes] = topic
+    return topic, _decode_data(code, record, offset + topic_length)
+
+
+def _encode_topic(topic: Hashable) -> bytes:
+    if isinstance(topic, tuple):
+        if len(topic) > 255:
+            raise CodecError(f"topic {topic} has too many elements")
+        return b'T' + bytes([len(topic)]) + b''.join(_encode_topic(element) for element in topic)
+    if isinstance(topic, Enum) and type(topic) in _ENUM_CODE:
+        return b'E' + bytes([_ENUM_CODE[type(topic)], _MEMBER_INDEX[topic]])
+    if isinstance(topic, CurrencyPair):
+        return b'P' + bytes([_MEMBER_INDEX[topic.leg1], _MEMBER_INDEX[topic.leg2]])
+    if isinstance(topic, str):
+        text = topic.encode()
+        return b'S' + _TEXT_LENGTH.pack(len(text)) + text
+    if isinstance(topic, int) and not isinstance(topic, bool):
+        return b'I' + struct.pack('<q', topic)
+    if topic is None:
+        return b'N'
+    pickled = pickle.dumps(topic)
+    return b'K' + _LENGTH.pack(len(pickled)) + pickled
+
+
+def _decode_topic(buf: bytes, offset: int) -> tuple[Hashable, int]:
+    tag = buf[offset:offset + 1]
+    offset += 1
+    match tag:
+        case b'T':
+            n = buf[offset]
+            offset += 1
+            elements = []
+            for _ in range(n):
+                element, offset = _decode_topic(buf, offset)
+                elements.append(element)
+            return tuple(elements), offset
+        case b'E':
+            return _MEMBERS[buf[offset]][buf[offset + 1]], offset + 2
+        case b'P':
+            currencies = _MEMBERS[_ENUM_CODE[Currency]]
+            return CurrencyPair(currencies[buf[offset]], currencies[buf[offset + 1]]), offset + 2  # type: ignore
+        case b'S':
+            (n,) = _TEXT_LENGTH.unpack_from(buf, offset)
+            offset += _TEXT_LENGTH.size
+            return buf[offset:offset + n].decode(), offset + n
+        case b'I':
+            return struct.unpack_from('<q', buf, offset)[0], offset + 8
+        case b'N':
+            return None, offset
+        case b'K':
+            (n,) = _LENGTH.unpack_from(buf, offset)
+            offset += _LENGTH.size
+            return pickle.loads(buf[offset:offset + n]), offset + n
+        case _:
+            raise CodecError(f"unknown topic tag {tag!r}")
+
+
+def _encode_data(data: object) -> tuple[int, bytes]:
+    match data:
+        case None:
+            return _NONE, b''
+        case Quote():
+            return _QUOTE, _encode_quote(data)
+        case BookUpdate():
+            return _BOOK_UPDATE, _encode_book_update(data)
+        case OrderStatusUpdate():
+            return _ORDER_STATUS_UPDATE, _encode_order_status_update(data)
+        case Order():
+            return _ORDER, _encode_order(data)
+        case Frame():
+            payload = data.payload
+            is_bytes = isinstance(payload, bytes)
+            return _FRAME, _FRAME_HEADER.pack(data.recv_ns, is_bytes) + (payload if is_bytes else payload.encode())
+        case list():
+            chunks = [_LENGTH.pack(len(data))]
+            for item in data:
+                code, body = _encode_data(item)
+                chunks.append(_RECORD.pack(code, 0) + _LENGTH.pack(len(body)) + body)
+            return _LIST, b''.join(chunks)
+        case str():
+            return _STR, data.encode()
+        case UUID():
+            return _UUID, data.bytes
+        case bytes():
+            return _BYTES, data
+        case _:
+            return _PICKLE, pickle.dumps(data)
+
+
+def _decode_data(code: int, buf: bytes | memoryview, offset: int) -> object:
+    match code:
+        case 0:  # _NONE
+            return None
+        case 1:  # _QUOTE
+            return _decode_quote(buf, offset)
+        case 2:  # _BOOK_UPDATE
+            return _decode_book_update(buf, offset)
+        case 3:  # _ORDER_STATUS_UPDATE
+            return _decode_order_status_update(buf, offset)
+        case 4:  # _ORDER
+            return _decode_order(buf, offset)
+        case 5:  # _LIST
+            (n,) = _LENGTH.unpack_from(buf, offset)
+            offset += _LENGTH.size
+            items = []
+            for _ in range(n):
+                item_code, _ = _RECORD.unpack_from(buf, offset)
+                (length,) = _LENGTH.unpack_from(buf, offset + _RECORD.size)
+                offset += _RECORD.size + _LENGTH.size
+                items.append(_decode_data(item_code, buf, offset))
+                offset += length
+            return items
+        case 6:  # _STR
+            return bytes(buf[offset:]).decode()
+        case 7:  # _UUID
+            return UUID(bytes=bytes(buf[offset:offset + 16]))
+        case 8:  # _PICKLE
+            return pickle.loads(buf[offset:])
+        case 9:  # _BYTES
+            return bytes(buf[offset:])
+        case 10:  # _FRAME
+            recv_ns, is_bytes = _FRAME_HEADER.unpack_from(buf, offset)
+            payload = bytes(buf[offset + _FRAME_HEADER.size:])
+            return Frame(payload if is_bytes else payload.decode(), recv_ns)
+        case _:
+            raise CodecError(f"unknown data type {code}")
+
+
+@lru_cache(maxsize=None)
+def _numbers_struct(mask: int, n: int) -> struct.Struct:
+    """
+    Returns:
+        the struct of `n` numbers, the i'th an int64 if bit i of mask is set and a float64 otherwise
+    """
+    return struct.Struct('<' + ''.join('q' if mask >> i & 1 else 'd' for i in range(n)))
+
+
+def _numbers_mask(values: tuple) -> int:
+    mask = 0
+    for i, value in enumerate(values):
+        if isinstance(value, int):
+            mask |= 1 << i
+    return mask
+
+
+def _pack_numbers(values: tuple) -> bytes:
+    mask = _numbers_mask(values)
+    return bytes([mask]) + _numbers_struct(mask, len(values)).pack(*values)
+
+
+def _unpack_numbers(buf: bytes | memoryview, offset: int, n: int) -> tuple[tuple, int]:
+    s = _numbers_struct(buf[offset], n)
+    return s.unpack_from(buf, offset + 1), offset + 1 + s.size
+
+
+def _time(t: datetime | None) -> int:
+    if t is None:
+        return _NO_TIME
+    if t.tzinfo is not None:
+        t = t.astimezone(timezone.utc).replace(tzinfo=None)
+    return (t - _EPOCH) // timedelta(microseconds=1)
+
+
+def _from_time(us: int) -> datetime | None:
+    return None if us == _NO_TIME else _EPOCH + timedelta(microseconds=us)
+
+
+def _pack_text(text: str | None) -> bytes:
+    if text is None:
+        return _TEXT_LENGTH.pack(_NO_TEXT)
+    encoded = text.encode()[:_NO_TEXT - 1]
+    return _TEXT_LENGTH.pack(len(encoded)) + encoded
+
+
+def _unpack_text(buf: bytes | memoryview, offset: int) -> tuple[str | None, int]:
+    (n,) = _TEXT_LENGTH.unpack_from(buf, offset)
+    offset += _TEXT_LENGTH.size
+    if n == _NO_TEXT:
+        return None, offset
+    return bytes(buf[offset:offset + n]).decode(), offset + n
+
+
+def _pair_market(pair: CurrencyPair, market: MarketName) -> bytes:
+    return bytes([_MEMBER_INDEX[market], _MEMBER_INDEX[pair.leg1], _MEMBER_INDEX[pair.leg2]])
+
+
+def _from_pair_market(market: int, leg1: int, leg2: int) -> tuple[CurrencyPair, MarketName]:
+    currencies = _MEMBERS[_ENUM_CODE[Currency]]
+    return CurrencyPair(currencies[leg1], currencies[leg2]), _MEMBERS[_ENUM_CODE[MarketName]][market]  # type: ignore
+
+
+def _encode_quote(quote: Quote) -> bytes:
+    return (
+        _pair_market(quote.pair, quote.market)
+        + _QUOTE_HEADER.pack(_time(quote.timestamp), _NO_SEQUENCE if quote.sequence is None else quote.sequence)
+        + _pack_numbers((quote.bid_price, quote.ask_price, quote.tob_bid_price, quote.tob_ask_price, quote.size))
+    )
+
+
+def _decode_quote(buf: bytes | memoryview, offset: int) -> Quote:
+    pair, market = _from_pair_market(buf[offset], buf[offset + 1], buf[offset + 2])
+    timestamp, sequence = _QUOTE_HEADER.unpack_from(buf, offset + 3)
+    (bid, ask, tob_bid, tob_ask, size), _ = _unpack_numbers(buf, offset + 3 + _QUOTE_HEADER.size, 5)
+    return Quote(
+        bid, ask, tob_bid, tob_ask, market, pair, size, _from_time(timestamp),  # type: ignore
+        sequence=None if sequence == _NO_SEQUENCE else sequence,
+    )
+
+
+def _encode_levels(levels: dict) -> tuple[int, bytes]:
+    """
+    Returns:
+        bit 0: int prices, bit 1: int sizes, and the prices array followed by the sizes array
+    """
+    n = len(levels)
+    int_prices = all(isinstance(price, int) for price in levels)
+    int_sizes = all(isinstance(size, int) for size in levels.values())
+    body = struct.pack(f"<{n}{'q' if int_prices else 'd'}", *levels.keys())
+    body += struct.pack(f"<{n}{'q' if int_sizes else 'd'}", *levels.values())
+    return int_prices | int_sizes << 1, body
+
+
+def _decode_levels(buf: bytes | memoryview, offset: int, n: int, types: int) -> tuple[dict, int]:
+    prices = struct.unpack_from(f"<{n}{'q' if types & 1 else 'd'}", buf, offset)
+    sizes = struct.unpack_from(f"<{n}{'q' if types & 2 else 'd'}", buf, offset + 8 * n)
+    return dict(zip(prices, sizes)), offset + 16 * n
+
+
+def _encode_book_update(update: BookUpdate) -> bytes:
+    bid_types, bids = _encode_levels(update.bids)
+    ask_types, asks = _encode_levels(update.asks)
+    flags = (
+        update.snapshot
+        | (update.sequence is not None) << 1
+        | (update.checksum is not None) << 2
+        | bid_types << 3
+        | ask_types << 5
+    )
+    header = _BOOK_HEADER.pack(
+        *_pair_market(update.pair, update.market),
+        flags,
+        _time(update.timestamp),
+        update.sequence or 0,
+        update.checksum or 0,
+        len(update.bids),
+        len(update.asks),
+    )
+    return header + bids + asks
+
+
+def _decode_book_update(buf: bytes | memoryview, offset: int) -> BookUpdate:
+    market, leg1, leg2, flags, timestamp, sequence, checksum, n_bids, n_asks = _BOOK_HEADER.unpack_from(buf, offset)
+    pair, market = _from_pair_market(market, leg1, leg2)
+    offset += _BOOK_HEADER.size
+    bids, offset = _decode_levels(buf, offset, n_bids, flags >> 3 & 3)
+    asks, offset = _decode_levels(buf, offset, n_asks, flags >> 5 & 3)
+    return BookUpdate(
+        pair,
+        market,
+        bids,
+        asks,
+        timestamp=_from_time(timestamp),
+        snapshot=bool(flags & 1),
+        sequence=sequence if flags & 2 else None,
+        checksum=checksum if flags & 4 else None,
+    )
+
+
+def _side_index(side: Side | None) -> int:
+    return _NONE_INDEX if side is None else _MEMBER_INDEX[side]
+
+
+def _from_side_index(index: int) -> Side | None:
+    return None if index == _NONE_INDEX else _MEMBERS[_ENUM_CODE[Side]][index]  # type: ignore
+
+
+def _encode_order_status_update(update: OrderStatusUpdate) -> bytes:
+    header = _STATUS_HEADER.pack(
+        *_pair_market(update.pair, update.market),
+        _MEMBER_INDEX[update.update_type],
+        _side_index(update.side),
+        update.live,
+        0,
+        update.uuid.bytes,
+        _time(update.update_time),
+    )
+    numbers = (update.size, update.cum_filled_size, update.cum_filled_amount, update.cum_fees, update.limit_price)
+    return header + _pack_numbers(numbers) + _pack_text(update.reject_reason) + _pack_text(update.comment)
+
+
+def _decode_order_status_update(buf: bytes | memoryview, offset: int) -> OrderStatusUpdate:
+    market, leg1, leg2, update_type, side, live, _, uuid, update_time = _STATUS_HEADER.unpack_from(buf, offset)
+    pair, market = _from_pair_market(market, leg1, leg2)
+    (size, filled_size, filled_amount, fees, limit_price), offset = _unpack_numbers(buf, offset + _STATUS_HEADER.size, 5)
+    reject_reason, offset = _unpack_text(buf, offset)
+    comment, offset = _unpack_text(buf, offset)
+    return OrderStatusUpdate(
+        market=market,
+        pair=pair,
+        uuid=UUID(bytes=uuid),
+        update_type=_MEMBERS[_ENUM_CODE[OrderStatusUpdateType]][update_type],  # type: ignore
+        update_time=_from_time(update_time),  # type: ignore
+        reject_reason=reject_reason,
+        comment=comment,
+        size=size,
+        cum_filled_size=filled_size,
+        cum_filled_amount=filled_amount,
+        cum_fees=fees,
+        side=_from_side_index(side),
+        limit_price=limit_price,
+        live=bool(live),
+    )
+
+
+def _encode_order(order: Order) -> bytes:
+    header = _ORDER_HEADER.pack(
+        *_pair_market(order.pair, order.market),
+        _side_index(order.side),
+        order.live,
+        order.timeout is not None,
+        0,
+        order.uuid.bytes,
+    )
+    numbers = (
+        order.size, order.limit_price, order.timeout or 0.0, order.filled_size, order.filled_amount, order.cum_fee
+    )
+    return header + _pack_numbers(numbers)
+
+
+def _decode_order(buf: bytes | memoryview, offset: int) -> Order:
+    market, leg1, leg2, side, live, has_timeout, _, uuid = _ORDER_HEADER.unpack_from(buf, offset)
+    pair, market = _from_pair_market(market, leg1, leg2)
+    (size, limit_price, timeout, filled_size, filled_amount, fee), _ = _unpack_numbers(buf, offset + _ORDER_HEADER.size, 6)
+    return Order(
+        uuid=UUID(bytes=uuid),
+        size=size,
+        pair=pair,
+        side=_from_side_index(side),  # type: ignore
+        limit_price=limit_price,
+        market=market,
+        timeout=timeout if has_timeout else None,
+        filled_size=filled_size,
+        filled_amount=filled_amount,
+        cum_fee=fee,
+        live=bool(live),
+    )
@@ -1,6 +1,7 @@
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum, auto
+from typing import NamedTuple
 from uuid import UUID
 
 from algotrade.common.enums import Currency, MarketName, Side
@@ -30,8 +31,39 @@ def currency_pair_from_str(pair: str) -> CurrencyPair:
     return CurrencyPair(leg1, leg2)
 
 
+class Frame(NamedTuple):
+    """
+    A message received by a `Connector`, the data of its PAYLOAD_IN events
+    Attributes:
+        payload: the message, text or bytes in raw mode
+        recv_ns: `time.monotonic_ns()` when the message was received
+    """
+    payload: str | bytes
+    recv_ns: int
+
+
+@dataclass
+class Trace:
+    """
+    Monotonic timestamps, `time.monotonic_ns()`, of an event on its way through the stack, see `LatencyTracer`.
+    Orders published in response to a traced event carry a copy with `decision_ns` set.
+    Attributes:
+        recv_ns: when the connector received the message the event was parsed from
+        parsed_ns: when the adapter created the event
+        broker_ns: when the broker handled the event, None before
+        decision_ns: when the algorithm published orders in response, None before
+    """
+    recv_ns: int
+    parsed_ns: int
+    broker_ns: int | None = None
+    decision_ns: int | None = None
+
+
 @dataclass(frozen=True)
 class Quote:
+    """
+    For pairs in fixed-point mode, see `FixedPoint`, prices are ints in ticks and size is an int in lots
+    """
     bid_price: float
     ask_price: float
     tob_bid_price: float
@@ -40,6 +72,8 @@ class Quote:
     pair: CurrencyPair
     size: float  # TODO rid of the tob here (it's a temp fix. and ugly) and use size = 0 for tob indication
     timestamp: datetime
+    sequence: int | None = None  # the market's sequence number of the quote's stream, None if not supported
+    trace: Trace | None = field(default=None, compare=False, repr=False)  # set when tracing latency
 
 
 
@@ -51,16 +85,17 @@ class Order:
     attributes:
         uuid: the orders given unique id
         timestamp: time at which the order was sent by the connection module
-        size: order size in base leg units - strictly positive
+        size: order size in base leg units (lots for pairs in fixed-point mode) - strictly positive
         pair: order's pair
         side: buy or sell
-        limit_price: limit price in quote leg units, provided when the order is a limit order
+        limit_price: limit price in quote leg units (ticks for pairs in fixed-point mode), provided when the order is a limit order
         market: market at which the order is placed
         timeout: time after which
         filled_size: base leg quantity units - ranges between 0 and size, defaults to 0
         filled_amount: quote leg quantity units - ranges between 0 and final amount, defaults to 0
         cum_fee: sum of the fees paid in order's quote leg units - strictly non negative, defaults to 0
         live: state of the order. True if accepted by market and not yet filled, cancelled or rejected, false otherwise, defaults to False
+        trace: the `Trace` of the event the order was published in response to, None unless tracing latency
     """
 
     uuid: UUID
@@ -75,6 +110,7 @@ class Order:
     filled_amount: float = field(init=True, default=0.0)
     cum_fee: float = field(init=True, default=0.0)
     live: bool = field(init=True, default=False)
+    trace: Trace | None = field(default=None, compare=False, repr=False)
     
     def __hash__(self):
         return hash(self.uuid)
@@ -123,6 +159,7 @@ class OrderStatusUpdate:
     side: Side | None = None
     limit_price: float = 0
     live: bool = True
+    trace: Trace | None = field(default=None, compare=False, repr=False)  # set when tracing latency
 
 
     @property
@@ -161,7 +198,8 @@ class Trade:
 class  BookUpdate:
     """
     An update of an L2 order book. For each changed price level on both bid and ask side, the price level is mapped to the
-    corresponding new size at this level. Note that there should be no distinction between a partial book update and a full
+    corresponding new size at this level. For pairs in fixed-point mode, see `FixedPoint`, price levels are ints in ticks
+    and sizes are ints in lots. Note that there should be no distinction between a partial book update and a full
     book snapshot.
     Attributes:
         pair: The corresponding currency pair
@@ -169,6 +207,10 @@ class  BookUpdate:
         bids: A map from bid price levels to new corresponding size at this price level. 
         bids: A map from ask price levels to new corresponding size at this price level. 
         timestamp: Time the update object was created or the time of the update supplied from the market. The earlier of the two.
+        snapshot: True if the update replaces the whole book
+        sequence: The market's sequence number of the update, consecutive per (pair, market). None if not supported
+        checksum: The market's checksum of the book after the update, in the market's own algorithm, e.g.
+            `kraken_checksum`. Verified by the `Broker` for markets it has the algorithm of. None if not supported
     """
     pair: CurrencyPair
     market: MarketName
@@ -176,6 +218,8 @@ class  BookUpdate:
     asks: dict[float, float]
     timestamp: datetime | None = None
     snapshot: bool = False
+    sequence: int | None = None
+    checksum: int | None = None
 
 
 
@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 
 class EnumHashable(Enum):
@@ -43,6 +43,31 @@ class OrderType(EnumHashable):
     STOP = 'stop'
     TAKE = 'take'
 
+class QueuePolicy(EnumHashable):
+    BLOCK = 'block'  # the publisher waits for room
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+    CONFLATE = 'conflate'  # the latest pending event per key replaces earlier ones
+
+class TopicPriority(IntEnum):
+    """
+    Pending events of a topic are consumed before those of lower priority topics
+    """
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+class TraceStage(EnumHashable):
+    """
+    Stages of the way from a received message to the order it triggered on the wire, see `LatencyTracer`
+    """
+    NETWORK_TO_PARSE = 'network_to_parse'  # the connector received the message until the adapter created the event
+    PARSE_TO_BROKER = 'parse_to_broker'
+    BROKER_TO_DECISION = 'broker_to_decision'  # until the algorithm published orders in response
+    DECISION_TO_WIRE = 'decision_to_wire'  # until the connector wrote the orders to the websocket
+    TICK_TO_TRADE = 'tick_to_trade'  # the whole way, received message to orders on the wire
+
+
 class TimeFormat(EnumHashable):
     ISO_8601_UTC = "%Y-%m-%dT%H:%M:%S.%fZ"
     ISO_8601_UTC8F = "%Y-%m-%dT%H:%M:%S.%8fZ"
@@ -65,6 +90,8 @@ class BrokerTopic(EnumHashable):
     ORDERS_OUT = 'orders_out'
     ORDER_STATUS_UPDATE = 'order_update'
     BOOK_UPDATE = 'book_update'
+    BOOK_RESYNC = 'book_resync'
+    CONSOLIDATED_BOOK_UPDATE = 'consolidated_book_update'
     QUOTE_UPDATE = 'quote_update'
     TRADE_UPDATE = 'trade_update'
     PANIC = 'panic'
@@ -0,0 +1,84 @@
+import math
+from dataclasses import dataclass
+from decimal import Decimal
+
+from algotrade.common.data_models import CurrencyPair, currency_pair_from_str
+from algotrade.common.enums import Side
+
+
+@dataclass(frozen=True)
+class FixedPoint:
+    """
+    Fixed-point representation of a pair's prices and sizes as integers: prices in ticks and sizes in lots.
+    Integer levels hash and compare exactly, so book lookups do not depend on float rounding (0.1 + 0.2 != 0.3).
+    Conversion to and from floats or decimal strings is meant to happen only at the edges, in the adapters.
+    Attributes:
+        tick: the pair's minimal price increment in quote leg units
+        lot: the pair's minimal size increment in base leg units
+    """
+    tick: float
+    lot: float
+
+    def __post_init__(self):
+        if self.tick <= 0 or self.lot <= 0:
+            raise ValueError(f"tick {self.tick} and lot {self.lot} must be positive")
+
+    def to_ticks(self, price: float | str) -> int:
+        """
+        Returns:
+            `price` (a float or a decimal string) as the nearest whole number of ticks
+        Raises:
+            ValueError: if `price` is not a multiple of the tick beyond float rounding, i.e. the configured tick
+                does not match the market's, rather than silently snapping it to another level
+        """
+        ticks = float(price) / self.tick
+        res = round(ticks)
+        if abs(ticks - res) > 1e-9 * max(1.0, abs(ticks)):
+            raise ValueError(f"price {price} is not a multiple of tick size {self.tick}")
+        return res
+
+    def to_lots(self, size: float | str) -> int:
+        """
+        Returns:
+            `size` (a float or a decimal string) as the nearest whole number of lots
+        """
+        return round(float(size) / self.lot)
+
+    def from_ticks(self, ticks: int) -> float:
+        return round(ticks * self.tick, _decimals(self.tick))
+
+    def from_lots(self, lots: int) -> float:
+        return round(lots * self.lot, _decimals(self.lot))
+
+    def round_ticks(self, price: float, side: Side) -> int:
+        """
+        Rounds a price in (fractional) ticks, e.g. one derived from other prices, to a whole number of ticks
+        on the passive side: down for a buy and up for a sell
+        """
+        return math.floor(price + 1e-9) if side == Side.BUY else math.ceil(price - 1e-9)
+
+
+def fixed_points_from_config(config: dict) -> dict[CurrencyPair, FixedPoint]:
+    """
+    Args:
+        config: global config dictionary. Pairs listed under an optional [fixed_point] table are in fixed-point mode, e.g.:
+
+            [fixed_point.BTC-EUR]
+            tick = 0.01
+            lot = 0.00000001
+
+    Returns:
+        a map from each pair in fixed-point mode to its representation
+    """
+    return {
+        currency_pair_from_str(pair): FixedPoint(**params)
+        for pair, params in config.get('fixed_point', {}).items()
+    }
+
+
+def _decimals(increment: float) -> int:
+    """
+    Returns:
+        the number of decimal places needed to represent multiples of `increment`
+    """
+    return max(0, -Decimal(str(increment)).as_tuple().exponent)  # type: ignore
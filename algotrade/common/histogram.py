@@ -0,0 +1,82 @@
+class LatencyHistogram:
+    """
+    An HDR-style histogram of non-negative integer values, e.g. latencies in nanoseconds. Values below
+    2 * 2^sub_bucket_bits are counted exactly, larger values in log-linear buckets: every power of two range is split
+    into 2^sub_bucket_bits equal buckets, so the relative error of a reported value is below 2^-sub_bucket_bits.
+    Recording is O(1) and allocation free.
+    """
+    def __init__(self, sub_bucket_bits: int = 5):
+        """
+        Args:
+            sub_bucket_bits: log2 of the number of buckets per power of two range, 5 gives 3% precision
+        """
+        self._sub_bits = sub_bucket_bits
+        self._sub = 1 << sub_bucket_bits
+        self._counts = [0] * ((65 - sub_bucket_bits) * self._sub)
+        self.count = 0
+        self.total = 0
+        self.min: int | None = None
+        self.max: int | None = None
+
+    def record(self, value: int):
+        if value < 0:
+            value = 0
+        if value < 2 * self._sub:
+            self._counts[value] += 1
+        else:
+            shift = value.bit_length() - self._sub_bits - 1
+            self._counts[shift * self._sub + (value >> shift)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self) -> float | None:
+        return self.total / self.count if self.count else None
+
+    def percentile(self, p: float) -> int | None:
+        """
+        Returns:
+            the lowest value of the bucket holding the `p` percentile (0 to 100) of the recorded values,
+            None if nothing was recorded
+        """
+        if not self.count:
+            return None
+        rank = max(1, round(p / 100 * self.count))
+        seen = 0
+        for i, n in enumerate(self._counts):
+            seen += n
+            if seen >= rank:
+                return min(self._bucket_value(i), self.max)  # type: ignore
+        return self.max
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            the count, mean, min, max and the 50, 90, 99 and 99.9 percentiles of the recorded values
+        """
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'min': self.min,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p99.9': self.percentile(99.9),
+            'max': self.max,
+        }
+
+    def reset(self):
+        self._counts = [0] * len(self._counts)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _bucket_value(self, index: int) -> int:
+        if index < 2 * self._sub:
+            return index
+        shift = index // self._sub - 1
+        return (index - shift * self._sub) << shift
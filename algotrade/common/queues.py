@@ -0,0 +1,127 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Callable, Hashable
+
+from algotrade.common.enums import QueuePolicy
+from algotrade.common.histogram import LatencyHistogram
+
+
+@dataclass(frozen=True)
+class QueueStats:
+    """
+    Attributes:
+        size: number of pending items
+        maxsize: capacity of the queue, 0 if unbounded
+        high_water: the largest number of pending items seen
+        dropped: number of items dropped or replaced by the queue's policy before being consumed
+    """
+    size: int
+    maxsize: int
+    high_water: int
+    dropped: int
+
+
+class BoundedQueue(asyncio.Queue):
+    """
+    An `asyncio.Queue` with a policy for putting into a full queue and usage metrics
+    """
+    def __init__(self, maxsize: int = 0, policy: QueuePolicy = QueuePolicy.BLOCK):
+        """
+        Args:
+            maxsize: capacity of the queue, unbounded if 0
+            policy: BLOCK waits for room, DROP_OLDEST discards the oldest pending item and DROP_NEWEST discards
+                the put item. Use `ConflatingQueue` for CONFLATE
+        """
+        if policy == QueuePolicy.CONFLATE and not isinstance(self, ConflatingQueue):
+            raise ValueError("a conflating queue requires a key, use ConflatingQueue")
+        self.policy = policy
+        self.high_water = 0
+        self.dropped = 0
+        self._wait: LatencyHistogram | None = None
+        self._stamps: deque[int] | None = None  # put time of each pending item while recording waits
+        super().__init__(maxsize)
+
+    def record_wait(self, histogram: LatencyHistogram | None):
+        """
+        Starts recording the nanoseconds each item waits in the queue into `histogram`, or stops if None.
+        Items already pending count as put now
+        """
+        self._wait = histogram
+        self._stamps = None if histogram is None else deque([time.perf_counter_ns()] * self.qsize())
+
+    async def put(self, item):
+        if self.policy in (QueuePolicy.DROP_OLDEST, QueuePolicy.DROP_NEWEST):
+            self.put_nowait(item)  # never blocks
+            return
+        await super().put(item)
+
+    def put_nowait(self, item):
+        if self.full():
+            match self.policy:
+                case QueuePolicy.DROP_NEWEST:
+                    self.dropped += 1
+                    return
+                case QueuePolicy.DROP_OLDEST:
+                    asyncio.Queue.get_nowait(self)
+                    if self._stamps:
+                        self._stamps.popleft()
+                    self.task_done()
+                    self.dropped += 1
+        super().put_nowait(item)
+        if self._stamps is not None:
+            self._stamps.append(time.perf_counter_ns())
+        self.high_water = max(self.high_water, self.qsize())
+
+    def get_nowait(self):
+        item = super().get_nowait()
+        if self._stamps:
+            self._wait.record(time.perf_counter_ns() - self._stamps.popleft())  # type: ignore
+        return item
+
+    def stats(self) -> QueueStats:
+        return QueueStats(self.qsize(), self.maxsize, self.high_water, self.dropped)
+
+
+class ConflatingQueue(BoundedQueue):
+    """
+    A queue holding only the latest unconsumed item per key. An item put while another item with the same key
+    is pending replaces it in place, so keys are consumed in the order they first became pending, each with its
+    freshest value. Replacing never blocks, a put of a new key into a full queue waits for room.
+    Attributes:
+        conflated: number of items replaced before being consumed
+    """
+    def __init__(self, key: Callable[[object], Hashable], maxsize: int = 0):
+        """
+        Args:
+            key: maps an item to its conflation key, e.g. a quote to its (pair, market)
+            maxsize: maximal number of pending keys, unbounded if 0
+        """
+        self._key = key
+        self.conflated = 0
+        super().__init__(maxsize, QueuePolicy.CONFLATE)
+
+    async def put(self, item):
+        if self._key(item) in self._queue:
+            self.put_nowait(item)
+            return
+        await super().put(item)
+
+    def put_nowait(self, item):
+        key = self._key(item)
+        if key in self._queue:
+            self._queue[key] = item
+            self.conflated += 1
+            self.dropped += 1
+            return
+        super().put_nowait(item)
+
+    def _init(self, maxsize):
+        self._queue: OrderedDict[Hashable, object] = OrderedDict()
+
+    def _put(self, item):
+        self._queue[self._key(item)] = item
+
+    def _get(self):
+        return self._queue.popitem(last=False)[1]
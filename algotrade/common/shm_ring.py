@@ -0,0 +1,116 @@
+import struct
+from multiprocessing import shared_memory
+
+_HEADER_SIZE = 64  # head and tail on their own cache line ahead of the data
+_HEAD = struct.Struct('<Q')  # total bytes written, at offset 0
+_TAIL = struct.Struct('<Q')  # total bytes read, at offset 8
+_CAPACITY = struct.Struct('<Q')  # at offset 16
+_LENGTH = struct.Struct('<I')
+_WRAP = 0xFFFFFFFF  # record length marking that the next record starts at the beginning of the data
+_ALIGN = 8
+
+
+def _aligned(n: int) -> int:
+    return (n + _ALIGN - 1) & ~(_ALIGN - 1)
+
+
+class ShmRing:
+    """
+    A single producer single consumer ring buffer of byte records in shared memory, for passing records between
+    processes without pickling or locks. The producer only moves the head and the consumer only moves the tail, both
+    monotonic byte counters stored in the shared header. A record is its uint32 length followed by its bytes, padded
+    to 8 bytes, and is never split: when it does not fit before the end of the buffer the rest is skipped with a wrap
+    marker. Neither side ever blocks, a full ring fails `try_write` and an empty one returns None from `try_read`
+    """
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self._shm = shm
+        self._buf = shm.buf
+        (self.capacity,) = _CAPACITY.unpack_from(self._buf, 16)
+
+    @classmethod
+    def create(cls, name: str | None, capacity: int) -> 'ShmRing':
+        """
+        Args:
+            name: name of the shared memory block, chosen by the system if None
+            capacity: size of the data in bytes, rounded up to a multiple of 8
+        """
+        capacity = _aligned(capacity)
+        shm = shared_memory.SharedMemory(name, create=True, size=_HEADER_SIZE + capacity)
+        shm.buf[:_HEADER_SIZE] = bytes(_HEADER_SIZE)
+        _CAPACITY.pack_into(shm.buf, 16, capacity)
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name: str) -> 'ShmRing':
+        """
+        Attaches to a ring created by another process
+        """
+        return cls(shared_memory.SharedMemory(name))
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def try_write(self, record: bytes) -> bool:
+        """
+        Producer side.
+        Returns:
+            True if the record was written, False if the ring has no room for it
+        """
+        size = _aligned(_LENGTH.size + len(record))
+        if size > self.capacity:
+            raise ValueError(f"a record of {len(record)} bytes does not fit a ring of {self.capacity} bytes")
+        buf = self._buf
+        (head,) = _HEAD.unpack_from(buf, 0)
+        (tail,) = _TAIL.unpack_from(buf, 8)
+        pos = head % self.capacity
+        skip = self.capacity - pos if self.capacity - pos < size else 0
+        if head + skip + size - tail > self.capacity:
+            return False
+        if skip:
+            _LENGTH.pack_into(buf, _HEADER_SIZE + pos, _WRAP)
+            pos = 0
+        start = _HEADER_SIZE + pos
+        _LENGTH.pack_into(buf, start, len(record))
+        buf[start + _LENGTH.size:start + _LENGTH.size + len(record)] = record
+        _HEAD.pack_into(buf, 0, head + skip + size)  # publish the record only once it is written
+        return True
+
+    def try_read(self) -> bytes | None:
+        """
+        Consumer side.
+        Returns:
+            the oldest unread record, None if there is none
+        """
+        buf = self._buf
+        (tail,) = _TAIL.unpack_from(buf, 8)
+        (head,) = _HEAD.unpack_from(buf, 0)
+        if tail == head:
+            return None
+        pos = tail % self.capacity
+        (length,) = _LENGTH.unpack_from(buf, _HEADER_SIZE + pos)
+        if length == _WRAP:
+            tail += self.capacity - pos
+            pos = 0
+            (length,) = _LENGTH.unpack_from(buf, _HEADER_SIZE)
+        start = _HEADER_SIZE + pos + _LENGTH.size
+        record = bytes(buf[start:start + length])
+        _TAIL.pack_into(buf, 8, tail + _aligned(_LENGTH.size + length))
+        return record
+
+    def used(self) -> int:
+        """
+        Returns:
+            number of bytes written and not yet read, including padding
+        """
+        return _HEAD.unpack_from(self._buf, 0)[0] - _TAIL.unpack_from(self._buf, 8)[0]
+
+    def close(self):
+        del self._buf
+        self._shm.close()
+
+    def unlink(self):
+        """
+        Frees the shared memory block, called by the creating process once both sides are closed
+        """
+        self._shm.unlink()
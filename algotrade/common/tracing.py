@@ -0,0 +1,103 @@
+import time
+from contextvars import ContextVar
+from dataclasses import replace
+from typing import Callable, Coroutine
+
+from algotrade.common.data_models import Order, Trace
+from algotrade.common.enums import TraceStage
+from algotrade.common.histogram import LatencyHistogram
+
+# the trace of the event the running handler consumes, see `LatencyTracer.traced`
+_origin: ContextVar[Trace | None] = ContextVar('origin', default=None)
+
+
+class LatencyTracer:
+    """
+    Measures tick-to-trade latency per stage. Every message a `Connector` receives is stamped, see `Frame`, and the
+    adapter passes the stamp on in the `Trace` of the quotes and order status updates it parses. The broker stamps the
+    trace again, and orders an algorithm publishes while handling a traced event carry the trace on to the adapter,
+    which hands their payload over to be timed when the connector writes it. Each stage's nanoseconds are recorded in
+    a `LatencyHistogram`, see `TraceStage`.
+    """
+    def __init__(self, max_pending: int = 4096):
+        """
+        Args:
+            max_pending: the most payloads waiting to be sent that are kept track of, the oldest is forgotten beyond
+        """
+        self._histograms = {stage: LatencyHistogram() for stage in TraceStage}
+        self._pending: dict[object, Trace] = {}  # traces of payloads waiting to be sent, by payload
+        self._max_pending = max_pending
+
+    def on_parsed(self, recv_ns: int) -> Trace:
+        """
+        Returns:
+            the trace of an event parsed from a message received at `recv_ns`
+        """
+        now = time.monotonic_ns()
+        self._histograms[TraceStage.NETWORK_TO_PARSE].record(now - recv_ns)
+        return Trace(recv_ns, now)
+
+    def on_broker(self, trace: Trace):
+        trace.broker_ns = time.monotonic_ns()
+        self._histograms[TraceStage.PARSE_TO_BROKER].record(trace.broker_ns - trace.parsed_ns)
+
+    def traced(self, handler: Callable[..., Coroutine]) -> Callable[..., Coroutine]:
+        """
+        Returns:
+            `handler` of traced events, such that orders it publishes are attributed to the event, see `on_decision`
+        """
+        async def traced_handler(update):
+            token = _origin.set(getattr(update, 'trace', None))
+            try:
+                await handler(update)
+            finally:
+                _origin.reset(token)
+        return traced_handler
+
+    def on_decision(self, orders: list[Order]):
+        """
+        Sets the trace of `orders` published by a handler of a traced event, stamped with the decision time
+        """
+        origin = _origin.get()
+        if origin is None or origin.broker_ns is None:
+            return
+        trace = replace(origin, decision_ns=time.monotonic_ns())
+        self._histograms[TraceStage.BROKER_TO_DECISION].record(trace.decision_ns - origin.broker_ns)  # type: ignore
+        for order in orders:
+            order.trace = trace
+
+    def expect(self, payload, trace: Trace):
+        """
+        Times `payload` carrying orders of `trace` when it is sent, see `on_sent`
+        """
+        if len(self._pending) >= self._max_pending:
+            del self._pending[next(iter(self._pending))]
+        self._pending[payload] = trace
+
+    def on_sent(self, payloads: list):
+        """
+        Records the decision to wire and tick to trade latency of the expected ones of the `payloads` just written
+        """
+        if not self._pending:
+            return
+        now = time.monotonic_ns()
+        for payload in payloads:
+            trace = self._pending.pop(payload, None)
+            if trace is not None:
+                self._histograms[TraceStage.DECISION_TO_WIRE].record(now - trace.decision_ns)  # type: ignore
+                self._histograms[TraceStage.TICK_TO_TRADE].record(now - trace.recv_ns)
+
+    def discard(self, payload):
+        self._pending.pop(payload, None)
+
+    def summary(self, reset: bool = False) -> dict[TraceStage, dict]:
+        """
+        Args:
+            reset: whether to start over after taking the summary
+        Returns:
+            the summary of each stage's nanoseconds, see `LatencyHistogram.summary`
+        """
+        summary = {stage: histogram.summary() for stage, histogram in self._histograms.items()}
+        if reset:
+            self._histograms = {stage: LatencyHistogram() for stage in TraceStage}
+        return summary
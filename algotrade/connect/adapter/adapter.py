@@ -1,7 +1,7 @@
-from typing import Protocol
+from typing import Hashable, Protocol
 from uuid import UUID
 
-from algotrade.common.data_models import CurrencyPair, Order
+from algotrade.common.data_models import CurrencyPair, Frame, Order, Update
 from algotrade.common.enums import AdapterName, MarketName
 from algotrade.pubsub import PubSub
 
@@ -61,17 +61,60 @@ class Adapter(Protocol):
         """
         ...
 
-    async def on_payload_recv_in(self, payload: str):
+    async def on_book_resync(self, update: Update):
         """
-        To be performed uppon a new payload from the `Connector`
+        Requests a fresh order book snapshot of `update.pair` from `update.market` only, after the `Broker` found
+        that book out of sync
+        """
+        ...
+
+    def merge_payloads(self, payloads: list) -> list:
+        """
+        Combines payloads queued to be sent together into fewer messages, keeping their order, e.g. adjacent requests
+        of the same type into one request. Returns the payloads as they are if the external source can not combine
+        """
+        ...
+
+    def get_subscription_key(self, payload) -> Hashable | None:
+        """
+        Returns the key of the subscription a payload to send requests, e.g. the stream and pair, None if the payload
+        is no subscription. The `Connector` replays the latest payload of each key on reconnect
+        """
+        ...
+
+    def renew_subscription(self, payload):
+        """
+        Returns a subscription payload to replay on reconnect, e.g. with a fresh request id
+        """
+        ...
+
+    def is_market_data(self, payload) -> bool:
+        """
+        Returns whether a received payload is market data, used to measure the blackout of a reconnect
+        """
+        ...
+
+    async def on_payload_recv_in(self, frame: Frame):
+        """
+        To be performed uppon a new payload from the `Connector`, received at `frame.recv_ns`. Traced events parsed from
+        it carry the receive time, see `LatencyTracer`
         """
         ...
 
     async def on_connection_established(self, msg):
         ...
         """
-        To be performed when the connector established a connection. Usualy send a subpsription message back
+        To be performed when the connector established a connection. Usualy send a subpsription message back.
+        msg is None for a single `Connector`. From a `ConnectorPool` it is a callable telling whether a shard key
+        (see `get_shard_key`) is served by the established connection, send only the payloads it serves
+        """
+
+    def get_shard_key(self, payload) -> Hashable | None:
+        """
+        Returns the key by which a `ConnectorPool` shards a payload to send across its market data connections, e.g.
+        the pair of a market data subscription. None for order traffic, sent through the pool's order connection
         """
+        ...
 
     async def on_panic(self, msg: str):
         """
@@ -8,16 +8,24 @@ from uuid import UUID, uuid4
 import toml
 from loguru import logger
 
-from algotrade.common.data_models import (CurrencyPair, OrderStatusUpdate,
-                                          OrderStatusUpdateType, Trade,
-                                          Quote)
+from algotrade.common.data_models import (CurrencyPair, Frame,
+                                          OrderStatusUpdate,
+                                          OrderStatusUpdateType, Quote, Trace,
+                                          Trade, Update)
 from algotrade.common.enums import (AdapterName, AdapterTopic, Currency,
                                     MarketName, Side, TimeFormat)
+from algotrade.common.fixed_point import FixedPoint, fixed_points_from_config
 from algotrade.common.idgenerator import generate_id
+from algotrade.common.tracing import LatencyTracer
 from algotrade.config import get_config
 from algotrade.connect.adapter.adapter import Order
 from algotrade.pubsub import PubSub
 
+try:  # a faster decoder of bytes and str payloads, optional
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
+
 
 class TalosError(Exception):
     pass
@@ -38,6 +46,66 @@ class UnKnownRejReasonError(Exception):
     pass
 
 
+# requests carrying a list of orders in "data", which Talos accepts in one message
+_MERGEABLE_PREFIXES = tuple(
+    f'{{"type": "{rtype}"' for rtype in ("NewOrderSingle", "OrderCancelRequest", "OrderCancelReplaceRequest")
+)
+
+
+def peek_type(payload: str | bytes) -> str | None:
+    """
+    Returns:
+        the value of the first "type" field of a JSON payload, found by a scan rather than parsing it, None if there
+        is none. Talos puts the message type ahead of the data
+    """
+    if isinstance(payload, str):
+        key, colon, quote = '"type"', ':', '"'
+    else:
+        key, colon, quote = b'"type"', b':', b'"'
+        if isinstance(payload, memoryview):
+            payload = payload.tobytes()
+    i = payload.find(key)  # type: ignore
+    if i < 0:
+        return None
+    start = payload.find(quote, payload.find(colon, i + len(key))) + 1  # type: ignore
+    end = payload.find(quote, start)  # type: ignore
+    if start == 0 or end < 0:
+        return None
+    value = payload[start:end]
+    return value if isinstance(value, str) else value.decode()
+
+
+def merge_payloads(payloads: list[str]) -> list[str]:
+    """
+    Merges each run of adjacent order requests of the same type, and otherwise equal but for their "data", into one
+    request with the combined "data" list. Other payloads are kept as they are, in their order
+    """
+    res: list[str] = []
+    run: list[str] = []
+    run_prefix = None
+    for payload in payloads:
+        prefix = next((p for p in _MERGEABLE_PREFIXES if payload.startswith(p)), None)
+        if prefix is not None and prefix == run_prefix:
+            run.append(payload)
+            continue
+        res.extend(_merge_run(run))
+        run, run_prefix = [payload], prefix
+    res.extend(_merge_run(run))
+    return res
+
+
+def _merge_run(run: list[str]) -> list[str]:
+    if len(run) < 2:
+        return run
+    requests = [json.loads(payload) for payload in run]
+    merged = requests[0]
+    rest = {k: v for k, v in merged.items() if k != "data"}
+    if any({k: v for k, v in request.items() if k != "data"} != rest for request in requests[1:]):
+        return run
+    merged["data"] = [entry for request in requests for entry in request["data"]]
+    return [json.dumps(merged)]
+
+
 class Talos:
     """Implements Adapter"""
     
@@ -55,11 +123,14 @@ class Talos:
     def __init__(
         self, 
         ps: PubSub, 
-        config: dict
+        config: dict,
+        tracer: LatencyTracer | None = None,
     ):
         """
         Args:
             ps: `PubSub` event broker
+            tracer: traces the quotes and order status updates and times the orders of traced events, see
+                `LatencyTracer`. Not tracing if None
             config: a configuration dict with a mandatory structure (toml):
                 
                 # Markets assigned to this adapter. 
@@ -101,6 +172,16 @@ class Talos:
         if len(self._pairs) != len(self._sizes):
             raise ValueError("lengths of pairs and sizes list must equal")
         self._markets = [MarketName(str_name) for str_name in self._talos_config['markets']]
+        # pairs in fixed-point mode are converted from and to Talos' decimal strings only in this adapter:
+        self._fixed_points: dict[CurrencyPair, FixedPoint] = fixed_points_from_config(self._config)
+        # message types dropped before being parsed:
+        self._ignored_types = frozenset(self._talos_config.get('ignored_types', []))
+        self._tracer = tracer
+        self._stream_seq: dict[int, int] = {}  # last seq of each market data subscription, by reqid
+        # reqid of the market data subscription of each (pair, market) and back, to resync a single stream:
+        self._md_reqids: dict[tuple[str, str], int] = {}
+        self._md_streams: dict[int, tuple[str, str]] = {}
+        self._cancel_pairs: dict[int, str] = {}  # pair of each cancelled subscription, by reqid, until routed
         with open('secrets.toml', 'r') as f:
             self._secrets = toml.load(f)['talos']
 
@@ -120,6 +201,8 @@ class Talos:
         for order in orders:
             self._sent_uuids.add(order.uuid)
         payload = self._get_orders_payload(orders)
+        if self._tracer is not None and orders[0].trace is not None:
+            self._tracer.expect(payload, orders[0].trace)
         await self._ps.publish((AdapterTopic.PAYLOAD_OUT, self.get_name()), payload)
 
     def on_cancel_orders_out(self, uuids: list[UUID]):
@@ -137,28 +220,100 @@ class Talos:
         await self._ps.publish(self._to_connector_qid, payload)
 
     async def on_connection_established(self, msg):
+        serves = msg if callable(msg) else lambda key: True  # see `ConnectorPool`
         payloads = [
-            self._get_snapshot_subscription_payload(pair, size, generate_id())
+            self._get_snapshot_subscription_payload(pair, size, self._new_md_reqid(pair, market), markets=[market])
             for pair, size in zip(self._pairs, self._sizes)
+            if serves(pair)
+            for market in self._config["default_markets"][pair]
         ]
         for payload in payloads:
             await self._ps.publish(self._to_connector_qid, payload)
-        payload = self._get_execution_report_subscription_payload()
-        await self._ps.publish(self._to_connector_qid,  payload)
+        if serves(None):
+            payload = self._get_execution_report_subscription_payload()
+            await self._ps.publish(self._to_connector_qid,  payload)
+
+    def get_shard_key(self, payload: str) -> str | None:
+        """
+        Market data subscriptions, and cancels of them, are sharded by pair, execution reports come with the order
+        traffic
+        """
+        if payload.startswith('{"reqid"') and '"type": "cancel"' in payload:
+            return self._cancel_pairs.pop(json.loads(payload)["reqid"], None)
+        if '"MarketDataSnapshot"' not in payload:
+            return None
+        streams = json.loads(payload)["streams"]
+        return streams[0]["Symbol"] if streams else None
 
-    def on_panic(self, msg: str):
+    async def on_book_resync(self, update: Update):
+        """
+        Cancels the market data subscription of the pair on the market and subscribes it again, Talos responds with a
+        full snapshot. The pair's streams of other markets are left alone
+        """
+        pair_str, market = str(update.pair), update.market.value
+        old = self._md_reqids.get((pair_str, market))
+        if old is None:
+            return
+        reqid = self._new_md_reqid(pair_str, market)
+        self._cancel_pairs[old] = pair_str
+        await self._ps.publish(self._to_connector_qid, json.dumps({"reqid": old, "type": "cancel"}))
+        size = self._sizes[self._pairs.index(pair_str)]
+        payload = self._get_snapshot_subscription_payload(pair_str, size, reqid, markets=[market])
+        await self._ps.publish(self._to_connector_qid, payload)
+
+    def _new_md_reqid(self, pair: str, market: str) -> int:
+        """
+        Returns:
+            a fresh reqid for the market data subscription of `pair` on `market`, replacing the one it had
+        """
+        old = self._md_reqids.get((pair, market))
+        if old is not None:
+            del self._md_streams[old]
+            self._stream_seq.pop(old, None)
+        reqid = generate_id()
+        self._md_reqids[(pair, market)] = reqid
+        self._md_streams[reqid] = (pair, market)
+        return reqid
+
+    async def on_panic(self, msg: str):
         self._trading = False  # TODO better panic handling. might not be fatal. perhaps, remove the relevant exchagne
 
+    def get_subscription_key(self, payload: str) -> tuple | None:
+        """Subscriptions are keyed by their first stream's name, symbol and markets"""
+        if '"type": "subscribe"' not in payload:
+            return None
+        streams = json.loads(payload)["streams"]
+        if not streams:
+            return None
+        return streams[0]["name"], streams[0].get("Symbol"), tuple(streams[0].get("Markets", ()))
+
+    def renew_subscription(self, payload: str) -> str:
+        """Gives a replayed subscription a fresh reqid, as Talos responds by reqid"""
+        request = json.loads(payload)
+        stream = self._md_streams.get(request["reqid"])
+        request["reqid"] = generate_id() if stream is None else self._new_md_reqid(*stream)
+        return json.dumps(request)
+
+    def is_market_data(self, payload: str | bytes) -> bool:
+        return peek_type(payload) == "MarketDataSnapshot"
+
+    def merge_payloads(self, payloads: list[str]) -> list[str]:
+        return merge_payloads(payloads)
+
     async def on_payload_recv_in(
-        self, payload: str
+        self, frame: Frame | str | bytes
     ):  # with talos currently ASSUME only one market in each update when setting throtle to 1ns TODO verify
-        paylaod = json.loads(payload)
+        """Accepts text payloads and raw UTF-8 frames, see `Connector`'s raw mode, unstamped ones as well"""
+        payload, recv_ns = frame if isinstance(frame, Frame) else (frame, None)
+        if self._ignored_types and peek_type(payload) in self._ignored_types:
+            return
+        paylaod = _loads(payload)
         rtype = paylaod["type"]
         match rtype:
             case "MarketDataSnapshot":  # much more frequent than other messages makes match efficient
-                await self._handle_quote_update_payload(paylaod)
+                await self._handle_quote_update_payload(paylaod, recv_ns)
             case "ExecutionReport":
-                await self._handle_execution_report_payload(paylaod)
+                await self._handle_execution_report_payload(paylaod, recv_ns)
             case "hello":
                 self._sessionid = paylaod["session_id"]
                 logger.info("Talos says hello")
@@ -183,14 +338,14 @@ class Talos:
                     "ClOrdID": str(order.uuid),
                     "Markets": [order.market.value],
                     "OrdType": "Limit",
-                    "OrderQty": order.size,
+                    "OrderQty": self._size_out(order.pair, order.size),
                     "Side": self.SIDE_TO_TALOS[order.side],
                     "Symbol": self.CCY_TO_TALOS[order.pair.leg1]
                     + "-"
                     + self.CCY_TO_TALOS[order.pair.leg2],
                     "TimeInForce": "GoodTillCancel",
                     "SubAccount": self._talos_config["sub_account"][self._talos_config["env"]],
-                    "Price": order.limit_price,
+                    "Price": self._price_out(order.pair, order.limit_price),
                     "CancelSessionID": self._sessionid,
                 }
                 for order in orders
@@ -251,8 +406,14 @@ class Talos:
             case _:
                 raise TalosError
 
-    async def _handle_quote_update_payload(self, payload: dict):
-        """Handles a message of type MarketDataSnapshot from Talos"""
+    async def _handle_quote_update_payload(self, payload: dict, recv_ns: int | None = None):
+        """Handles a message of type MarketDataSnapshot from Talos, dropping ones not newer than the last of their stream"""
+        seq = payload.get("seq")
+        if seq is not None:
+            last = self._stream_seq.get(payload["reqid"])
+            if last is not None and seq <= last:
+                return None
+            self._stream_seq[payload["reqid"]] = seq
         stream = payload["data"][0]  # assumes length 1  TODO
         name = list(stream["Markets"])[0]
         if stream["Markets"][name]["Status"] != "Online":
@@ -263,29 +424,56 @@ class Talos:
             )
             return None
         name = next(iter(stream["Markets"].keys()))
+        pair = self._currency_pair_from_talos_symbol(stream["Symbol"])
         quote_update = Quote(
-            bid_price=float(
-                stream["Bids"][1]["VWAP"]
+            bid_price=self._vwap_in(
+                pair, stream["Bids"][1]["VWAP"], Side.BUY
             ),  # assume here if the market is online talos sends non empty bids
-            ask_price=float(stream["Offers"][1]["VWAP"]),
-            tob_bid_price=float(stream["Bids"][0]["VWAP"]),
-            tob_ask_price=float(stream["Offers"][0]["VWAP"]),
+            ask_price=self._vwap_in(pair, stream["Offers"][1]["VWAP"], Side.SELL),
+            tob_bid_price=self._vwap_in(pair, stream["Bids"][0]["VWAP"], Side.BUY),
+            tob_ask_price=self._vwap_in(pair, stream["Offers"][0]["VWAP"], Side.SELL),
             market=MarketName(name),
-            pair=self._currency_pair_from_talos_symbol(stream["Symbol"]),
-            size=float(stream["Bids"][1]["Size"]),
+            pair=pair,
+            size=self._size_in(pair, stream["Bids"][1]["Size"]),
             timestamp=datetime.strptime(
                 stream["ExchangeTime"], TimeFormat.ISO_8601_UTC.value
             ),
+            sequence=seq,
+            trace=self._trace(recv_ns),
         )
         await self._ps.publish(AdapterTopic.QUOTE_UPDATE, quote_update)
 
+    def _trace(self, recv_ns: int | None) -> Trace | None:
+        return None if self._tracer is None or recv_ns is None else self._tracer.on_parsed(recv_ns)
+
+    def _vwap_in(self, pair: CurrencyPair, vwap: str, side: Side) -> float | int:
+        """
+        Converts the VWAP of a Talos size bucket, an average usually off the tick grid, to ticks rounded to the
+        passive side (see `FixedPoint.round_ticks`) for pairs in fixed-point mode and to a float otherwise
+        """
+        fixed = self._fixed_points.get(pair)
+        return float(vwap) if fixed is None else fixed.round_ticks(float(vwap) / fixed.tick, side)
+
+    def _size_in(self, pair: CurrencyPair, size: str) -> float | int:
+        """Converts a Talos size to lots for pairs in fixed-point mode and to a float otherwise"""
+        fixed = self._fixed_points.get(pair)
+        return float(size) if fixed is None else fixed.to_lots(size)
+
+    def _price_out(self, pair: CurrencyPair, price: float | int) -> float:
+        fixed = self._fixed_points.get(pair)
+        return price if fixed is None else fixed.from_ticks(price)  # type: ignore
+
+    def _size_out(self, pair: CurrencyPair, size: float | int) -> float:
+        fixed = self._fixed_points.get(pair)
+        return size if fixed is None else fixed.from_lots(size)  # type: ignore
+
     def _currency_pair_from_talos_symbol(self, symbol: str):
         return CurrencyPair(
                 Currency(symbol.split("-")[0].lower()),
                 Currency(symbol.split("-")[1].lower()),
         )
 
-    async def _handle_execution_report_payload(self, payload: dict):
+    async def _handle_execution_report_payload(self, payload: dict, recv_ns: int | None = None):
         # TODO: UGLY FUNCTION!!! Make beautiful
         if not payload["data"]:
             return
@@ -329,12 +517,14 @@ class Talos:
                     resd["update_type"] = OrderStatusUpdateType.GENERAL_INFO
                     resd["comment"] = "talos order status is {}".format(data["OrdStatus"])  # type: ignore
             # resd['order']  self._create_order(payload)
-            resd['size'] = data['OrderQty']
-            resd['cum_filled_size'] = data['CumQty']
+            pair = self._currency_pair_from_talos_symbol(data["Symbol"])
+            resd['size'] = self._size_in(pair, data['OrderQty'])
+            resd['cum_filled_size'] = self._size_in(pair, data['CumQty'])
             resd['cum_filled_amount'] = data['CumAmt']
             resd['cum_fee'] = data['CumTalosFee']
             resd['side'] = data['Side'].lower()
             resd['live'] =  data['OrdStatus'] in self._live_strings
+            resd['trace'] = self._trace(recv_ns)
             update = OrderStatusUpdate(**resd)
             await self._ps.publish(AdapterTopic.ORDER_UPDATE, update)
 
@@ -396,7 +586,10 @@ class Talos:
         return header
 
 
-    def _get_snapshot_subscription_payload(self,pair: str, size: float, reqid: int, **kw) -> str:
+    def _get_snapshot_subscription_payload(
+        self, pair: str, size: float, reqid: int, markets: list[str] | None = None, **kw
+    ) -> str:
+        """One stream per market, of `markets` or of the pair's default markets"""
         subscription_payload = {
             "reqid": reqid,
             "type": "subscribe",
@@ -409,7 +602,7 @@ class Talos:
                     "SizeBuckets": [0, str(size)],
                     "FeeMode": "Taker",  # this does NOT include Talos fee
                 }
-                for name in self._config["default_markets"][pair]
+                for name in (markets if markets is not None else self._config["default_markets"][pair])
             ],
         }
         return json.dumps(subscription_payload)
@@ -1,13 +1,21 @@
 import asyncio
 import dataclasses
+import time
 from random import uniform
-from typing import Callable, Protocol
+from typing import Callable, Hashable, Protocol
 
 import websockets
 from loguru import logger
-from websockets.exceptions import ConnectionClosedError
+from websockets.exceptions import (ConnectionClosed, ProtocolError,
+                                   WebSocketException)
+from websockets.frames import Opcode
+from websockets.legacy.client import WebSocketClientProtocol
 
-from algotrade.common.enums import AdapterName, ConnectorTopic
+from algotrade.common.data_models import Frame
+from algotrade.common.enums import AdapterName, ConnectorTopic, QueuePolicy
+from algotrade.common.histogram import LatencyHistogram
+from algotrade.common.queues import BoundedQueue, QueueStats
+from algotrade.common.tracing import LatencyTracer
 from algotrade.pubsub import PubSub
 
 
@@ -18,6 +26,72 @@ class HeaderGenerator(Protocol):
         """
         ...
 
+@dataclasses.dataclass(frozen=True)
+class ConnectionStats:
+    """
+    Attributes:
+        connected: whether the websocket is open
+        connects: number of times the websocket was opened
+        disconnects: number of times the websocket was lost
+        sent: number of messages sent
+        received: number of messages received
+        send_rate: messages sent per second since the stats were started or last reset
+        receive_rate: messages received per second since the stats were started or last reset
+        idle: seconds since the last message was received, None if none was
+        last_blackout: seconds from the last disconnect until market data was received again, None if not yet
+        blackout_ns: summary (see `LatencyHistogram.summary`) of the nanoseconds from each disconnect until market
+            data was received again
+    """
+    connected: bool
+    connects: int
+    disconnects: int
+    sent: int
+    received: int
+    send_rate: float
+    receive_rate: float
+    idle: float | None
+    last_blackout: float | None
+    blackout_ns: dict
+
+
+def backoff_delay(attempt: int, min_backoff: float, max_backoff: float) -> float:
+    """
+    Returns:
+        seconds to wait before reconnect attempt number `attempt` (from 1) after a disconnect: 0 for the first, then
+        doubling from min_backoff up to max_backoff, less a random jitter of up to half of it
+    """
+    if attempt <= 1:
+        return 0.0
+    delay = min(max_backoff, min_backoff * 2 ** (attempt - 2))
+    return uniform(delay / 2, delay)
+
+
+class RawFramesProtocol(WebSocketClientProtocol):
+    """
+    A websocket client protocol receiving text messages as their undecoded UTF-8 bytes, like binary ones, for
+    adapters decoding bytes directly
+    """
+    async def read_message(self) -> bytes | None:
+        frame = await self.read_data_frame(max_size=self.max_size)
+        if frame is None:  # a close frame was received
+            return None
+        if frame.opcode not in (Opcode.TEXT, Opcode.BINARY):
+            raise ProtocolError("unexpected opcode")
+        if frame.fin:  # not fragmented, the common case
+            return frame.data
+        chunks = [frame.data]
+        size = len(frame.data)
+        while not frame.fin:
+            frame = await self.read_data_frame(max_size=None if self.max_size is None else self.max_size - size)
+            if frame is None:
+                raise ProtocolError("incomplete fragmented message")
+            if frame.opcode != Opcode.CONT:
+                raise ProtocolError("unexpected opcode")
+            chunks.append(frame.data)
+            size += len(frame.data)
+        return b''.join(chunks)
+
+
 @dataclasses.dataclass
 class Connector:
     """
@@ -30,54 +104,269 @@ class Connector:
         adapter_name: AdapterName,
         ps: PubSub,
         generate_headers: Callable[..., dict] | None = None,
+        out_queue_size: int = 1024,
+        merge_payloads: Callable[[list], list] | None = None,
+        max_send_batch: int = 64,
+        established_msg: object = None,
+        get_subscription_key: Callable[[object], Hashable | None] | None = None,
+        is_market_data: Callable[[object], bool] | None = None,
+        min_backoff: float = 0.1,
+        max_backoff: float = 10.0,
+        healthy_after: float = 5.0,
+        renew_subscription: Callable[[object], object] | None = None,
+        raw: bool = False,
+        tracer: LatencyTracer | None = None,
     ):
         """ 
             H+eader can be required to be dynamically generated and updated when reconnecting in case of a dissconnect            
             Returns the name of the adapter which the connector is communicating with
+            out_queue_size: maximal number of payloads waiting to be sent, publishers of more wait for room.
+                Unbounded if 0
+            merge_payloads: combines a batch of payloads to send into fewer messages, e.g. `Adapter.merge_payloads`.
+                The batch is sent as is if None
+            max_send_batch: maximal number of queued payloads taken at once and written back to back, 1 sends
+                payloads one by one
+            established_msg: the data of the CONNECTION_ESTABLISHED events of this connector, see `ConnectorPool`
+            get_subscription_key: maps a sent payload to the key of the subscription it requests, None if it is no
+                subscription, e.g. `Adapter.get_subscription_key`. The latest sent payload of each key is replayed on
+                reconnect, in place of publishing CONNECTION_ESTABLISHED again. Without it every (re)connect is
+                published
+            is_market_data: tells whether a received payload is market data, e.g. `Adapter.is_market_data`,
+                to measure the market data blackout of each reconnect
+            min_backoff: seconds to wait before the second reconnect attempt, the first is immediate
+            max_backoff: the most seconds to wait between reconnect attempts
+            healthy_after: seconds a connection must have been up to start the backoff over when it is lost. A
+                connection dropped sooner, e.g. on a rate limit or a bad login, counts as a failed attempt
+            renew_subscription: returns a subscription payload to replay, e.g. with a fresh request id, see
+                `Adapter.renew_subscription`. Replayed as is if None
+            raw: whether to publish received messages as bytes, without decoding text messages, see
+                `RawFramesProtocol`. The adapter must accept bytes payloads
+            tracer: times the sending of the payloads it expects, see `LatencyTracer`
         """
         self._uri = uri
-        self._out_q = asyncio.Queue()
+        self._out_q = BoundedQueue(out_queue_size, QueuePolicy.BLOCK)
         self._ps = ps
         self._generate_headers = generate_headers
         self._adapter_name = adapter_name
         self._connected = asyncio.Future()
+        self._merge_payloads = merge_payloads
+        self._max_send_batch = max_send_batch
+        self._established_msg = established_msg
+        self._is_connected = False
+        self._connects = 0
+        self._disconnects = 0
+        self._sent = 0
+        self._received = 0
+        self._last_received: float | None = None
+        self._stats_since = time.monotonic()
+        self._sent_since = self._received_since = 0  # counts when the stats were last reset
+        self._get_subscription_key = get_subscription_key
+        self._subscriptions: dict[Hashable, object] = {}  # latest sent payload of each subscription
+        self._is_market_data = is_market_data
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._healthy_after = healthy_after
+        self._renew_subscription = renew_subscription
+        self._disconnected_at: int | None = None  # monotonic ns of the disconnect while waiting for market data
+        self._blackouts = LatencyHistogram()
+        self._last_blackout: float | None = None
+        self._raw = raw
+        self._tracer = tracer
+        self._unsent: list = []  # payloads taken off the queue whose sending failed, sent first on reconnect
 
     async def connect(self):
         i = 0
         while True:
+            opened_at = None
             extra_headers = self._generate_headers() if self._generate_headers is not None else None # type: ignore
             try:
-                async with websockets.connect(uri=self._uri, extra_headers=extra_headers) as ws:  # type: ignore
-                    self._connected.set_result(True)
-                    i = 0
+                async with websockets.connect(  # type: ignore
+                    uri=self._uri,
+                    extra_headers=extra_headers,
+                    create_protocol=RawFramesProtocol if self._raw else None,
+                ) as ws:
+                    if not self._connected.done():
+                        self._connected.set_result(True)
+                    opened_at = time.monotonic()
+                    self._is_connected = True
+                    self._connects += 1
                     # init_response = await ws.recv()
-                    await self._ps.publish((ConnectorTopic.CONNECTION_ESTABLISHED, self._adapter_name), None)
-                    await self._run_socket(ws)  # runs forever
-            except (ConnectionClosedError, websockets.exceptions.InvalidStatusCode) as e:  # type: ignore
-                sleep = uniform(0.3, 5)
-                _log_disconnection_info(self._uri, extra_headers, sleep, i + 1, e)
-                await asyncio.sleep(sleep)
+                    if self._subscriptions:  # a reconnect, restore the subscriptions at once
+                        if self._renew_subscription is not None:
+                            self._subscriptions = {
+                                key: self._renew_subscription(payload) for key, payload in self._subscriptions.items()
+                            }
+                        await self._send_batch(ws, list(self._subscriptions.values()), keep_unsent=False)
+                        logger.info(f"{self._uri}: reconnected, replayed {len(self._subscriptions)} subscriptions")
+                    else:
+                        await self._ps.publish(
+                            (ConnectorTopic.CONNECTION_ESTABLISHED, self._adapter_name), self._established_msg
+                        )
+                    await self._run_socket(ws)  # runs until the connection is lost
+            except (WebSocketException, OSError) as e:
+                if self._is_connected:
+                    self._is_connected = False
+                    self._disconnects += 1
+                    if self._is_market_data is not None and self._disconnected_at is None:
+                        self._disconnected_at = time.monotonic_ns()
+                if opened_at is not None and time.monotonic() - opened_at >= self._healthy_after:
+                    i = 0  # the connection was healthy, start the backoff over
                 i += 1
-            
+                sleep = backoff_delay(i, self._min_backoff, self._max_backoff)
+                _log_disconnection_info(self._uri, extra_headers, sleep, i, e)
+                await asyncio.sleep(sleep)
 
     async def on_payload_out(self, payload):
         await self._out_q.put(payload)
 
+    async def discard_out(self):
+        """
+        Consumes the payloads to send without sending them, run instead of `connect` when replaying a journal
+        """
+        while True:
+            payload = await self._out_q.get()
+            if self._tracer is not None:
+                self._tracer.discard(payload)
+
     async def connected(self):
         return self._connected
 
+    def get_adapter_name(self) -> AdapterName:
+        return self._adapter_name
+
+    def queue_stats(self) -> QueueStats:
+        return self._out_q.stats()
+
+    def connection_stats(self, reset: bool = False) -> ConnectionStats:
+        """
+        Args:
+            reset: whether to start measuring the rates over after taking the stats
+        """
+        now = time.monotonic()
+        elapsed = max(now - self._stats_since, 1e-9)
+        stats = ConnectionStats(
+            connected=self._is_connected,
+            connects=self._connects,
+            disconnects=self._disconnects,
+            sent=self._sent,
+            received=self._received,
+            send_rate=(self._sent - self._sent_since) / elapsed,
+            receive_rate=(self._received - self._received_since) / elapsed,
+            idle=None if self._last_received is None else now - self._last_received,
+            last_blackout=self._last_blackout,
+            blackout_ns=self._blackouts.summary(),
+        )
+        if reset:
+            self._stats_since = now
+            self._sent_since, self._received_since = self._sent, self._received
+        return stats
+
     async def _run_socket(self, ws):
-        await asyncio.gather(self._run_send(ws), self._run_recieve(ws))    
+        """
+        Sends and receives until either fails, stopping the other
+        """
+        tasks = [asyncio.create_task(self._run_send(ws)), asyncio.create_task(self._run_recieve(ws))]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()  # raises the failure
+        finally:
+            for task in tasks:
+                task.cancel()
 
     async def _run_send(self, ws):
+        """
+        Sends everything queued at once: waits for a payload, takes all others queued behind it, merges them if the
+        adapter supports it and writes the messages back to back, without waiting for the queue in between.
+        The payloads of a batch that failed to be written are kept and sent first on the next connection
+        """
         while True:
-            to_send = await self._out_q.get()
-            await ws.send(to_send)
+            if self._unsent:
+                batch, self._unsent = self._unsent, []
+            else:
+                batch = [await self._out_q.get()]
+                while len(batch) < self._max_send_batch and not self._out_q.empty():
+                    batch.append(self._out_q.get_nowait())
+            await self._send_batch(ws, batch)
+
+    async def _send_batch(self, ws, batch: list, keep_unsent: bool = True):
+        """
+        Merges `batch` if the adapter supports it and writes the messages back to back.
+        Args:
+            keep_unsent: whether to keep the payloads a connection failure left unwritten, to be sent first on the
+                next connection. A message being written when the send is cancelled may already be in the
+                transport's buffer, so it counts as sent rather than risk sending e.g. an order twice
+        """
+        messages = self._merge(batch)
+        for i, message in enumerate(messages):
+            try:
+                await ws.send(message)
+            except (ConnectionClosed, OSError):
+                self._keep_unsent(batch, messages, i, keep_unsent)
+                raise
+            except asyncio.CancelledError:
+                self._sent += 1
+                self._keep_unsent(batch, messages, i + 1, keep_unsent)
+                raise
+            self._sent += 1
+        self._on_sent(batch)
+
+    def _keep_unsent(self, batch: list, messages: list, written: int, keep_unsent: bool):
+        sent = self._count_sent(batch, messages, written)
+        self._on_sent(batch[:sent])
+        if keep_unsent:
+            self._unsent = batch[sent:]
+            logger.warning(f"{self._uri}: sending failed, {len(self._unsent)} payloads wait for a reconnect")
+
+    def _merge(self, batch: list) -> list:
+        if self._merge_payloads is not None and len(batch) > 1:
+            return self._merge_payloads(batch)
+        return batch
+
+    def _count_sent(self, batch: list, messages: list, written: int) -> int:
+        """
+        Returns:
+            the number of payloads at the start of `batch` the first `written` of its merged `messages` carry.
+            Merging keeps the order of the payloads, so they are the shortest prefix merged into those messages
+        """
+        if messages is batch:
+            return written
+        for n in range(len(batch) + 1):
+            if self._merge(batch[:n]) == messages[:written]:
+                return n
+        return 0  # resend all rather than lose any
+
+    def _on_sent(self, payloads: list):
+        """
+        Bookkeeping of payloads written to the websocket: their latency trace and the subscriptions they request
+        """
+        if self._tracer is not None:
+            self._tracer.on_sent(payloads)
+        if self._get_subscription_key is not None:
+            for payload in payloads:
+                key = self._get_subscription_key(payload)
+                if key is not None:
+                    self._subscriptions[key] = payload
     
     async def _run_recieve(self, ws):
+        """
+        Publishes each received message as a `Frame` stamped with its receive time
+        """
         while True:
             payload = await ws.recv()
-            await self._ps.publish((ConnectorTopic.PAYLOAD_IN, self._adapter_name), payload)
+            recv_ns = time.monotonic_ns()
+            self._received += 1
+            self._last_received = recv_ns / 1e9
+            if self._disconnected_at is not None and self._is_market_data(payload):  # type: ignore
+                self._record_blackout()
+            await self._ps.publish((ConnectorTopic.PAYLOAD_IN, self._adapter_name), Frame(payload, recv_ns))
+
+    def _record_blackout(self):
+        blackout = time.monotonic_ns() - self._disconnected_at  # type: ignore
+        self._disconnected_at = None
+        self._blackouts.record(blackout)
+        self._last_blackout = blackout / 1e9
+        logger.info(f"{self._uri}: first market data {self._last_blackout:.3f} seconds after the disconnect")
 
 
 def _log_disconnection_info(
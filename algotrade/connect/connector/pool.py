@@ -0,0 +1,133 @@
+import asyncio
+import zlib
+from typing import Callable, Hashable
+
+from algotrade.common.enums import AdapterName
+from algotrade.common.queues import QueueStats
+from algotrade.common.tracing import LatencyTracer
+from algotrade.connect.connector.connector import ConnectionStats, Connector
+from algotrade.pubsub import PubSub
+
+ORDERS = 'orders'
+
+
+class ConnectorPool:
+    """
+    Connects an adapter through several websockets: `market_data_connections` connections sharing the market data
+    subscriptions and one connection dedicated to order traffic, such that a flood of market data neither caps nor
+    delays orders, and a reconnect only blacks out the pairs of the lost connection.
+
+    Outgoing payloads are routed by their shard key, see `Adapter.get_shard_key`: payloads without one go to the order
+    connection, the others to the market data connection the key is hashed to. Each connection publishes its
+    CONNECTION_ESTABLISHED event with a callable telling whether a shard key is served by it, so the adapter only
+    subscribes what belongs to the established connection. A reconnecting connection replays its own subscriptions. Payloads received on any connection are published as
+    the adapter's PAYLOAD_IN events, like a single `Connector`'s
+    """
+    def __init__(
+        self,
+        uri: str,
+        adapter_name: AdapterName,
+        ps: PubSub,
+        get_shard_key: Callable[[object], Hashable | None],
+        market_data_connections: int,
+        generate_headers: Callable[..., dict] | None = None,
+        merge_payloads: Callable[[list], list] | None = None,
+        get_subscription_key: Callable[[object], Hashable | None] | None = None,
+        is_market_data: Callable[[object], bool] | None = None,
+        raw: bool = False,
+        tracer: LatencyTracer | None = None,
+        renew_subscription: Callable[[object], object] | None = None,
+    ):
+        """
+        Args:
+            get_shard_key: maps a payload to send to its shard key, e.g. its pair, None for order traffic
+            market_data_connections: number of connections for market data, at least 1
+            for the rest see `Connector`
+        """
+        if market_data_connections < 1:
+            raise ValueError(f"market_data_connections {market_data_connections} must be at least 1")
+        self._adapter_name = adapter_name
+        self._get_shard_key = get_shard_key
+        self._orders = Connector(
+            uri,
+            adapter_name,
+            ps,
+            generate_headers,
+            merge_payloads=merge_payloads,
+            established_msg=self._is_order_key,
+            get_subscription_key=get_subscription_key,
+            renew_subscription=renew_subscription,
+            raw=raw,
+            tracer=tracer,
+        )
+        self._market_data = [
+            Connector(
+                uri,
+                adapter_name,
+                ps,
+                generate_headers,
+                established_msg=self._shard_filter(i),
+                get_subscription_key=get_subscription_key,
+                renew_subscription=renew_subscription,
+                is_market_data=is_market_data,
+                raw=raw,
+                tracer=tracer,
+            )
+            for i in range(market_data_connections)
+        ]
+
+    async def connect(self):
+        await asyncio.gather(*(connector.connect() for connector in self._connectors()))
+
+    async def on_payload_out(self, payload):
+        await self._route(self._get_shard_key(payload)).on_payload_out(payload)
+
+    async def discard_out(self):
+        """
+        Consumes the payloads to send without sending them, run instead of `connect` when replaying a journal
+        """
+        await asyncio.gather(*(connector.discard_out() for connector in self._connectors()))
+
+    def get_adapter_name(self) -> AdapterName:
+        return self._adapter_name
+
+    def queue_stats(self) -> dict[str, QueueStats]:
+        """
+        Returns:
+            the stats of each connection's queue of payloads to send, by connection name, see `connection_names`
+        """
+        return {name: connector.queue_stats() for name, connector in zip(self.connection_names(), self._connectors())}
+
+    def connection_stats(self, reset: bool = False) -> dict[str, ConnectionStats]:
+        """
+        Returns:
+            the health and rates of each connection by connection name, see `Connector.connection_stats`
+        """
+        return {
+            name: connector.connection_stats(reset)
+            for name, connector in zip(self.connection_names(), self._connectors())
+        }
+
+    def connection_names(self) -> list[str]:
+        """
+        Returns:
+            'orders' followed by 'market_data-<i>' for each market data connection
+        """
+        return [ORDERS] + [f'market_data-{i}' for i in range(len(self._market_data))]
+
+    def _connectors(self) -> list[Connector]:
+        return [self._orders] + self._market_data
+
+    def _shard(self, key: Hashable) -> int:
+        return zlib.crc32(str(key).encode()) % len(self._market_data)  # stable across runs, unlike hash
+
+    def _route(self, key: Hashable | None) -> Connector:
+        return self._orders if key is None else self._market_data[self._shard(key)]
+
+    def _is_order_key(self, key: Hashable | None) -> bool:
+        return key is None
+
+    def _shard_filter(self, i: int) -> Callable[[Hashable | None], bool]:
+        def serves(key: Hashable | None) -> bool:
+            return key is not None and self._shard(key) == i
+        return serves
@@ -0,0 +1,232 @@
+import asyncio
+import glob
+import queue
+import struct
+import threading
+import time
+from typing import Hashable, Iterable, Iterator
+
+from loguru import logger
+
+from algotrade.common import codec
+from algotrade.common.data_models import Frame
+from algotrade.common.enums import BrokerTopic, ConnectorTopic
+from algotrade.pubsub import ANY, PubSub
+
+_MAGIC = b'ATJ2'
+_FORMAT = struct.Struct('<I')  # `codec.FORMAT_ID` of the records
+_ENTRY = struct.Struct('<qI')  # monotonic nanoseconds, record length
+
+# events published by the connectors, everything else is derived from them by the rest of the stack
+REPLAY_TOPICS = ((ConnectorTopic.CONNECTION_ESTABLISHED,), (ConnectorTopic.PAYLOAD_IN,))
+# events recorded as the decisions of the stack
+DECISION_TOPICS = ((BrokerTopic.ORDERS_OUT,), (BrokerTopic.CANCEL_ORDERS_OUT,))
+
+
+def _matches(qid: Hashable, prefixes: Iterable[tuple]) -> bool:
+    elements = qid if isinstance(qid, tuple) else (qid,)
+    for prefix in prefixes:
+        if len(prefix) <= len(elements) and all(p is ANY or p == e for p, e in zip(prefix, elements)):
+            return True
+    return False
+
+
+def _file_path(path: str, index: int) -> str:
+    return f"{path}.{index:06d}"
+
+
+def journal_files(path: str) -> list[str]:
+    """
+    Returns:
+        the files of the journal at `path`, oldest first
+    """
+    return sorted(glob.glob(glob.escape(path) + '.' + '[0-9]' * 6))
+
+
+def read_journal(path: str) -> Iterator[tuple[int, Hashable, object]]:
+    """
+    Yields:
+        the (monotonic nanoseconds, topic, data) of every event in the journal at `path`, in publish order.
+        A record cut short by a crash ends its file
+    """
+    for file_path in journal_files(path):
+        with open(file_path, 'rb') as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"{file_path} is not a journal file")
+            (format_id,) = _FORMAT.unpack(f.read(_FORMAT.size))
+            if format_id != codec.FORMAT_ID:
+                raise ValueError(f"{file_path} was written with enums of another layout and cannot be decoded")
+            while True:
+                header = f.read(_ENTRY.size)
+                if len(header) < _ENTRY.size:
+                    break
+                ns, length = _ENTRY.unpack(header)
+                record = f.read(length)
+                if len(record) < length:
+                    logger.warning(f"journal file {file_path} ends with a partial record")
+                    break
+                topic, data = codec.decode(record)
+                yield ns, topic, data
+
+
+class Journal:
+    """
+    An append-only binary log of the events published to a `PubSub`. Each event is stamped with `time.monotonic_ns`
+    and encoded with `codec` by the publisher, the loop only queues the record, while a background thread writes
+    the records to files `<path>.000000`, `<path>.000001`, ..., starting a new file once one reaches `max_file_bytes`.
+    Existing files are never overwritten, a new journal continues after the last file
+    """
+    def __init__(
+        self,
+        path: str,
+        max_file_bytes: int = 64 * 2**20,
+        skip: Iterable[tuple] = ((BrokerTopic.CONSOLIDATED_BOOK_UPDATE,),),
+    ):
+        """
+        Args:
+            path: path prefix of the journal files
+            max_file_bytes: size after which the next file is started
+            skip: prefixes (see `Pattern`) of topics not to journal, by default the consolidated books, which are
+                live views of the books rather than events
+        """
+        self._path = path
+        self._max_file_bytes = max_file_bytes
+        self._skip = tuple(skip)
+        self._skipped: dict[Hashable, bool] = {}  # cache of whether each seen topic is skipped
+        self._failed: set[Hashable] = set()  # topics with data that could not be encoded, logged once
+        files = journal_files(path)
+        self._index = int(files[-1].rsplit('.', 1)[1]) + 1 if files else 0
+        self._records: queue.SimpleQueue[bytes | None] = queue.SimpleQueue()
+        self.written = 0
+        self._thread = threading.Thread(target=self._write, name='journal', daemon=True)
+        self._thread.start()
+
+    def attach(self, ps: PubSub):
+        """
+        Starts journaling every event published to `ps`
+        """
+        ps.add_tap(self.record)
+
+    def record(self, qid: Hashable, data: object):
+        skipped = self._skipped.get(qid)
+        if skipped is None:
+            skipped = self._skipped[qid] = _matches(qid, self._skip)
+        if skipped:
+            return
+        try:
+            record = codec.encode(qid, data)
+        except Exception:
+            if qid not in self._failed:
+                self._failed.add(qid)
+                logger.exception(f"can not journal events of {qid}")
+            return
+        self._records.put(_ENTRY.pack(time.monotonic_ns(), len(record)) + record)
+
+    def close(self):
+        """
+        Writes the queued records and stops the writer thread
+        """
+        self._records.put(None)
+        self._thread.join()
+
+    def _write(self):
+        f = None
+        try:
+            while True:
+                entry = self._records.get()
+                if entry is None:
+                    return
+                if f is None or f.tell() >= self._max_file_bytes:
+                    if f is not None:
+                        f.close()
+                    f = open(_file_path(self._path, self._index), 'xb')
+                    self._index += 1
+                    f.write(_MAGIC + _FORMAT.pack(codec.FORMAT_ID))
+                f.write(entry)
+                self.written += 1
+                if self._records.empty():
+                    f.flush()  # a burst is written in one go, a lull leaves nothing in the buffer
+        finally:
+            if f is not None:
+                f.close()
+
+
+class Replay:
+    """
+    Feeds the events of a journal back into a `PubSub`, driving a fresh stack (adapters, broker and algorithms)
+    through the recorded event stream. By default only the events published by the connectors are replayed, the rest
+    of the stack publishes everything else again. As fast as possible, each event is published once the previous one
+    was consumed throughout, so the stack sees the same sequence of events it saw live. At recorded pace, events are
+    published at their recorded time offsets, divided by `speed`. The decisions the stack publishes while replaying
+    are collected in `decisions` for comparison with the journal's, see `recorded_decisions`
+    """
+    def __init__(
+        self,
+        path: str,
+        ps: PubSub,
+        topics: Iterable[tuple] = REPLAY_TOPICS,
+        paced: bool = False,
+        speed: float = 1.0,
+        decision_topics: Iterable[tuple] = DECISION_TOPICS,
+    ):
+        """
+        Args:
+            path: path prefix of the journal files
+            ps: the `PubSub` of the stack to drive
+            topics: prefixes (see `Pattern`) of the topics to replay
+            paced: whether to publish at recorded pace instead of as fast as possible
+            speed: the pace multiplier when paced
+            decision_topics: prefixes of the topics whose events are collected in `decisions`
+        """
+        self._path = path
+        self._ps = ps
+        self._topics = tuple(topics)
+        self._paced = paced
+        self._speed = speed
+        self._decision_topics = tuple(decision_topics)
+        self.decisions: list[tuple[Hashable, object]] = []
+        self.replayed = 0
+
+    async def run(self) -> int:
+        """
+        Returns:
+            number of events replayed, once all of them were consumed
+        """
+        self._ps.add_tap(self._on_event)
+        try:
+            start_ns = first_ns = None
+            for ns, topic, data in read_journal(self._path):
+                if not _matches(topic, self._topics):
+                    continue
+                if self._paced:
+                    if first_ns is None:
+                        start_ns, first_ns = time.monotonic_ns(), ns
+                    delay = ((ns - first_ns) / self._speed - (time.monotonic_ns() - start_ns)) / 1e9  # type: ignore
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                else:
+                    await self._wait_idle()
+                if isinstance(data, Frame):  # received now, as far as latency tracing goes
+                    data = Frame(data.payload, time.monotonic_ns())
+                await self._ps.publish(topic, data)
+                self.replayed += 1
+            await self._wait_idle()
+        finally:
+            self._ps.remove_tap(self._on_event)
+        return self.replayed
+
+    def recorded_decisions(self) -> list[tuple[Hashable, object]]:
+        """
+        Returns:
+            the (topic, data) of the decisions recorded in the journal
+        """
+        return [(topic, data) for _, topic, data in read_journal(self._path) if _matches(topic, self._decision_topics)]
+
+    async def _wait_idle(self):
+        await asyncio.sleep(0)  # let consumers woken by the last event start
+        while not self._ps.idle():
+            await asyncio.sleep(0)
+
+    def _on_event(self, qid: Hashable, data: object):
+        if _matches(qid, self._decision_topics):
+            self.decisions.append((qid, data))
@@ -0,0 +1,176 @@
+from operator import neg
+from typing import Iterable, Iterator, Tuple
+
+from sortedcontainers import SortedDict
+
+from algotrade.common.data_models import CurrencyPair
+from algotrade.common.enums import MarketName, Side
+from algotrade.order_book.depth_index import (DepthIndex, walk_price_for_size,
+                                              walk_vwap_for_size)
+from algotrade.order_book.order_book import (OrderBook,
+                                             OrderBookMissingLevelError)
+
+
+class ConsolidatedBook:
+    """
+    The order books of one pair on all markets, merged level by level. Each consolidated level holds the total size
+    at its price and the size each market contributes to it.
+    It is maintained incrementally from the levels each market update touched, so keeping it is O(log n) per
+    changed level regardless of the number of markets.
+    Levels a market's book drops by itself (e.g. by a depth cap) are kept until that market's next snapshot.
+    """
+    def __init__(self, pair: CurrencyPair, tick_size: float | None = None):
+        """
+        Args:
+            pair: the pair of the merged books
+            tick_size: when given, a cumulative `DepthIndex` on this tick grid is maintained per side, making
+                `price_for_size` and `vwap_for_size` O(log n) rather than a walk of the levels
+        Attributes:
+            levels: per side, a sorted dictionary that maps a price level to the total size at this level,
+                best level last
+            venues: per side, maps a price level to the size of each market at this level
+            market_levels: per market and side, the price levels the market has a size at
+            books: the book of each market, used for per market queries
+            depth: per side, the cumulative depth index of the consolidated levels, None without a tick size
+        """
+        self.pair = pair
+        self._levels = {Side.BUY: SortedDict(), Side.SELL: SortedDict(neg)}
+        self._venues: dict[Side, dict[float, dict[MarketName, float]]] = {Side.BUY: {}, Side.SELL: {}}
+        self._market_levels: dict[MarketName, dict[Side, set[float]]] = {}
+        self._books: dict[MarketName, OrderBook] = {}
+        self._depth = {side: DepthIndex(side, tick_size) for side in Side} if tick_size is not None else None
+
+    def on_market_update(
+        self,
+        market: MarketName,
+        book: OrderBook,
+        bids: Iterable[float] = (),
+        asks: Iterable[float] = (),
+        snapshot: bool = False
+    ):
+        """
+        Brings the levels of `market` up to date with its book after an update
+        Args:
+            market: the market the update came from
+            book: the book of `market`, already updated
+            bids: the bid price levels the update touched
+            asks: the ask price levels the update touched
+            snapshot: True if the update replaced the whole book, in which case all of its levels are taken
+        """
+        self._books[market] = book
+        if snapshot:
+            self.remove_market(market)
+            for side in Side:
+                for price, size in book.iter_levels(side):
+                    self._set(market, side, price, size)
+            return
+        for side, prices in ((Side.BUY, bids), (Side.SELL, asks)):
+            for price in prices:
+                self._set(market, side, price, book.get_size(side, price))
+
+    def remove_market(self, market: MarketName):
+        """
+        Removes all levels of `market`, e.g. when its book is cleared. Costs O(log n) per level of the market
+        """
+        levels = self._market_levels.get(market)
+        if levels is None:
+            return
+        for side, prices in levels.items():
+            for price in list(prices):
+                self._set(market, side, price, 0.0)
+        del self._market_levels[market]
+
+    def has_tob(self, side: Side) -> bool:
+        return bool(self._levels[side])
+
+    def get_tob(self, side: Side) -> Tuple[float, float]:
+        """
+        Returns:
+            the best (price level, total size) on side `side` across all markets
+        """
+        if not self._levels[side]:
+            raise OrderBookMissingLevelError(f"no levels on the {side.value} side")
+        return self._levels[side].peekitem(-1)
+
+    def nbbo(self) -> Tuple[float | None, float | None]:
+        """
+        Returns:
+            the best bid and best ask prices across all markets, None for an empty side
+        """
+        return tuple(self._levels[side].peekitem(-1)[0] if self._levels[side] else None for side in Side)  # type: ignore
+
+    def get_venues(self, side: Side, price: float) -> dict[MarketName, float]:
+        """
+        Returns:
+            the size each market has at price level `price` on side `side`
+        """
+        return dict(self._venues[side].get(price, {}))
+
+    def get_size(self, side: Side, price: float) -> float:
+        return self._levels[side].get(price, 0.0)
+
+    def iter_levels(self, side: Side) -> Iterator[Tuple[float, float]]:
+        """
+        Yields the consolidated (price level, total size) pairs of side `side` from the top of the book down
+        """
+        sd = self._levels[side]
+        for level in reversed(sd):
+            yield level, sd[level]
+
+    def price_for_size(self, side: Side, size: float) -> float | None:
+        """
+        Returns:
+            the price of the worst level reached when sweeping `size` from the top of side `side` on all markets,
+            None if the side holds less than `size`
+        """
+        if self._depth is not None:
+            return self._depth[side].price_for_size(size)
+        return walk_price_for_size(self.iter_levels(side), size)
+
+    def vwap_for_size(self, side: Side, size: float) -> float | None:
+        """
+        Returns:
+            the volume weighted average price of sweeping `size` from the top of side `side` on all markets,
+            None if the side holds less than `size`
+        """
+        if self._depth is not None:
+            return self._depth[side].vwap_for_size(size)
+        return walk_vwap_for_size(self.iter_levels(side), size)
+
+    def best_venue_for_size(self, side: Side, size: float) -> Tuple[MarketName, float] | None:
+        """
+        Args:
+            side: the side of the books to sweep, i.e. Side.BUY to sell `size` into the bids
+            size: the size to fill on a single market
+        Returns:
+            the market with the best VWAP for sweeping `size` from side `side` and that VWAP,
+            None if no single market holds `size`. Costs one `vwap_for_size` query per market, O(log n) each on
+            markets whose books keep a depth index (see `book_factory`)
+        """
+        best = None
+        for market, book in self._books.items():
+            vwap = book.vwap_for_size(side, size)
+            if vwap is None:
+                continue
+            if best is None or (vwap > best[1] if side == Side.BUY else vwap < best[1]):
+                best = (market, vwap)
+        return best
+
+    def _set(self, market: MarketName, side: Side, price: float, size: float):
+        venues = self._venues[side].setdefault(price, {})
+        venues.pop(market, None)
+        prices = self._market_levels.setdefault(market, {Side.BUY: set(), Side.SELL: set()})[side]
+        if size > 0:
+            venues[market] = size
+            prices.add(price)
+        else:
+            prices.discard(price)
+        if venues:
+            # summed over the few markets of the level rather than adjusted, to not accumulate rounding errors
+            total = self._levels[side][price] = sum(venues.values())
+        else:
+            del self._venues[side][price]
+            self._levels[side].pop(price, None)
+            total = 0.0
+        if self._depth is not None:
+            self._depth[side].set(price, total)
@@ -0,0 +1,244 @@
+from decimal import Decimal
+from math import ceil, floor
+from typing import Iterable, Tuple
+
+from algotrade.common.enums import Side
+
+# relative tolerance for comparing cumulative sizes, which carry floating point summation errors
+_EPS = 1e-9
+# fewest level removals between two checks whether the grid should shrink
+_SHRINK_CHECK_MIN_REMOVALS = 64
+
+
+class _Fenwick:
+    """
+    A Fenwick (binary indexed) tree of floats: point add, prefix sum and prefix sum search in O(log n)
+    """
+
+    def __init__(self, n: int):
+        self._n = n
+        self._tree = [0.0] * (n + 1)
+
+    def add(self, i: int, value: float):
+        """
+        Adds `value` at (0-based) position i
+        """
+        i += 1
+        tree, n = self._tree, self._n
+        while i <= n:
+            tree[i] += value
+            i += i & -i
+
+    def prefix(self, i: int) -> float:
+        """
+        Returns the sum of positions [0, i)
+        """
+        res = 0.0
+        tree = self._tree
+        while i > 0:
+            res += tree[i]
+            i -= i & -i
+        return res
+
+    def search(self, target: float) -> int:
+        """
+        Returns the smallest position i such that the sum of positions [0, i] reaches `target`
+        (n if the total is smaller than `target`)
+        """
+        pos, rem = 0, target - _EPS * abs(target)
+        tree, n = self._tree, self._n
+        step = 1 << (n.bit_length() - 1) if n else 0
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] < rem:
+                pos = nxt
+                rem -= tree[nxt]
+            step >>= 1
+        return pos
+
+
+class DepthIndex:
+    """
+    A cumulative depth index of one side of an order book. Levels are placed on a tick grid ordered from
+    the best price end, and two Fenwick trees hold the size and notional of each level, such that
+    size-to-price queries (sweep price, VWAP, depth up to a price) are O(log n) and a level change is O(log n).
+    The grid is re-anchored (and grown) when a level falls outside of it, and shrunk back once the levels span
+    a small part of it, e.g. after a far-off level was removed, such that a single outlier does not slow down
+    all later queries. Depth capped books (see `L2OrderBook` max_depth) remove their dropped levels from it too.
+    """
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, side: Side, tick_size: float, capacity: int = INITIAL_CAPACITY):
+        """
+        Args:
+            side: the side of the book this index is of
+            tick_size: the pair's minimal price increment. Prices are rounded to it
+            capacity: initial number of ticks in the grid, the grid grows as needed
+        """
+        if tick_size <= 0:
+            raise ValueError(f"tick size {tick_size} must be positive")
+        self._is_bid = side == Side.BUY
+        self._tick_size = tick_size
+        self._decimals = max(0, -Decimal(str(tick_size)).as_tuple().exponent)  # type: ignore
+        self._sizes: dict[int, float] = {}  # tick -> size
+        self._min_capacity = capacity
+        self._removals = 0  # since the grid was last checked for shrinking
+        self._reset(capacity, None)
+
+    def set(self, price: float, size: float):
+        """
+        Sets the size at price level `price`, a zero size removes the level
+        """
+        tick = round(price / self._tick_size)
+        delta = size - self._sizes.get(tick, 0.0)
+        if delta == 0:
+            return
+        if size == 0:
+            del self._sizes[tick]
+        else:
+            self._sizes[tick] = size
+        pos = self._pos(tick)
+        if not 0 <= pos < self._capacity:
+            self._rebuild(self._capacity)
+            return
+        self._size_tree.add(pos, delta)
+        self._notional_tree.add(pos, delta * tick)
+        if size == 0:
+            self._removals += 1
+            # the O(n) check runs once per n removals, n the number of levels, so it is amortized O(1)
+            if self._removals >= max(len(self._sizes), _SHRINK_CHECK_MIN_REMOVALS):
+                self._shrink()
+
+    def clear(self):
+        self._sizes.clear()
+        self._removals = 0
+        self._reset(self._min_capacity, None)
+
+    def total_size(self) -> float:
+        return self._size_tree.prefix(self._capacity)
+
+    def price_for_size(self, size: float) -> float | None:
+        """
+        Returns:
+            the price of the worst level reached when sweeping `size` from the top of the book,
+            None if the side holds less than `size`
+        """
+        pos = self._sweep_pos(size)
+        return None if pos is None else self._price(pos)
+
+    def vwap_for_size(self, size: float) -> float | None:
+        """
+        Returns:
+            the volume weighted average price paid for sweeping `size` from the top of the book,
+            None if the side holds less than `size`
+        """
+        pos = self._sweep_pos(size)
+        if pos is None:
+            return None
+        size_before = self._size_tree.prefix(pos)
+        notional_before = self._notional_tree.prefix(pos) * self._tick_size
+        return (notional_before + (size - size_before) * self._price(pos)) / size
+
+    def size_through(self, price: float) -> float:
+        """
+        Returns:
+            the cumulative size of all levels at `price` or better
+        """
+        if self._anchor is None:
+            return 0.0
+        ticks = price / self._tick_size
+        pos = self._pos(ceil(ticks - _EPS) if self._is_bid else floor(ticks + _EPS))
+        return self._size_tree.prefix(min(pos + 1, self._capacity)) if pos >= 0 else 0.0
+
+    def _sweep_pos(self, size: float) -> int | None:
+        if size <= 0:
+            raise ValueError(f"size {size} must be positive")
+        pos = self._size_tree.search(size)
+        return pos if pos < self._capacity else None
+
+    def _pos(self, tick: int) -> int:
+        if self._anchor is None:
+            return -1
+        return self._anchor - tick if self._is_bid else tick - self._anchor
+
+    def _price(self, pos: int) -> float:
+        tick = self._anchor - pos if self._is_bid else self._anchor + pos  # type: ignore
+        return round(tick * self._tick_size, self._decimals)
+
+    def _reset(self, capacity: int, anchor: int | None):
+        self._capacity = capacity
+        self._anchor = anchor
+        self._size_tree = _Fenwick(capacity)
+        self._notional_tree = _Fenwick(capacity)
+
+    def _shrink(self):
+        """
+        Rebuilds the grid at the smallest capacity that fits the current levels if they span a quarter of it or less
+        """
+        self._removals = 0
+        if self._capacity <= self._min_capacity:
+            return
+        span = max(self._sizes) - min(self._sizes) + 1 if self._sizes else 0
+        if 4 * span <= self._capacity:
+            self._rebuild(self._min_capacity)
+
+    def _rebuild(self, capacity: int):
+        """
+        Re-anchors the grid around all current levels, growing it from `capacity` if needed, and re-inserts
+        the levels
+        """
+        if not self._sizes:
+            self._reset(capacity, None)
+            return
+        lo, hi = min(self._sizes), max(self._sizes)
+        span = hi - lo + 1
+        while capacity < 2 * span:
+            capacity *= 2
+        margin = (capacity - span) // 2
+        self._reset(capacity, hi + margin if self._is_bid else lo - margin)
+        for tick, size in self._sizes.items():
+            pos = self._pos(tick)
+            self._size_tree.add(pos, size)
+            self._notional_tree.add(pos, size * tick)
+
+
+def walk_price_for_size(levels: Iterable[Tuple[float, float]], size: float) -> float | None:
+    """
+    `DepthIndex.price_for_size` by walking `levels` ((price, size) pairs from the top of the book down)
+    """
+    if size <= 0:
+        raise ValueError(f"size {size} must be positive")
+    left = size - _EPS * size
+    for price, level_size in levels:
+        left -= level_size
+        if left <= 0:
+            return price
+    return None
+
+
+def walk_vwap_for_size(levels: Iterable[Tuple[float, float]], size: float) -> float | None:
+    """
+    `DepthIndex.vwap_for_size` by walking `levels` ((price, size) pairs from the top of the book down)
+    """
+    if size <= 0:
+        raise ValueError(f"size {size} must be positive")
+    left, notional = size, 0.0
+    for price, level_size in levels:
+        take = min(left, level_size)
+        notional += take * price
+        left -= take
+        if left <= _EPS * size:
+            return notional / (size - left)
+    return None
+
+
+def walk_size_through(levels: Iterable[Tuple[float, float]], side: Side, price: float) -> float:
+    """
+    `DepthIndex.size_through` by walking `levels` ((price, size) pairs from the top of the book down)
+    """
+    res = 0.0
+    for level, level_size in levels:
+        if (level < price) if side == Side.BUY else (level > price):
+            break
+        res += level_size
+    return res
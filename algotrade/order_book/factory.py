@@ -0,0 +1,101 @@
+from functools import partial
+from typing import Callable
+
+from algotrade.common.data_models import CurrencyPair, currency_pair_from_str
+from algotrade.common.enums import MarketName
+from algotrade.order_book.order_book import L2OrderBook, OrderBook
+from algotrade.order_book.tick_order_book import TickL2OrderBook
+
+BookFactory = Callable[[], OrderBook]
+
+
+class UnknownBookBackendError(Exception):
+    pass
+
+
+BookFactoryKey = CurrencyPair | tuple[CurrencyPair, MarketName]
+
+
+def book_factory(
+    backend: str = 'sorted', 
+    tick_size: float | None = None, 
+    depth_index: bool = False,
+    max_depth: int | None = None,
+    depth_reserve: int = 0,
+    window: int | None = None,
+) -> BookFactory:
+    """
+    Args:
+        backend: 'sorted' for an `L2OrderBook` or 'tick' for a `TickL2OrderBook`
+        tick_size: the pair's minimal price increment, mandatory for the 'tick' backend or with depth_index
+        depth_index: whether books maintain a cumulative depth index for O(log n) sweep/VWAP/depth queries
+        max_depth: number of levels per side the books keep, unbounded when None
+        depth_reserve: levels kept beyond max_depth to absorb deletions near the top
+        window: number of ticks from the top of each side the books span, unbounded when None. 'tick' backend only
+    Returns:
+        a callable creating a new empty order book of the requested backend
+    """
+    if (backend == 'tick' or depth_index) and tick_size is None:
+        raise ValueError("a tick_size is required for the 'tick' book backend or a depth index")
+    if backend != 'tick' and window is not None:
+        raise ValueError("window is only supported by the 'tick' book backend")
+    match backend:
+        case 'sorted':
+            return partial(
+                L2OrderBook, 
+                tick_size if depth_index else None, 
+                max_depth=max_depth, 
+                depth_reserve=depth_reserve,
+            )
+        case 'tick':
+            return partial(
+                TickL2OrderBook, 
+                tick_size, 
+                depth_index=depth_index, 
+                max_depth=max_depth, 
+                depth_reserve=depth_reserve, 
+                window=window,
+            )
+        case _:
+            raise UnknownBookBackendError(f"unknown order book backend: {backend}")
+
+
+def book_factories_from_config(config: dict) -> dict[BookFactoryKey, BookFactory]:
+    """
+    Args:
+        config: global config dictionary. Pairs listed under an optional [order_book] table, with optional
+            per-market overrides of the pair's parameters, e.g.:
+
+            [order_book.BTC-EUR]
+            backend = 'sorted'
+            max_depth = 25
+
+            [order_book.BTC-EUR.markets.kraken]
+            max_depth = 100
+
+    Returns:
+        a map from each configured pair, and from each (pair, market) with overrides, to the factory of its books
+    """
+    res: dict[BookFactoryKey, BookFactory] = {}
+    for pair_str, params in config.get('order_book', {}).items():
+        pair = currency_pair_from_str(pair_str)
+        params = dict(params)
+        markets = params.pop('markets', {})
+        res[pair] = book_factory(**params)
+        for market, overrides in markets.items():
+            res[(pair, MarketName(market))] = book_factory(**(params | overrides))
+    return res
+
+
+def consolidated_tick_sizes_from_config(config: dict) -> dict[CurrencyPair, float]:
+    """
+    Args:
+        config: global config dictionary, see `book_factories_from_config`
+    Returns:
+        the tick size of each pair configured with a depth index, which its consolidated book then keeps too
+    """
+    return {
+        currency_pair_from_str(pair_str): params['tick_size']
+        for pair_str, params in config.get('order_book', {}).items()
+        if params.get('depth_index', False)
+    }
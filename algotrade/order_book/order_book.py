@@ -1,34 +1,125 @@
+import zlib
+from itertools import islice
 from operator import neg
-from typing import Tuple
+from typing import Callable, Iterator, Protocol, Tuple
 
+import numpy as np
 from sortedcontainers import SortedDict
 
+from algotrade.common.data_models import CurrencyPair
 from algotrade.common.enums import Side
+from algotrade.order_book.depth_index import (DepthIndex, walk_price_for_size,
+                                              walk_size_through,
+                                              walk_vwap_for_size)
 
 
 class OrderBookMissingLevelError(Exception):
     pass
 
-comp = {Side.BUY: lambda a, b: a < b, Side.SELL: lambda a, b: a > b}
+
+class OrderBook(Protocol):
+    """
+    The interface shared by all L2 order book implementations (`L2OrderBook`, `TickL2OrderBook`)
+    """
+
+    def update(self, bids: dict[float, float]={}, asks: dict[float, float]={}, snapshot=False):
+        ...
+
+    def delta_update(self, bid_deltas: dict[float, float], ask_deltas: dict[float, float]):
+        ...
+
+    def has_tob(self, side: Side) -> bool:
+        ...
+
+    def get_level(self, side: Side, nth_from_top=1) -> Tuple[float, float]:
+        ...
+
+    def get_size(self, side: Side, price_level: float) -> float:
+        ...
+
+    def get_tob(self, side: Side) -> Tuple[float, float]:
+        ...
+
+    def bids(self) -> dict[float, float]:
+        ...
+
+    def asks(self) -> dict[float, float]:
+        ...
+
+    def iter_levels(self, side: Side) -> Iterator[Tuple[float, float]]:
+        ...
+
+    def set_levels(self, side: Side, prices: np.ndarray, sizes: np.ndarray):
+        ...
+
+    def clear(self):
+        ...
+
+    def price_for_size(self, side: Side, size: float) -> float | None:
+        ...
+
+    def vwap_for_size(self, side: Side, size: float) -> float | None:
+        ...
+
+    def depth_within(self, side: Side, bps: float) -> float:
+        ...
+
+    def is_complete(self, side: Side) -> bool:
+        ...
 
 
 class L2OrderBook:
-    def __init__(self):
+    def __init__(
+        self, 
+        depth_tick_size: float | None = None, 
+        max_depth: int | None = None, 
+        depth_reserve: int = 0
+    ):
         """
+        Args:
+            depth_tick_size: when given, a cumulative `DepthIndex` on this tick grid is maintained per side,
+                making `price_for_size`, `vwap_for_size` and `depth_within` O(log n) instead of walking the levels
+            max_depth: when given, the number of levels from the top of each side the book is meant to hold.
+                Levels beyond max_depth + depth_reserve are dropped on update, and updates of levels beyond the
+                worst level kept are ignored until the next snapshot
+            depth_reserve: number of levels kept beyond max_depth, such that deleting near levels still leaves
+                max_depth known levels
         Attributes:
             levels: a sorted dictionary that maps a price level to the size at this level
-            tob: the two Top-Of-the-Book figures
+            tob: the (price level, size) of the Top-Of-the-Book on each side, None for an empty side.
+                Refreshed on every mutation such that reading it is O(1)
+            depth: the cumulative depth index of each side, None if not maintained
+            frontier: per side, the worst level kept when levels were last dropped, None if none were dropped since
+                the last snapshot. The book does not know the levels beyond it
         """
+        if max_depth is not None and max_depth < 1:
+            raise ValueError(f"max_depth {max_depth} must be at least 1")
         self._levels = {Side.BUY: SortedDict(), Side.SELL: SortedDict(neg)}
-        self._tob = {Side.BUY: float("-inf"), Side.SELL: float("inf")}
+        self._tob: dict[Side, Tuple[float, float] | None] = {Side.BUY: None, Side.SELL: None}
+        self._depth = None if depth_tick_size is None else {
+            side: DepthIndex(side, depth_tick_size) for side in Side
+        }
+        self._max_depth = max_depth
+        self._max_levels = None if max_depth is None else max_depth + depth_reserve
+        self._frontier: dict[Side, float | None] = {Side.BUY: None, Side.SELL: None}
 
     def update(self, bids: dict[float, float]={}, asks: dict[float, float]={}, snapshot=False):
         assert bids or asks
         if snapshot:
-            self._levels = {Side.BUY: SortedDict(bids), Side.SELL: SortedDict(neg, asks)}
-        else:
-            self._update(bids, Side.BUY)
-            self._update(asks, Side.SELL)
+            self.clear()
+        self._update(bids, Side.BUY)
+        self._update(asks, Side.SELL)
+
+    def clear(self):
+        """
+        Removes all levels from both sides of the book
+        """
+        self._levels = {Side.BUY: SortedDict(), Side.SELL: SortedDict(neg)}
+        self._tob = {Side.BUY: None, Side.SELL: None}
+        self._frontier: dict[Side, float | None] = {Side.BUY: None, Side.SELL: None}
+        if self._depth is not None:
+            self._depth[Side.BUY].clear()
+            self._depth[Side.SELL].clear()
 
     def delta_update(
         self, bid_deltas: dict[float, float] | SortedDict, 
@@ -46,21 +137,47 @@ class L2OrderBook:
         self._delta_update(bids, Side.SELL, -1)
         
     def has_tob(self, side: Side):
-        return side in self._levels and len(self._levels[side]) != 0
+        return self._tob[side] is not None
+
+    def is_complete(self, side: Side) -> bool:
+        """
+        Returns:
+            False if levels were dropped from side `side` by the depth cap and deletions since left less than
+            max_depth levels, i.e. there may be levels within max_depth from the top that the book does not know.
+            A snapshot makes the book complete again.
+        """
+        return self._frontier[side] is None or len(self._levels[side]) >= self._max_depth  # type: ignore
+
+    def set_levels(self, side: Side, prices: np.ndarray, sizes: np.ndarray):
+        """
+        Sets the sizes at price levels `prices` on side `side`, a zero size removes a level.
+        The array equivalent of `update`. Prices must be unique
+        """
+        self._update(dict(zip(prices.tolist(), sizes.tolist())), side)
 
     def _delta_update(self, deltas: dict[float, float], side: Side, sign=1):
+        if not deltas:
+            return
         sd = self._levels[side]  # sorted dict of levels at side
-        for level in deltas.keys():
-            if level not in self._levels[side]:
-                sd[level] = deltas[level]
-            else:
-                sd[level] += sign * deltas[level]
-            if sd[level] < 0:
-                raise ValueError(
-                    f"Level size cannot become negative. Raised for level: {level}"
-                )
-            if sd[level] == 0:
-                sd.pop(level)
+        depth = self._depth[side] if self._depth is not None else None
+        try:
+            for level, delta in deltas.items():
+                if self._beyond_frontier(side, level):
+                    continue
+                size = sd.get(level, 0) + sign * delta
+                if size < 0:
+                    raise ValueError(
+                        f"Level size cannot become negative. Raised for level: {level}"
+                    )
+                if size == 0:
+                    sd.pop(level, None)
+                else:
+                    sd[level] = size
+                if depth is not None:
+                    depth.set(level, size)
+        finally:
+            self._trim(side)
+            self._refresh_tob(side)
 
     def get_level(self, side: Side, nth_from_top=1) -> Tuple[float, float]:
         """
@@ -71,6 +188,8 @@ class L2OrderBook:
         Returns:
             (price level, size at price level)
         """
+        if nth_from_top == 1:
+            return self.get_tob(side)
         return self._levels[side].peekitem(index=-nth_from_top)  # type: ignore
 
     def get_size(self, side: Side, price_level: float):
@@ -84,7 +203,10 @@ class L2OrderBook:
         Returns:
             (price level, size at price level)
         """
-        return self.get_level(side)
+        tob = self._tob[side]
+        if tob is None:
+            raise OrderBookMissingLevelError(f"{side.value} side of the book is empty")
+        return tob
 
     def bids(self):
         return self._levels[Side.BUY]
@@ -92,36 +214,132 @@ class L2OrderBook:
     def asks(self):
         return self._levels[Side.SELL]
 
-    def _update_tob(self, side: Side):
+    def iter_levels(self, side: Side) -> Iterator[Tuple[float, float]]:
+        """
+        Yields the (price level, size) pairs of side `side` from the top of the book down
+        """
+        sd = self._levels[side]
+        for level in reversed(sd):
+            yield level, sd[level]
+
+    def price_for_size(self, side: Side, size: float) -> float | None:
+        """
+        Returns:
+            the price of the worst level reached when sweeping `size` from the top of side `side`,
+            None if the side holds less than `size`
+        """
+        if self._depth is not None:
+            return self._depth[side].price_for_size(size)
+        return walk_price_for_size(self.iter_levels(side), size)
+
+    def vwap_for_size(self, side: Side, size: float) -> float | None:
+        """
+        Returns:
+            the volume weighted average price of sweeping `size` from the top of side `side`,
+            None if the side holds less than `size`
+        """
+        if self._depth is not None:
+            return self._depth[side].vwap_for_size(size)
+        return walk_vwap_for_size(self.iter_levels(side), size)
+
+    def depth_within(self, side: Side, bps: float) -> float:
+        """
+        Returns:
+            the cumulative size on side `side` at prices within `bps` basis points of the mid price
+        """
+        limit = price_within_bps(self, side, bps)
+        if self._depth is not None:
+            return self._depth[side].size_through(limit)
+        return walk_size_through(self.iter_levels(side), side, limit)
+
+    def _trim(self, side: Side):
+        """
+        Drops the levels farthest from the top of the book beyond the depth cap
+        """
+        sd = self._levels[side]
+        if self._max_levels is None or len(sd) <= self._max_levels:
+            return
+        while len(sd) > self._max_levels:
+            level, _ = sd.popitem(index=0)
+            if self._depth is not None:
+                self._depth[side].set(level, 0)
+        self._frontier[side] = sd.peekitem(index=0)[0]
+
+    def _beyond_frontier(self, side: Side, level: float) -> bool:
+        """
+        Returns:
+            True if `level` is worse than the worst level kept when levels were last dropped, i.e. in the part of
+            side `side` the book does not know, such that setting it would leave a gap in the book
+        """
+        frontier = self._frontier[side]
+        if frontier is None:
+            return False
+        return level < frontier if side == Side.BUY else level > frontier
+
+    def _refresh_tob(self, side: Side):
         """
-        Updates the TOB (Top-Of-the-Book)
+        Updates the TOB (Top-Of-the-Book). The best level is the last one in the sorted dict, so peeking it is O(1)
         """
         sd = self._levels[side]
-        tmp = sd.peekitem(index=-1)[0]
-        if comp[side](self._tob[side], tmp):
-            self._tob[side]  = tmp  # type: ignore
+        self._tob[side] = sd.peekitem(index=-1) if sd else None
 
     def _update(self, update: dict[float, float], side: Side):
         """
-        TODO: We can get more efficient here by scanning the keys to find the max/min.
-        Currently logarithminc in num of levels - in _update_tob
+        Sets the size of each level in `update`, a zero size removes the level
         Args:
-            update:
-            side:
-            snapshot:
+            update: a map from price level to the new size at this level
+            side: the side of the book to update
         """
         if not update:
             return
         sd = self._levels[side]  # sd: sorted dict
-        sd.update(update)
-        for level in update.keys():
-            if level <= 0:
-                raise ValueError(f"level {level} must be positive")
-            if sd[level] < 0:
-                raise ValueError(f"size at level {level} must be non-negative")
-            if sd[level] == 0:
-                sd.pop(level)
-        self._update_tob(side)
+        depth = self._depth[side] if self._depth is not None else None
+        try:
+            for level, size in update.items():
+                if level <= 0:
+                    raise ValueError(f"level {level} must be positive")
+                if size < 0:
+                    raise ValueError(f"size at level {level} must be non-negative")
+                if self._beyond_frontier(side, level):
+                    continue
+                if size == 0:
+                    sd.pop(level, None)
+                else:
+                    sd[level] = size
+                if depth is not None:
+                    depth.set(level, size)
+        finally:
+            self._trim(side)
+            self._refresh_tob(side)
+
+def price_within_bps(book: OrderBook, side: Side, bps: float) -> float:
+    """
+    Returns the price `bps` basis points away from the book's mid price towards side `side`
+    """
+    mid = (book.get_tob(Side.BUY)[0] + book.get_tob(Side.SELL)[0]) / 2
+    return mid * (1 - bps / 1e4) if side == Side.BUY else mid * (1 + bps / 1e4)
+
+# a market's checksum algorithm of the book of a pair, see `BookUpdate.checksum`
+BookChecksum = Callable[[CurrencyPair, OrderBook], int]
+
+
+def kraken_checksum(book: OrderBook, price_decimals: int, size_decimals: int = 8, depth: int = 10) -> int:
+    """
+    Kraken's book checksum: CRC32 of the top `depth` asks from the top of the book, then the top `depth` bids,
+    each level contributing its price and its size formatted with the pair's number of decimals, without the
+    decimal point and leading zeros. Only `depth` levels per side are read, so the cost does not grow with the book
+    """
+    digits = []
+    for side in (Side.SELL, Side.BUY):
+        for price, size in islice(book.iter_levels(side), depth):
+            digits.append(_kraken_digits(price, price_decimals))
+            digits.append(_kraken_digits(size, size_decimals))
+    return zlib.crc32(''.join(digits).encode())
+
+
+def _kraken_digits(value: float, decimals: int) -> str:
+    return f"{value:.{decimals}f}".replace('.', '').lstrip('0')
+
 
 def copy(book: L2OrderBook) -> L2OrderBook:
     res = L2OrderBook()
@@ -141,4 +359,50 @@ def diff(lhs: L2OrderBook, rhs: L2OrderBook) -> L2OrderBook:
     """
     res = copy(lhs)
     res.subtract(rhs.bids(), rhs.asks())
-    return res
\ No newline at end of file
+    return res
+
+class BookDiffView:
+    """
+    A read-only view of a base book minus a subtrahend book (e.g. the market's book minus own orders).
+    Nothing is copied: every read is computed from the two books as they are at the time of the read,
+    walking the base book from the top and skipping levels that the subtraction empties.
+    """
+
+    def __init__(self, base: OrderBook, subtrahend: OrderBook):
+        """
+        Args:
+            base: the book to reduce from
+            subtrahend: the book to be reduced
+        """
+        self._base = base
+        self._subtrahend = subtrahend
+
+    def get_size(self, side: Side, price_level: float) -> float:
+        return max(self._base.get_size(side, price_level) - self._subtrahend.get_size(side, price_level), 0)
+
+    def get_level(self, side: Side, nth_from_top=1) -> Tuple[float, float]:
+        """
+        Returns the nth non-empty price level from the tob of the difference on side `side`
+        Arguments:
+            nth_from_top: the nth level from the top of the book to return data for
+            side: Buy or Sell side of the book
+        Returns:
+            (price level, size at price level)
+        """
+        for i, level in enumerate(self._iter_levels(side), start=1):
+            if i == nth_from_top:
+                return level
+        raise OrderBookMissingLevelError(f"difference has less than {nth_from_top} levels on {side.value} side")
+
+    def get_tob(self, side: Side) -> Tuple[float, float]:
+        return self.get_level(side)
+
+    def has_tob(self, side: Side) -> bool:
+        return next(self._iter_levels(side), None) is not None
+
+    def _iter_levels(self, side: Side) -> Iterator[Tuple[float, float]]:
+        subtrahend = self._subtrahend
+        for level, size in self._base.iter_levels(side):
+            size -= subtrahend.get_size(side, level)
+            if size > 0:
+                yield level, size
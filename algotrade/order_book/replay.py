@@ -0,0 +1,134 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from algotrade.common.enums import Side
+from algotrade.order_book.tick_order_book import TickL2OrderBook
+
+# side codes of replayed events
+BUY = 1
+SELL = -1
+
+
+@dataclass(frozen=True)
+class TOBSeries:
+    """
+    Top of the book after replayed events. Prices and sizes are NaN while a side of the book is empty.
+    Attributes:
+        timestamps: the event or sample times the TOB was taken at
+        bid_price: best bid price at each timestamp
+        bid_size: size at the best bid at each timestamp
+        ask_price: best ask price at each timestamp
+        ask_size: size at the best ask at each timestamp
+    """
+    timestamps: np.ndarray
+    bid_price: np.ndarray
+    bid_size: np.ndarray
+    ask_price: np.ndarray
+    ask_size: np.ndarray
+
+
+def apply_events(book: TickL2OrderBook, sides: np.ndarray, prices: np.ndarray, sizes: np.ndarray):
+    """
+    Applies a contiguous block of level updates (the new size at a price level, 0 removes the level) to `book`
+    in one pass per side. The resulting book is identical to calling `book.update` for each event in order.
+    Arguments:
+        book: the book to update, of the vectorized tick ladder backend
+        sides: BUY or SELL per event
+        prices: price level per event
+        sizes: new size at the price level per event
+    """
+    _validate(book, sides, prices, sizes)
+    if not len(sides):
+        return
+    for code, side in ((BUY, Side.BUY), (SELL, Side.SELL)):
+        mask = sides == code
+        if not mask.any():
+            continue
+        side_prices, side_sizes = prices[mask], sizes[mask]
+        # within a block only the last update of each level matters:
+        levels, last = np.unique(side_prices[::-1], return_index=True)
+        book.set_levels(side, levels, side_sizes[::-1][last])
+
+
+def replay(
+    book: TickL2OrderBook,
+    timestamps: np.ndarray,
+    sides: np.ndarray,
+    prices: np.ndarray,
+    sizes: np.ndarray,
+    sample_times: np.ndarray | None = None,
+) -> TOBSeries:
+    """
+    Replays book events (sorted by timestamp) into `book` and records the top of the book.
+    Events between consecutive samples are applied in bulk with `apply_events`, one batch per sample, while
+    short batches and unsampled replays apply the events one at a time, which is cheaper than a bulk pass for
+    a few events. All events are applied, including the ones after the last sample.
+    Arguments:
+        book: the book to replay the events into, of the vectorized tick ladder backend
+        timestamps: the time of each event, non-decreasing
+        sides: BUY or SELL per event
+        prices: price level per event
+        sizes: new size at the price level per event
+        sample_times: sorted times to take the TOB at (after all events up to and including that time).
+            When None the TOB is taken after every event
+    Returns:
+        the TOB series at the event or sample times
+    """
+    _validate(book, sides, prices, sizes)
+    if sample_times is None:
+        res = np.full((4, len(sides)), np.nan)
+        for i, (code, price, size) in enumerate(zip(sides.tolist(), prices.tolist(), sizes.tolist())):
+            _apply_event(book, code, price, size)
+            _record_tob(book, res, i)
+        return TOBSeries(timestamps, res[0], res[1], res[2], res[3])
+    ends = np.searchsorted(timestamps, sample_times, side='right')
+    res = np.full((4, len(ends)), np.nan)
+    start = 0
+    for i, end in enumerate(ends.tolist()):
+        if end > start:
+            _apply_block(book, sides[start:end], prices[start:end], sizes[start:end])
+        start = max(start, end)
+        _record_tob(book, res, i)
+    if start < len(sides):
+        _apply_block(book, sides[start:], prices[start:], sizes[start:])
+    return TOBSeries(sample_times, res[0], res[1], res[2], res[3])
+
+
+# blocks of fewer events are applied one event at a time, as the fixed cost of a bulk pass outweighs its gain
+_MIN_BULK_EVENTS = 64
+
+
+def _apply_block(book: TickL2OrderBook, sides: np.ndarray, prices: np.ndarray, sizes: np.ndarray):
+    if len(sides) >= _MIN_BULK_EVENTS:
+        apply_events(book, sides, prices, sizes)
+        return
+    for code, price, size in zip(sides.tolist(), prices.tolist(), sizes.tolist()):
+        _apply_event(book, code, price, size)
+
+
+def _apply_event(book: TickL2OrderBook, code: int, price: float, size: float):
+    if code == BUY:
+        book.update(bids={price: size})
+    else:
+        book.update(asks={price: size})
+
+
+def _record_tob(book: TickL2OrderBook, res: np.ndarray, i: int):
+    if book.has_tob(Side.BUY):
+        res[0, i], res[1, i] = book.get_tob(Side.BUY)
+    if book.has_tob(Side.SELL):
+        res[2, i], res[3, i] = book.get_tob(Side.SELL)
+
+
+def _validate(book: TickL2OrderBook, sides: np.ndarray, prices: np.ndarray, sizes: np.ndarray):
+    if not isinstance(book, TickL2OrderBook):
+        # the sorted backend applies levels one at a time, so replaying into it is no faster than `update`
+        raise TypeError(f"replay requires a TickL2OrderBook, got {type(book).__name__}")
+    if book.depth_capped:
+        # a capped book needs a resync once it dropped levels that became needed, which a replay cannot get
+        raise ValueError("replay requires a book that is not depth capped")
+    if not len(sides) == len(prices) == len(sizes):
+        raise ValueError("sides, prices and sizes must have the same length")
+    if not np.isin(sides, (BUY, SELL)).all():
+        raise ValueError(f"sides must be either {BUY} (buy) or {SELL} (sell)")
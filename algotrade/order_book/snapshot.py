@@ -0,0 +1,128 @@
+"""
+Binary snapshots of order books.
+
+File layout (little endian, all sections 8 bytes aligned):
+    header:         magic b'ATOB', version (uint16), reserved (uint16), number of books (uint64)
+    per book:       pair (16 bytes ascii, e.g. b'BTC-EUR'), market (16 bytes ascii), updated_at (float64, unix time),
+                    number of bid levels (uint32), number of ask levels (uint32),
+                    followed by float64 arrays: bid prices, bid sizes, ask prices, ask sizes (top of the book first)
+
+Loading maps the file into memory and exposes the level arrays as zero-copy NumPy views, so no parsing is involved.
+"""
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+
+import numpy as np
+
+from algotrade.common.data_models import CurrencyPair, currency_pair_from_str
+from algotrade.common.enums import MarketName, Side
+from algotrade.order_book.order_book import OrderBook
+
+MAGIC = b'ATOB'
+VERSION = 1
+_HEADER = struct.Struct('<4sHHQ')
+_BOOK_HEADER = struct.Struct('<16s16sdII')
+
+
+class BookSnapshotFormatError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class BookSnapshot:
+    """
+    The levels of one order book as saved in a snapshot file. Level arrays are read-only views of the mapped file
+    Attributes:
+        updated_at: unix time of the last update the book had received before it was saved
+    """
+    pair: CurrencyPair
+    market: MarketName
+    updated_at: float
+    bid_prices: np.ndarray
+    bid_sizes: np.ndarray
+    ask_prices: np.ndarray
+    ask_sizes: np.ndarray
+
+    def restore_into(self, book: OrderBook):
+        """
+        Replaces the content of `book` with the snapshot's levels
+        """
+        book.clear()
+        book.set_levels(Side.BUY, self.bid_prices, self.bid_sizes)
+        book.set_levels(Side.SELL, self.ask_prices, self.ask_sizes)
+
+
+def dumps(
+    books: dict[tuple[CurrencyPair, MarketName], OrderBook],
+    updated_at: dict[tuple[CurrencyPair, MarketName], float],
+) -> bytes:
+    """
+    Arguments:
+        books: the books to save, keyed by (pair, market)
+        updated_at: unix time of the last update of each book
+    Returns:
+        the binary snapshot of `books`
+    """
+    chunks = [_HEADER.pack(MAGIC, VERSION, 0, len(books))]
+    for (pair, market), book in books.items():
+        sides = [np.array(list(book.iter_levels(side)), dtype=np.float64).reshape(-1, 2) for side in (Side.BUY, Side.SELL)]
+        chunks.append(_BOOK_HEADER.pack(
+            str(pair).encode('ascii'),
+            market.value.encode('ascii'),
+            updated_at.get((pair, market), 0.0),
+            len(sides[0]),
+            len(sides[1]),
+        ))
+        for levels in sides:
+            chunks.append(levels[:, 0].tobytes())
+            chunks.append(levels[:, 1].tobytes())
+    return b''.join(chunks)
+
+
+def write(path: str, data: bytes):
+    """
+    Atomically replaces the file at `path` with `data`, such that a reader never sees a partially written snapshot
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def save(
+    path: str,
+    books: dict[tuple[CurrencyPair, MarketName], OrderBook],
+    updated_at: dict[tuple[CurrencyPair, MarketName], float],
+):
+    write(path, dumps(books, updated_at))
+
+
+def load(path: str) -> list[BookSnapshot]:
+    """
+    Maps the snapshot file at `path` into memory.
+    Returns:
+        a snapshot per saved book, with level arrays viewing the mapped file
+    """
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, _, n_books = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        raise BookSnapshotFormatError(f"{path} is not an order book snapshot of version {VERSION}")
+    res = []
+    offset = _HEADER.size
+    for _ in range(n_books):
+        pair, market, updated_at, n_bids, n_asks = _BOOK_HEADER.unpack_from(buf, offset)
+        offset += _BOOK_HEADER.size
+        arrays = []
+        for n in (n_bids, n_bids, n_asks, n_asks):
+            arrays.append(np.frombuffer(buf, dtype=np.float64, count=n, offset=offset))
+            offset += 8 * n
+        res.append(BookSnapshot(
+            currency_pair_from_str(pair.rstrip(b'\0').decode('ascii')),
+            MarketName(market.rstrip(b'\0').decode('ascii')),
+            updated_at,
+            *arrays,
+        ))
+    return res
@@ -0,0 +1,538 @@
+from decimal import Decimal
+from typing import Iterator, Tuple
+
+import numpy as np
+
+from algotrade.common.enums import Side
+from algotrade.order_book.depth_index import (DepthIndex, walk_price_for_size,
+                                              walk_size_through,
+                                              walk_vwap_for_size)
+from algotrade.order_book.order_book import (OrderBookMissingLevelError,
+                                             price_within_bps)
+
+
+class _Ladder:
+    """
+    One side of a `TickL2OrderBook`. Sizes are kept in a NumPy array where index i holds the size at
+    tick `anchor + i`. The anchor moves (and the array grows) when a level falls outside the ladder.
+    Attributes:
+        sizes: size per tick offset from the anchor, 0 for an empty level
+        anchor: the tick of index 0, None until the first level is set
+        best: index of the best non-empty level, -1 when the side is empty
+        worst: index of the worst non-empty level, -1 when the side is empty. Scans for levels stop at it
+        count: number of non-empty levels
+    """
+    def __init__(self, side: Side, capacity: int):
+        self._is_bid = side == Side.BUY
+        self.sizes = np.zeros(capacity, dtype=np.float64)
+        self.anchor: int | None = None
+        self.best = -1
+        self.worst = -1
+        self.count = 0
+
+    def index(self, tick: int) -> int:
+        """
+        Returns the index of `tick` in the ladder, or -1 if the tick is outside of the ladder
+        """
+        if self.anchor is None:
+            return -1
+        i = tick - self.anchor
+        return i if 0 <= i < len(self.sizes) else -1
+
+    def get(self, tick: int) -> float:
+        i = self.index(tick)
+        return float(self.sizes[i]) if i >= 0 else 0.0
+
+    def is_worse(self, i: int, j: int) -> bool:
+        """
+        Returns True if index (or tick) i is a worse price than index (or tick) j
+        """
+        return i < j if self._is_bid else i > j
+
+    def set(self, tick: int, size: float) -> float:
+        """
+        Sets the size at `tick` and keeps `best`, `worst` and `count` up to date.
+        Returns:
+            the previous size at `tick`
+        """
+        i = self.index(tick)
+        if i < 0:
+            if size == 0:
+                return 0.0
+            self._reanchor(tick, tick)
+            i = tick - self.anchor  # type: ignore
+        old = float(self.sizes[i])
+        self.sizes[i] = size
+        if old == 0 and size != 0:
+            self.count += 1
+        elif old != 0 and size == 0:
+            self.count -= 1
+        if size != 0:
+            if self.best < 0 or self.is_worse(self.best, i):
+                self.best = i
+            if self.worst < 0 or self.is_worse(i, self.worst):
+                self.worst = i
+        else:
+            if i == self.best:
+                self.best = self._scan(i, toward_worse=True, inclusive=False)
+            if i == self.worst:
+                self.worst = self._scan(i, toward_worse=False, inclusive=False)
+        return old
+
+    def set_many(self, ticks: np.ndarray, sizes: np.ndarray):
+        """
+        The vectorized equivalent of calling `set` for each (tick, size) pair. Ticks must be unique
+        """
+        nonzero = sizes != 0
+        if nonzero.any():
+            lo, hi = int(ticks[nonzero].min()), int(ticks[nonzero].max())
+            if self.index(lo) < 0 or self.index(hi) < 0:
+                self._reanchor(lo, hi)
+        if self.anchor is None:  # only removals on an empty ladder
+            return
+        idx = ticks - self.anchor
+        inside = (idx >= 0) & (idx < len(self.sizes))  # zero sizes outside of the ladder are no-ops
+        if not inside.all():
+            idx, sizes, nonzero = idx[inside], sizes[inside], nonzero[inside]
+        if not len(idx):
+            return
+        self.count += int(np.count_nonzero(nonzero)) - int(np.count_nonzero(self.sizes[idx]))
+        self.sizes[idx] = sizes
+        if self.best >= 0 and self.sizes[self.best] == 0:
+            self.best = self._scan(self.best, toward_worse=True, inclusive=False)
+        if self.worst >= 0 and self.sizes[self.worst] == 0:
+            self.worst = self._scan(self.worst, toward_worse=False, inclusive=False)
+        if nonzero.any():
+            set_idx = idx[nonzero]
+            best, worst = (int(set_idx.max()), int(set_idx.min())) if self._is_bid else \
+                (int(set_idx.min()), int(set_idx.max()))
+            if self.best < 0 or self.is_worse(self.best, best):
+                self.best = best
+            if self.worst < 0 or self.is_worse(worst, self.worst):
+                self.worst = worst
+
+    def cut(self, tick: int) -> np.ndarray:
+        """
+        Removes all levels worse than `tick`
+        Returns:
+            the indices of the removed levels, valid until the next write to the ladder
+        """
+        if self.worst < 0 or not self.is_worse(self.anchor + self.worst, tick):  # type: ignore
+            return np.empty(0, dtype=np.int64)
+        i = tick - self.anchor  # type: ignore
+        if self._is_bid:
+            start, stop = self.worst, min(i, len(self.sizes))
+        else:
+            start, stop = max(i + 1, 0), self.worst + 1
+        removed = np.flatnonzero(self.sizes[start:stop]) + start
+        self.sizes[start:stop] = 0
+        self.count -= len(removed)
+        if self.count == 0:
+            self.best = self.worst = -1
+        else:
+            self.worst = self._scan(min(max(i, 0), len(self.sizes) - 1), toward_worse=False, inclusive=True)
+        return removed
+
+    def nth_from_best(self, n: int) -> int:
+        """
+        Returns the index of the nth non-empty level from the best one, -1 if the side has less than n levels.
+        Scans chunks of the ladder from the best level on, such that the cost is bound by the distance to
+        the nth level rather than the ladder's capacity
+        """
+        if n > self.count:
+            return -1
+        pos, chunk = self.best, max(64, 4 * n)
+        while True:
+            if self._is_bid:
+                lo = max(self.worst, pos - chunk + 1)
+                found = np.flatnonzero(self.sizes[lo:pos + 1])[::-1] + lo
+                pos = lo - 1
+            else:
+                hi = min(self.worst, pos + chunk - 1)
+                found = np.flatnonzero(self.sizes[pos:hi + 1]) + pos
+                pos = hi + 1
+            if len(found) >= n:
+                return int(found[n - 1])
+            n -= len(found)
+            chunk *= 2
+
+    def clear(self):
+        self.sizes[:] = 0
+        self.best = -1
+        self.worst = -1
+        self.count = 0
+
+    def nonzero_from_best(self) -> np.ndarray:
+        """
+        Returns the indices of all non-empty levels, ordered from the best level to the worst
+        """
+        if self.best < 0:
+            return np.empty(0, dtype=np.int64)
+        if self._is_bid:
+            return np.flatnonzero(self.sizes[self.worst:self.best + 1])[::-1] + self.worst
+        return np.flatnonzero(self.sizes[self.best:self.worst + 1]) + self.best
+
+    def _scan(self, i: int, toward_worse: bool, inclusive: bool) -> int:
+        """
+        Finds the first non-empty level from index i (excluded unless `inclusive`) toward worse or better
+        prices, scanning no further than the worst or the best level. Returns -1 if there is none
+        """
+        bound = self.worst if toward_worse else self.best
+        if self.count == 0 or bound < 0:
+            return -1
+        if not inclusive:
+            i += -1 if self._is_bid == toward_worse else 1
+        if self._is_bid == toward_worse:  # toward lower indices
+            if i < bound:
+                return -1
+            below = self.sizes[bound:i + 1][::-1]
+            j = int(np.argmax(below != 0))
+            return i - j if below[j] != 0 else -1
+        if i > bound:
+            return -1
+        above = self.sizes[i:bound + 1]
+        j = int(np.argmax(above != 0))
+        return i + j if above[j] != 0 else -1
+
+    def _reanchor(self, lo_tick: int, hi_tick: int):
+        """
+        Moves the anchor (growing the ladder if needed) such that the ticks between `lo_tick` and `hi_tick`
+        and all non-empty levels fit.
+        """
+        capacity = len(self.sizes)
+        occupied = np.flatnonzero(self.sizes) if self.count else np.empty(0, dtype=np.int64)
+        if self.anchor is None or len(occupied) == 0:
+            lo, hi = lo_tick, hi_tick
+        else:
+            lo = min(lo_tick, self.anchor + int(occupied[0]))
+            hi = max(hi_tick, self.anchor + int(occupied[-1]))
+        span = hi - lo + 1
+        while capacity < 2 * span:
+            capacity *= 2
+        anchor = lo - (capacity - span) // 2
+        sizes = np.zeros(capacity, dtype=np.float64)
+        if len(occupied):
+            sizes[occupied + (self.anchor - anchor)] = self.sizes[occupied]  # type: ignore
+        if self.best >= 0:
+            self.best += self.anchor - anchor  # type: ignore
+            self.worst += self.anchor - anchor  # type: ignore
+        self.sizes = sizes
+        self.anchor = anchor
+
+
+class TickL2OrderBook:
+    """
+    An L2 order book with the same interface as `L2OrderBook`, that keeps the levels of each side in a
+    NumPy ladder indexed by the integer tick offset of a price level from a moving anchor.
+    Level writes are O(1) and finding a new best level after the best one is removed is a vectorized scan.
+    Prices must be multiples of `tick_size`.
+    Without a `window` a far away level grows the ladder to span it, so books of markets that may send such
+    levels should cap it.
+    """
+    INITIAL_CAPACITY = 1024
+
+    def __init__(
+        self,
+        tick_size: float,
+        capacity: int = INITIAL_CAPACITY,
+        depth_index: bool = False,
+        max_depth: int | None = None,
+        depth_reserve: int = 0,
+        window: int | None = None,
+    ):
+        """
+        Args:
+            tick_size: the minimal price increment of the book's pair
+            capacity: initial number of ticks on each side's ladder, the ladder grows as needed
+            depth_index: when True, a cumulative `DepthIndex` is maintained per side, making `price_for_size`,
+                `vwap_for_size` and `depth_within` O(log n) instead of scanning the ladder
+            max_depth: when given, the number of levels from the top of each side the book is meant to hold, as
+                for `L2OrderBook`. Levels beyond max_depth + depth_reserve are dropped on update
+            depth_reserve: number of levels kept beyond max_depth, such that deleting near levels still leaves
+                max_depth known levels
+            window: when given, the number of ticks from the top of each side the ladder spans. Levels outside
+                of it are dropped, which bounds the ladder's size
+        Attributes:
+            frontier: per side, the worst tick kept when levels were last dropped, None if none were dropped since
+                the last snapshot. Updates of levels beyond it are ignored, the book does not know them
+        """
+        if tick_size <= 0:
+            raise ValueError(f"tick size {tick_size} must be positive")
+        if max_depth is not None and max_depth < 1:
+            raise ValueError(f"max_depth {max_depth} must be at least 1")
+        if window is not None and window < 1:
+            raise ValueError(f"window {window} must be at least 1")
+        self._tick_size = tick_size
+        self._decimals = max(0, -Decimal(str(tick_size)).as_tuple().exponent)  # type: ignore
+        self._ladders = {Side.BUY: _Ladder(Side.BUY, capacity), Side.SELL: _Ladder(Side.SELL, capacity)}
+        self._depth = {side: DepthIndex(side, tick_size) for side in Side} if depth_index else None
+        self._max_depth = max_depth
+        self._max_levels = None if max_depth is None else max_depth + depth_reserve
+        self._window = window
+        self._frontier: dict[Side, int | None] = {Side.BUY: None, Side.SELL: None}
+
+    def update(self, bids: dict[float, float]={}, asks: dict[float, float]={}, snapshot=False):
+        assert bids or asks
+        if snapshot:
+            self.clear()
+        self._update(bids, Side.BUY)
+        self._update(asks, Side.SELL)
+
+    def clear(self):
+        """
+        Removes all levels from both sides of the book
+        """
+        self._ladders[Side.BUY].clear()
+        self._ladders[Side.SELL].clear()
+        self._frontier = {Side.BUY: None, Side.SELL: None}
+        if self._depth is not None:
+            self._depth[Side.BUY].clear()
+            self._depth[Side.SELL].clear()
+
+    def delta_update(self, bid_deltas: dict[float, float], ask_deltas: dict[float, float]):
+        self._delta_update(bid_deltas, Side.BUY)
+        self._delta_update(ask_deltas, Side.SELL)
+
+    def subtract(self, asks: dict[float, float], bids: dict[float, float]):
+        self._delta_update(asks, Side.BUY, -1)
+        self._delta_update(bids, Side.SELL, -1)
+
+    def has_tob(self, side: Side):
+        return self._ladders[side].best >= 0
+
+    @property
+    def depth_capped(self) -> bool:
+        """
+        True if the book drops levels, by a max_depth or a window
+        """
+        return self._max_levels is not None or self._window is not None
+
+    def is_complete(self, side: Side) -> bool:
+        """
+        Returns:
+            False if levels were dropped from side `side` and may now be needed: with a max_depth, when deletions
+            since left less than max_depth levels; with a window only, when the window from the top of the book
+            now reaches beyond the dropped levels. A snapshot makes the book complete again.
+        """
+        frontier = self._frontier[side]
+        if frontier is None:
+            return True
+        ladder = self._ladders[side]
+        if self._max_depth is not None:
+            return ladder.count >= self._max_depth
+        if ladder.best < 0:
+            return False
+        return not ladder.is_worse(self._window_edge(side, ladder.anchor + ladder.best), frontier)  # type: ignore
+
+    def set_levels(self, side: Side, prices: np.ndarray, sizes: np.ndarray):
+        """
+        Sets the sizes at price levels `prices` on side `side` in one vectorized pass, a zero size removes a level.
+        Equivalent to `update` with the same levels. Prices must be unique
+        """
+        if not len(prices):
+            return
+        if (prices <= 0).any():
+            raise ValueError(f"level {prices[prices <= 0][0]} must be positive")
+        if (sizes < 0).any():
+            raise ValueError(f"size at level {prices[sizes < 0][0]} must be non-negative")
+        ticks = np.rint(prices / self._tick_size).astype(np.int64)
+        off_tick = np.abs(ticks * self._tick_size - prices) > 1e-9 * np.maximum(1.0, np.abs(prices))
+        if off_tick.any():
+            raise ValueError(f"price {prices[off_tick][0]} is not a multiple of tick size {self._tick_size}")
+        ladder = self._ladders[side]
+        is_bid = side == Side.BUY
+        keep = np.ones(len(ticks), dtype=bool)
+        frontier = self._frontier[side]
+        if frontier is not None:
+            keep &= (ticks >= frontier) if is_bid else (ticks <= frontier)
+        if self._window is not None:
+            # the window of the best level set or kept, a conservative choice when the batch removes the best one
+            set_ticks = ticks[keep & (sizes != 0)]
+            candidates = ([int(set_ticks.max() if is_bid else set_ticks.min())] if len(set_ticks) else []) + \
+                ([ladder.anchor + ladder.best] if ladder.best >= 0 else [])  # type: ignore
+            if candidates:
+                edge = self._window_edge(side, max(candidates) if is_bid else min(candidates))
+                self._cut(side, edge)
+                outside = ((ticks < edge) if is_bid else (ticks > edge)) & (sizes != 0) & keep
+                if outside.any():
+                    self._move_frontier(side, edge)
+                    keep &= ~outside
+        if not keep.all():
+            prices, ticks, sizes = prices[keep], ticks[keep], sizes[keep]
+        try:
+            ladder.set_many(ticks, sizes.astype(np.float64, copy=False))
+            if self._depth is not None:
+                depth = self._depth[side]
+                for price, size in zip(prices.tolist(), sizes.tolist()):
+                    depth.set(price, size)
+        finally:
+            self._trim(side)
+
+    def get_level(self, side: Side, nth_from_top=1) -> Tuple[float, float]:
+        """
+        Returns the nth price level from the tob on side `side`
+        Arguments:
+            nth_from_top: the nth level from the top of the book to return data for
+            side: Buy or Sell side of the book
+        Returns:
+            (price level, size at price level)
+        """
+        ladder = self._ladders[side]
+        i = ladder.best if nth_from_top == 1 else ladder.nth_from_best(nth_from_top)
+        if i < 0:
+            raise OrderBookMissingLevelError(f"no level {nth_from_top} on {side.value} side")
+        return self._price(ladder.anchor + i), float(ladder.sizes[i])  # type: ignore
+
+    def get_size(self, side: Side, price_level: float):
+        return self._ladders[side].get(self._tick(price_level))
+
+    def get_tob(self, side: Side) -> Tuple[float, float]:
+        """
+        Returns the price level data for the top of the book on side `side`
+        Arguments:
+            side: Buy or Sell side of the book
+        Returns:
+            (price level, size at price level)
+        """
+        return self.get_level(side)
+
+    def bids(self) -> dict[float, float]:
+        return self._side_levels(Side.BUY)
+
+    def asks(self) -> dict[float, float]:
+        return self._side_levels(Side.SELL)
+
+    def iter_levels(self, side: Side) -> Iterator[Tuple[float, float]]:
+        """
+        Yields the (price level, size) pairs of side `side` from the top of the book down
+        """
+        ladder = self._ladders[side]
+        for i in ladder.nonzero_from_best():
+            yield self._price(ladder.anchor + int(i)), float(ladder.sizes[i])  # type: ignore
+
+    def price_for_size(self, side: Side, size: float) -> float | None:
+        """
+        Returns:
+            the price of the worst level reached when sweeping `size` from the top of side `side`,
+            None if the side holds less than `size`
+        """
+        if self._depth is not None:
+            return self._depth[side].price_for_size(size)
+        return walk_price_for_size(self.iter_levels(side), size)
+
+    def vwap_for_size(self, side: Side, size: float) -> float | None:
+        """
+        Returns:
+            the volume weighted average price of sweeping `size` from the top of side `side`,
+            None if the side holds less than `size`
+        """
+        if self._depth is not None:
+            return self._depth[side].vwap_for_size(size)
+        return walk_vwap_for_size(self.iter_levels(side), size)
+
+    def depth_within(self, side: Side, bps: float) -> float:
+        """
+        Returns:
+            the cumulative size on side `side` at prices within `bps` basis points of the mid price
+        """
+        limit = price_within_bps(self, side, bps)
+        if self._depth is not None:
+            return self._depth[side].size_through(limit)
+        return walk_size_through(self.iter_levels(side), side, limit)
+
+    def _side_levels(self, side: Side) -> dict[float, float]:
+        """
+        Returns the levels of side `side` ordered like `L2OrderBook` sides, from the bottom of the book to the top
+        """
+        return dict(reversed(list(self.iter_levels(side))))
+
+    def _tick(self, price: float) -> int:
+        tick = round(price / self._tick_size)
+        if abs(tick * self._tick_size - price) > 1e-9 * max(1.0, abs(price)):
+            raise ValueError(f"price {price} is not a multiple of tick size {self._tick_size}")
+        return tick
+
+    def _price(self, tick: int) -> float:
+        return round(tick * self._tick_size, self._decimals)
+
+    def _update(self, update: dict[float, float], side: Side):
+        try:
+            for level, size in update.items():
+                if level <= 0:
+                    raise ValueError(f"level {level} must be positive")
+                if size < 0:
+                    raise ValueError(f"size at level {level} must be non-negative")
+                self._set(side, self._tick(level), size)
+        finally:
+            self._trim(side)
+
+    def _delta_update(self, deltas: dict[float, float], side: Side, sign=1):
+        ladder = self._ladders[side]
+        try:
+            for level, delta in deltas.items():
+                tick = self._tick(level)
+                size = ladder.get(tick) + sign * delta
+                if size < 0:
+                    raise ValueError(
+                        f"Level size cannot become negative. Raised for level: {level}"
+                    )
+                self._set(side, tick, size)
+        finally:
+            self._trim(side)
+
+    def _set(self, side: Side, tick: int, size: float):
+        """
+        Sets the size at `tick` unless it is beyond the frontier or outside of the window, which it then moves
+        """
+        ladder = self._ladders[side]
+        if self._beyond_frontier(side, tick):
+            return
+        if size != 0 and self._window is not None and ladder.best >= 0:
+            best = ladder.anchor + ladder.best  # type: ignore
+            if ladder.is_worse(tick, best):
+                edge = self._window_edge(side, best)
+                if ladder.is_worse(tick, edge):
+                    self._move_frontier(side, edge)
+                    return
+            else:  # a new best level moves the window
+                self._cut(side, self._window_edge(side, tick))
+        ladder.set(tick, size)
+        if self._depth is not None:
+            self._depth[side].set(self._price(tick), size)
+
+    def _trim(self, side: Side):
+        """
+        Drops the levels of side `side` beyond max_depth + depth_reserve
+        """
+        ladder = self._ladders[side]
+        if self._max_levels is None or ladder.count <= self._max_levels:
+            return
+        self._cut(side, ladder.anchor + ladder.nth_from_best(self._max_levels))  # type: ignore
+
+    def _cut(self, side: Side, tick: int):
+        """
+        Drops the levels of side `side` worse than `tick`, which becomes the frontier if any were dropped
+        """
+        ladder = self._ladders[side]
+        removed = ladder.cut(tick)
+        if not len(removed):
+            return
+        self._move_frontier(side, tick)
+        if self._depth is not None:
+            for i in removed.tolist():
+                self._depth[side].set(self._price(ladder.anchor + i), 0.0)  # type: ignore
+
+    def _move_frontier(self, side: Side, tick: int):
+        frontier = self._frontier[side]
+        if frontier is None or self._ladders[side].is_worse(frontier, tick):
+            self._frontier[side] = tick
+
+    def _beyond_frontier(self, side: Side, tick: int) -> bool:
+        frontier = self._frontier[side]
+        return frontier is not None and self._ladders[side].is_worse(tick, frontier)
+
+    def _window_edge(self, side: Side, best: int) -> int:
+        """
+        Returns the worst tick of the window whose top is tick `best`
+        """
+        return best - self._window + 1 if side == Side.BUY else best + self._window - 1  # type: ignore
@@ -1,25 +1,192 @@
 
 import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
 from typing import Callable, Coroutine, Hashable
 
+from loguru import logger
+
+from algotrade.common.enums import QueuePolicy, TopicPriority
+from algotrade.common.histogram import LatencyHistogram
+from algotrade.common.queues import BoundedQueue, ConflatingQueue, QueueStats
+
+
+class _Any:
+    def __repr__(self):
+        return 'ANY'
+
+
+ANY = _Any()  # wildcard position of a topic pattern
+
+
+@dataclass(frozen=True)
+class Pattern:
+    """
+    The topic of a pattern subscription: matches every topic (a tuple, other topics count as a 1-tuple) that starts
+    with `prefix`, where ANY in `prefix` matches any element. E.g. (BrokerTopic.ORDERS_OUT, ANY) matches
+    (BrokerTopic.ORDERS_OUT, market) for every market and (BrokerTopic.PANIC,) matches BrokerTopic.PANIC
+    and (BrokerTopic.PANIC, pair, market)
+    """
+    prefix: tuple
+
+
+@dataclass
+class _TrieNode:
+    children: dict[Hashable, '_TrieNode'] = field(default_factory=dict)
+    patterns: list[Pattern] = field(default_factory=list)  # patterns ending at this node
+
+
+@dataclass
+class _Partitions:
+    """
+    Attributes:
+        key: maps an event to its partition
+        in_flight: bounds the number of partitions being consumed concurrently
+        pending: the events waiting in each partition being consumed, in publish order
+        tasks: the running partition consumers
+    """
+    key: Callable[[object], Hashable]
+    in_flight: asyncio.Semaphore
+    pending: dict[Hashable, deque] = field(default_factory=dict)
+    tasks: set[asyncio.Task] = field(default_factory=set)
+
+
+@dataclass
+class _TopicMetrics:
+    """
+    Attributes:
+        published: number of events published
+        consumed: number of events fed to the consumers
+        preempted: number of events that waited for events of higher priority topics to be consumed first
+        starved: number of events consumed ahead of pending higher priority events, as they waited too long
+        queue_wait: nanoseconds events waited in the queue
+        handlers: nanoseconds each consumer took per event, by consumer name
+    """
+    published: int = 0
+    consumed: int = 0
+    preempted: int = 0
+    starved: int = 0
+    queue_wait: LatencyHistogram = field(default_factory=LatencyHistogram)
+    handlers: dict[str, LatencyHistogram] = field(default_factory=dict)
+
 
 class PubSub:
     EMPTY_STALL_TIME = 0.01
-    def __init__(self) -> None:
-        self._queues: dict[Hashable, asyncio.Queue] = {}
+    def __init__(
+        self, 
+        capacity: int = 0, 
+        policy: QueuePolicy = QueuePolicy.BLOCK, 
+        starvation_limit: int = 64,
+    ) -> None:
+        """
+        Args:
+            capacity: default capacity of topic queues, unbounded if 0. See `set_capacity` for single topics
+            policy: default policy of full topic queues, one of BLOCK, DROP_OLDEST or DROP_NEWEST
+            starvation_limit: the most times an event yields to pending higher priority events, see `set_priority`
+        """
+        self._capacity = capacity
+        self._policy = policy
+        self._queues: dict[Hashable, BoundedQueue] = {}
         self._consumed_msgs: dict[Hashable, asyncio.Queue] = {}
         self._consumers: dict[Hashable, list[Callable[..., Coroutine]]] = {}
         self._consumed: set = set()
+        self._direct: set[Hashable] = set()  # topics dispatched inline when possible
+        self._locks: dict[Hashable, asyncio.Lock] = {}  # held while a topic's consumers run
+        self._trie = _TrieNode()  # index of pattern subscriptions by their prefix elements
+        self._routes: dict[Hashable, list[Pattern]] = {}  # cache of the patterns matching each published topic
+        self._partitions: dict[Hashable, _Partitions] = {}  # topics consumed concurrently by partition
+        self._batches: dict[Hashable, tuple[int, float]] = {}  # (max batch, max wait) of batch consumed topics
+        self._metrics: dict[Hashable, _TopicMetrics] | None = None  # None while instrumentation is disabled
+        self._metrics_since = 0.0
+        self._priorities: dict[Hashable, TopicPriority] = {}  # topics of other than NORMAL priority
+        self._starvation_limit = starvation_limit
+        self._feeding: set[Hashable] = set()  # topics with an event taken off their queue and not yet consumed
+        self._taps: list[Callable[[Hashable, object], None]] = []  # called with every published event
         
     async def publish(self, qid: Hashable, data: object | None = None):
         """
-        Adds an event to the qid channel
+        Adds an event to the qid channel. On a direct dispatch topic (see `set_direct`) the consumers are called
+        inline, before this returns, if no earlier event of the topic is queued or being consumed
         Args:
             qid: event topic id
             data: data to be pushed to event q
         """
-        q = self._init_qid(qid)
-        await q.put(data)
+        for tap in self._taps:
+            tap(qid, data)
+        routes = self._routes.get(qid)
+        if routes is None:
+            routes = self._routes[qid] = self._match(qid)
+        for pattern in routes:
+            await self._put(pattern, data)
+        await self._put(qid, data)
+
+    def add_tap(self, tap: Callable[[Hashable, object], None]):
+        """
+        Calls `tap(qid, data)` with every event when it is published, before it is queued or consumed, e.g. to
+        journal the event stream. A tap runs inline in the publisher and must not block
+        """
+        self._taps.append(tap)
+
+    def remove_tap(self, tap: Callable[[Hashable, object], None]):
+        self._taps.remove(tap)
+
+    def has_consumers(self, qid: Hashable) -> bool:
+        """
+        Returns:
+            True if topic `qid` has a consumer, directly or through a pattern, such that publishers of costly
+            events nobody consumes may skip them
+        """
+        if qid in self._consumers:
+            return True
+        routes = self._routes.get(qid)
+        if routes is None:
+            routes = self._routes[qid] = self._match(qid)
+        return bool(routes)
+
+    def idle(self) -> bool:
+        """
+        Returns:
+            True if no event is waiting for a consumer or being consumed on any topic. Events of topics nobody
+            subscribed to do not count
+        """
+        return (
+            not self._feeding
+            and all(q.empty() for qid, q in self._queues.items() if qid in self._consumers)
+            and not any(lock.locked() for lock in self._locks.values())
+            and not any(partitions.pending for partitions in self._partitions.values())
+        )
+
+    def set_priority(self, qid: Hashable, priority: TopicPriority):
+        """
+        Sets the priority of topic `qid`, NORMAL by default. Before an event is consumed, it yields to the event loop
+        while a higher priority topic has pending events, so e.g. order updates are not stuck behind a flood of
+        quotes. An event yields at most `starvation_limit` times in a row, such that a steady stream of high priority
+        events only delays lower priority ones. Directly dispatched events are queued while higher priority events
+        are pending
+        Args:
+            qid: event topic id, or a `Pattern` to prioritize a pattern subscription
+            priority: the topic's priority
+        """
+        if priority == TopicPriority.NORMAL:
+            self._priorities.pop(qid, None)
+        else:
+            self._priorities[qid] = priority
+
+    def set_direct(self, qid: Hashable, direct: bool = True):
+        """
+        Sets the dispatch mode of topic `qid`. In direct mode an event published while the topic is idle is consumed
+        inline by the publishing coroutine, saving the queue hop and task switch. Otherwise it is queued as usual, so
+        events of a topic are always consumed one at a time in FIFO order. Exceptions of consumers called inline
+        propagate to the publisher
+        """
+        self._init_qid(qid)
+        if direct:
+            if qid in self._partitions or qid in self._batches:
+                raise ValueError(f"topic {qid} is partitioned or batched and can not be dispatched directly")
+            self._direct.add(qid)
+        else:
+            self._direct.discard(qid)
     
     async def subscribe(self, qid: Hashable, handler: Callable[..., Coroutine]):
         """
@@ -28,11 +195,255 @@ class PubSub:
             qid: event topic id
             handler: and `async def` function or any other Callable that returns a Corutine
         """
+        if qid in self._batches:
+            raise ValueError(f"topic {qid} is consumed in batches, use subscribe_batch")
         self._consumers.setdefault(qid, []).append(handler)
         if qid not in self._consumed:
             await self._feed(qid)
 
-    def _init_qid(self, qid: Hashable) -> asyncio.Queue:
+    async def subscribe_batch(
+        self, 
+        qid: Hashable, 
+        handler: Callable[..., Coroutine], 
+        max_batch: int = 100, 
+        max_wait: float = 0.0
+    ):
+        """
+        Adds a handler called with a list of events of topic qid: all events queued when the handler becomes free,
+        up to `max_batch`. All handlers of a topic must be batch handlers with the same batch parameters
+        Args:
+            qid: event topic id
+            handler: and `async def` function or any other Callable that returns a Corutine, taking a list of events
+            max_batch: maximal number of events in a batch
+            max_wait: seconds to wait for more events after the first of a batch, 0 to hand over only the events
+                already queued
+        """
+        if max_batch < 1:
+            raise ValueError(f"max_batch {max_batch} must be at least 1")
+        if qid in self._partitions:
+            raise ValueError(f"topic {qid} is partitioned and can not be consumed in batches")
+        if qid in self._consumers and self._batches.get(qid) != (max_batch, max_wait):
+            raise ValueError(f"topic {qid} already has consumers with other batch parameters")
+        self._init_qid(qid)
+        self._direct.discard(qid)
+        self._batches[qid] = (max_batch, max_wait)
+        self._consumers.setdefault(qid, []).append(handler)
+        if qid not in self._consumed:
+            await self._feed(qid)
+
+    async def subscribe_pattern(self, prefix: tuple, handler: Callable[..., Coroutine]):
+        """
+        Adds a handler to all topics matching a pattern, see `Pattern`. Events of all matching topics are fed to
+        the pattern's handlers through a queue of their own, in the order they were published
+        Args:
+            prefix: the elements a matching topic starts with, ANY matches any element
+            handler: and `async def` function or any other Callable that returns a Corutine
+        """
+        pattern = Pattern(tuple(prefix))
+        if pattern not in self._consumers:
+            node = self._trie
+            for element in pattern.prefix:
+                node = node.children.setdefault(element, _TrieNode())
+            node.patterns.append(pattern)
+            self._routes.clear()  # cached routes may miss the new pattern
+        await self.subscribe(pattern, handler)
+
+    def partition(self, qid: Hashable, key: Callable[[object], Hashable], max_in_flight: int = 8):
+        """
+        Consumes topic `qid` concurrently by partition: events with the same key are consumed one at a time in
+        publish order, while events of different keys do not wait for each other, e.g. quotes partitioned by pair.
+        When `max_in_flight` partitions are being consumed, an event of another partition waits for one of them
+        to finish. Replaces direct dispatch of the topic. Must be called before the topic is consumed
+        Args:
+            qid: event topic id
+            key: maps an event to its partition
+            max_in_flight: maximal number of partitions consumed concurrently
+        """
+        if qid in self._consumed:
+            raise ValueError(f"topic {qid} is already being consumed")
+        if max_in_flight < 1:
+            raise ValueError(f"max_in_flight {max_in_flight} must be at least 1")
+        if qid in self._batches:
+            raise ValueError(f"topic {qid} is consumed in batches and can not be partitioned")
+        self._init_qid(qid)
+        self._direct.discard(qid)
+        self._partitions[qid] = _Partitions(key, asyncio.Semaphore(max_in_flight))
+
+    def set_capacity(
+        self, 
+        qid: Hashable, 
+        capacity: int, 
+        policy: QueuePolicy = QueuePolicy.BLOCK, 
+        key: Callable[[object], Hashable] | None = None
+    ):
+        """
+        Sets the capacity of topic `qid`'s queue and what publishing to it does when full.
+        Must be called before the topic is consumed. Events already pending are moved to the new queue, those
+        beyond the capacity being dropped by a DROP policy. With BLOCK or CONFLATE, which cannot drop them, the
+        capacity may not be less than the number of pending events
+        Args:
+            qid: event topic id
+            capacity: maximal number of pending events (of pending keys with CONFLATE), unbounded if 0
+            policy: BLOCK makes the publisher wait for room, DROP_OLDEST drops the oldest pending event, DROP_NEWEST
+                drops the published event and CONFLATE keeps only the latest pending event per key
+            key: maps an event to its conflation key, mandatory with CONFLATE
+        """
+        if qid in self._consumed:
+            raise ValueError(f"topic {qid} is already being consumed")
+        pending = self._init_qid(qid)
+        if (
+            capacity
+            and policy in (QueuePolicy.BLOCK, QueuePolicy.CONFLATE)
+            and pending.qsize() > capacity
+        ):
+            raise ValueError(f"topic {qid} has {pending.qsize()} pending events, more than the capacity {capacity}")
+        if policy == QueuePolicy.CONFLATE:
+            if key is None:
+                raise ValueError("a key is required to conflate a topic")
+            q: BoundedQueue = ConflatingQueue(key, capacity)
+        else:
+            q = BoundedQueue(capacity, policy)
+        while not pending.empty():
+            q.put_nowait(pending.get_nowait())
+        self._queues[qid] = q
+        if self._metrics is not None:
+            q.record_wait(self._topic_metrics(qid).queue_wait)
+
+    def conflate(self, qid: Hashable, key: Callable[[object], Hashable]):
+        """
+        Makes topic `qid` a latest value topic: of the pending events with the same key only the latest is kept,
+        so consumers falling behind a burst skip stale events, e.g. quotes keyed by (pair, market).
+        Must be called before the topic is consumed
+        Args:
+            qid: event topic id
+            key: maps an event to its conflation key
+        """
+        self.set_capacity(qid, 0, QueuePolicy.CONFLATE, key)
+
+    def enable_metrics(self):
+        """
+        Starts instrumenting all topics: queue depth, publish and consume rates, queue wait and consumer execution
+        time histograms. While disabled the instrumentation costs one attribute check per publish and dispatch
+        """
+        if self._metrics is not None:
+            return
+        self._metrics = {}
+        self._metrics_since = time.perf_counter()
+        for qid, q in self._queues.items():
+            q.record_wait(self._topic_metrics(qid).queue_wait)
+
+    def disable_metrics(self):
+        self._metrics = None
+        for q in self._queues.values():
+            q.record_wait(None)
+
+    def metrics_snapshot(self, reset: bool = False) -> dict[Hashable, dict]:
+        """
+        Args:
+            reset: whether to start over counting and recording after taking the snapshot
+        Returns:
+            per topic: current queue depth, its high-water mark, events published and consumed and their rates
+            per second since metrics were enabled or last reset, its priority, the number of its events that yielded
+            to higher priority events and of those that stopped yielding (see `set_priority`), and summaries (see
+            `LatencyHistogram.summary`) of the queue wait and of each consumer's execution time in nanoseconds.
+            Empty if metrics are disabled
+        """
+        if self._metrics is None:
+            return {}
+        elapsed = max(time.perf_counter() - self._metrics_since, 1e-9)
+        res = {}
+        for qid, m in self._metrics.items():
+            q = self._queues[qid]
+            res[qid] = {
+                'depth': q.qsize(),
+                'high_water': q.high_water,
+                'published': m.published,
+                'consumed': m.consumed,
+                'publish_rate': m.published / elapsed,
+                'consume_rate': m.consumed / elapsed,
+                'priority': self._priorities.get(qid, TopicPriority.NORMAL),
+                'preempted': m.preempted,
+                'starved': m.starved,
+                'queue_wait_ns': m.queue_wait.summary(),
+                'handlers_ns': {name: h.summary() for name, h in m.handlers.items()},
+            }
+        if reset:
+            self._metrics_since = time.perf_counter()
+            for m in self._metrics.values():
+                m.published = m.consumed = m.preempted = m.starved = 0
+                m.queue_wait.reset()
+                for h in m.handlers.values():
+                    h.reset()
+        return res
+
+    async def log_metrics(self, period: float):
+        """
+        Logs a metrics snapshot of every active topic each `period` seconds, each covering the last period
+        """
+        while True:
+            await asyncio.sleep(period)
+            for qid, snapshot in self.metrics_snapshot(reset=True).items():
+                if snapshot['published'] or snapshot['consumed'] or snapshot['depth']:
+                    logger.info(f"pubsub metrics {qid}: {snapshot}")
+
+    def queue_stats(self) -> dict[Hashable, QueueStats]:
+        """
+        Returns:
+            the size, capacity, high-water mark and number of dropped events of each topic's queue
+        """
+        return {qid: q.stats() for qid, q in self._queues.items()}
+
+    def conflated(self, qid: Hashable) -> int:
+        """
+        Returns:
+            the number of events of topic `qid` that were replaced by a later event before being consumed
+        """
+        q = self._queues.get(qid)
+        return q.conflated if isinstance(q, ConflatingQueue) else 0
+
+    async def _put(self, qid: Hashable, data: object | None):
+        """
+        Consumes `data` inline on an idle direct dispatch topic, queues it otherwise
+        """
+        q = self._init_qid(qid)
+        if self._metrics is not None:
+            self._topic_metrics(qid).published += 1
+        if (
+            qid in self._direct 
+            and qid in self._consumers 
+            and q.empty() 
+            and not self._locks[qid].locked()
+            and qid not in self._feeding  # the feed may hold an event while it yields, before taking the lock
+            and not (self._priorities and self._preempted(qid))
+        ):
+            await self._dispatch(qid, data)
+            return
+        await q.put(data)
+
+    def _match(self, qid: Hashable) -> list[Pattern]:
+        """
+        Returns:
+            the patterns matching topic `qid`, found by walking only the trie branches of its elements and ANY
+        """
+        elements = qid if isinstance(qid, tuple) else (qid,)
+        res = []
+        nodes = [self._trie]
+        for element in elements:
+            next_nodes = []
+            for node in nodes:
+                res.extend(node.patterns)
+                for key in (element, ANY):
+                    child = node.children.get(key)
+                    if child is not None:
+                        next_nodes.append(child)
+            nodes = next_nodes
+            if not nodes:
+                return res
+        for node in nodes:
+            res.extend(node.patterns)
+        return res
+
+    def _init_qid(self, qid: Hashable) -> BoundedQueue:
         """
         Inits a new queue for an unseen qid or returns the queue for an existing one
         Args:
@@ -42,9 +453,18 @@ class PubSub:
         """
         if qid not in self._queues:
             # avoid set default to prevent multiple redundant calls to astncio.Queue()
-            self._queues[qid] = asyncio.Queue()
+            self._queues[qid] = BoundedQueue(self._capacity, self._policy)
+            self._locks[qid] = asyncio.Lock()
+            if self._metrics is not None:
+                self._queues[qid].record_wait(self._topic_metrics(qid).queue_wait)
         return self._queues[qid]
 
+    def _topic_metrics(self, qid: Hashable) -> _TopicMetrics:
+        metrics = self._metrics.get(qid)  # type: ignore
+        if metrics is None:
+            metrics = self._metrics[qid] = _TopicMetrics()  # type: ignore
+        return metrics
+
     def stop(self):
         self._consumed.clear()
         
@@ -55,10 +475,118 @@ class PubSub:
         """      
         self._consumed.add(qid)
         q = self._init_qid(qid)
+        partitions = self._partitions.get(qid)
+        batches = self._batches.get(qid)
         while qid in self._consumed: 
             # try: 
             data = await q.get()
+            self._feeding.add(qid)
+            try:
+                if self._priorities:
+                    await self._yield_to_higher_priorities(qid)
+                if batches is not None:
+                    data = await self._drain(q, data, *batches)
+                if partitions is None:
+                    await self._dispatch(qid, data)
+                    continue
+                key = partitions.key(data)
+                if key in partitions.pending:  # its partition is being consumed
+                    partitions.pending[key].append(data)
+                    continue
+                await partitions.in_flight.acquire()
+                partitions.pending[key] = deque([data])
+                task = asyncio.create_task(self._consume_partition(qid, partitions, key))
+                partitions.tasks.add(task)
+                task.add_done_callback(partitions.tasks.discard)
+            finally:
+                self._feeding.discard(qid)
+
+    def _preempted(self, qid: Hashable) -> bool:
+        """
+        Returns:
+            True if a consumed topic of higher priority than qid has pending events
+        """
+        priority = self._priorities.get(qid, TopicPriority.NORMAL)
+        for other, other_priority in self._priorities.items():
+            if other_priority > priority and other in self._consumers and not self._queues[other].empty():
+                return True
+        return False
+
+    async def _yield_to_higher_priorities(self, qid: Hashable):
+        """
+        Yields to the event loop while higher priority events are pending, at most `starvation_limit` times
+        """
+        if not self._preempted(qid):
+            return
+        yields = 0
+        while yields < self._starvation_limit and self._preempted(qid):
+            await asyncio.sleep(0)
+            yields += 1
+        if self._metrics is not None:
+            metrics = self._topic_metrics(qid)
+            metrics.preempted += 1
+            if yields == self._starvation_limit:
+                metrics.starved += 1
+
+    async def _drain(self, q: BoundedQueue, first: object, max_batch: int, max_wait: float) -> list:
+        """
+        Returns:
+            `first` followed by the events queued in q, waiting up to max_wait seconds for more, at most max_batch
+        """
+        batch = [first]
+        deadline = asyncio.get_running_loop().time() + max_wait
+        while len(batch) < max_batch:
+            if not q.empty():
+                batch.append(q.get_nowait())
+                continue
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(q.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _consume_partition(self, qid: Hashable, partitions: _Partitions, key: Hashable):
+        """
+        Feeds the pending events of partition `key` to the consumers of qid until none are left
+        """
+        pending = partitions.pending[key]
+        try:
+            while pending:
+                data = pending.popleft()
+                try:
+                    await self._consume(qid, data)
+                except Exception:
+                    logger.exception(f"a consumer of {qid} failed on partition {key}")
+        finally:
+            del partitions.pending[key]
+            partitions.in_flight.release()
+
+    async def _dispatch(self, qid: Hashable, data: object | None):
+        """
+        Feeds `data` to all consumers of qid, one after the other, while holding the topic's lock
+        """
+        async with self._locks[qid]:  # acquiring a free lock does not yield, so no other event can overtake
+            await self._consume(qid, data)
+
+    async def _consume(self, qid: Hashable, data: object | None):
+        """
+        Feeds `data` (an event, or a list of events on a batched topic) to all consumers of qid, one after the other
+        """
+        if self._metrics is None:
             coros = (consumer(data) for consumer in self._consumers[qid])
             # await asyncio.gather(*coros)  # await to not allow subsequent calls for the same worker to run concurrently 
             for coro in coros:
                 await coro  # blocking
+            return
+        metrics = self._topic_metrics(qid)
+        metrics.consumed += len(data) if qid in self._batches else 1  # type: ignore
+        for consumer in self._consumers[qid]:
+            start = time.perf_counter_ns()
+            await consumer(data)
+            name = getattr(consumer, '__qualname__', repr(consumer))
+            if name not in metrics.handlers:
+                metrics.handlers[name] = LatencyHistogram()
+            metrics.handlers[name].record(time.perf_counter_ns() - start)
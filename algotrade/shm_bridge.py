@@ -0,0 +1,85 @@
+import asyncio
+from typing import Hashable, Iterable
+
+from algotrade.common import codec
+from algotrade.common.shm_ring import ShmRing
+from algotrade.pubsub import PubSub
+
+
+class ShmPublisher:
+    """
+    Forwards the events of local PubSub topics to another process through a shared memory ring, see `ShmSubscriber`.
+    Events are encoded with `codec`, so quotes, book updates, orders and order status updates are not pickled.
+    While the ring is full the forwarding consumer waits for room, so the topic's queue backs up by its own policy
+    """
+    FULL_STALL_TIME = 0.0005
+
+    def __init__(self, ps: PubSub, ring: ShmRing, topics: Iterable[Hashable]):
+        """
+        Args:
+            ps: the local PubSub
+            ring: the ring to write to, the only writer of it
+            topics: topics to forward, published under the same topic on the other side
+        """
+        self._ps = ps
+        self._ring = ring
+        self._topics = list(topics)
+        self.sent = 0
+
+    async def run(self):
+        await asyncio.gather(*(self._ps.subscribe(topic, self._forwarder(topic)) for topic in self._topics))
+
+    def _forwarder(self, topic: Hashable):
+        async def forward(data):
+            record = codec.encode(topic, data)
+            while not self._ring.try_write(record):
+                await asyncio.sleep(self.FULL_STALL_TIME)
+            self.sent += 1
+        forward.__qualname__ = f"ShmPublisher.forward[{topic}]"
+        return forward
+
+
+class ShmSubscriber:
+    """
+    Publishes the events read from a shared memory ring, written by a `ShmPublisher` of another process, to the
+    local PubSub. Polls the ring, backing off from `min_poll` to `max_poll` seconds while it stays empty
+    """
+    def __init__(self, ps: PubSub, ring: ShmRing, min_poll: float = 0.0, max_poll: float = 0.001):
+        """
+        Args:
+            ps: the local PubSub
+            ring: the ring to read from, the only reader of it
+            min_poll: seconds to wait after the ring is found empty the first time, 0 yields to other tasks
+            max_poll: the most seconds to wait between polls of an empty ring
+        """
+        self._ps = ps
+        self._ring = ring
+        self._min_poll = min_poll
+        self._max_poll = max_poll
+        self.received = 0
+
+    async def run(self):
+        poll = self._min_poll
+        while True:
+            if await self.poll():
+                poll = self._min_poll
+                continue
+            await asyncio.sleep(poll)
+            poll = min(self._max_poll, max(2 * poll, 1e-5))
+
+    async def poll(self, max_events: int = 256) -> int:
+        """
+        Publishes up to `max_events` pending events
+        Returns:
+            number of events published
+        """
+        n = 0
+        while n < max_events:
+            record = self._ring.try_read()
+            if record is None:
+                break
+            topic, data = codec.decode(record)
+            await self._ps.publish(topic, data)
+            n += 1
+        self.received += n
+        return n
@@ -0,0 +1,87 @@
+"""
+Latency and throughput of sending bursts of order requests through a `Connector` to a local websocket server
+standing in for the market, with payloads sent one by one, in batches, and in batches merged by the Talos adapter.
+
+Usage:
+    python -m benchmarks.bench_connector [--bursts 2000] [--burst-size 4]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+import websockets
+
+from algotrade.common.enums import AdapterName
+from algotrade.connect.adapter.talos import merge_payloads
+from algotrade.connect.connector.connector import Connector
+from algotrade.pubsub import PubSub
+
+PORT = 8766
+
+
+def order_payload(i: int) -> str:
+    return json.dumps({
+        "type": "NewOrderSingle",
+        "data": [{"ClOrdID": str(i), "Markets": ["kraken"], "OrdType": "Limit", "OrderQty": 0.1, "Side": "Buy",
+                  "Symbol": "BTC-EUR", "TimeInForce": "GoodTillCancel", "Price": 20000.0 + i}],
+    })
+
+
+async def run_bursts(bursts: int, burst_size: int, max_send_batch: int, merge: bool) -> tuple[np.ndarray, float]:
+    """
+    Returns:
+        the latency in microseconds of each burst from queuing its first payload until the server received its
+        last order, and the orders per second over all bursts
+    """
+    received = 0
+    burst_done = asyncio.Event()
+
+    async def serve(ws):
+        nonlocal received
+        async for message in ws:
+            received += len(json.loads(message)["data"])
+            if received % burst_size == 0:
+                burst_done.set()
+
+    connector = Connector(
+        f"ws://localhost:{PORT}",
+        AdapterName.TALOS,
+        PubSub(),
+        merge_payloads=merge_payloads if merge else None,
+        max_send_batch=max_send_batch,
+    )
+    latencies = np.empty(bursts)
+    async with websockets.serve(serve, "localhost", PORT):  # type: ignore
+        task = asyncio.create_task(connector.connect())
+        await asyncio.sleep(0.1)
+        start_all = time.perf_counter()
+        for i in range(bursts):
+            burst_done.clear()
+            start = time.perf_counter_ns()
+            for j in range(burst_size):
+                await connector.on_payload_out(order_payload(i * burst_size + j))
+            await burst_done.wait()
+            latencies[i] = (time.perf_counter_ns() - start) / 1e3
+        throughput = bursts * burst_size / (time.perf_counter() - start_all)
+        task.cancel()
+    return latencies, throughput
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bursts', type=int, default=2000)
+    parser.add_argument('--burst-size', type=int, default=4)
+    args = parser.parse_args()
+    for name, max_send_batch, merge in (('one by one', 1, False), ('batched', 64, False), ('merged', 64, True)):
+        latencies, throughput = asyncio.run(run_bursts(args.bursts, args.burst_size, max_send_batch, merge))
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(
+            f"{name}, bursts of {args.burst_size}: "
+            f"mean {latencies.mean():.1f}us p50 {p50:.1f}us p99 {p99:.1f}us, {throughput:.0f} orders/s"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Latency of an event crossing a chain of `PubSub` topics, like a market data payload crossing
+PAYLOAD_IN -> AdapterTopic.QUOTE_UPDATE -> BrokerTopic.QUOTE_UPDATE -> ORDERS_OUT, with queued and direct dispatch.
+
+Usage:
+    python -m benchmarks.bench_pubsub [--hops 4] [--events 20000]
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from algotrade.pubsub import PubSub
+
+
+async def run_chain(hops: int, events: int, direct: bool) -> np.ndarray:
+    """
+    Returns:
+        the latency in microseconds of each event from its first publish until the last topic's consumer ran
+    """
+    ps = PubSub()
+    done = asyncio.Event()
+    latencies = np.empty(events)
+    subscriptions = []
+
+    def forward(hop: int):
+        async def consumer(msg):
+            await ps.publish(hop + 1, msg)
+        return consumer
+
+    async def last(msg):
+        i, start = msg
+        latencies[i] = (time.perf_counter_ns() - start) / 1e3
+        done.set()
+
+    for hop in range(hops - 1):
+        subscriptions.append(asyncio.create_task(ps.subscribe(hop, forward(hop))))
+    subscriptions.append(asyncio.create_task(ps.subscribe(hops - 1, last)))
+    if direct:
+        for hop in range(hops):
+            ps.set_direct(hop)
+    await asyncio.sleep(0)  # let the feeds start
+    for i in range(events):
+        done.clear()
+        await ps.publish(0, (i, time.perf_counter_ns()))
+        await done.wait()
+    ps.stop()
+    for task in subscriptions:
+        task.cancel()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hops', type=int, default=4)
+    parser.add_argument('--events', type=int, default=20000)
+    args = parser.parse_args()
+    for direct in (False, True):
+        latencies = asyncio.run(run_chain(args.hops, args.events, direct))
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(
+            f"{'direct' if direct else 'queued'} dispatch, {args.hops} hops: "
+            f"mean {latencies.mean():.1f}us p50 {p50:.1f}us p99 {p99:.1f}us "
+            f"({latencies.mean() / args.hops:.1f}us per hop)"
+        )
+
+
+if __name__ == '__main__':
+    main()
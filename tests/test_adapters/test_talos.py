@@ -0,0 +1,42 @@
+import asyncio
+import json
+
+from algotrade.common.data_models import currency_pair_from_str
+from algotrade.common.enums import AdapterTopic, MarketName
+from algotrade.config import get_config
+from algotrade.connect.adapter.talos import Talos
+from algotrade.pubsub import PubSub
+from tests.common import pubsub_events
+
+PAIR = currency_pair_from_str('BTC-EUR')
+
+
+def quote_payload(bid_vwap: str, ask_vwap: str) -> str:
+    return json.dumps({
+        "reqid": 1,
+        "type": "MarketDataSnapshot",
+        "seq": 1,
+        "data": [{
+            "Symbol": "BTC-EUR",
+            "Markets": {"kraken": {"Status": "Online"}},
+            "Bids": [{"VWAP": "10149.30", "Size": "0"}, {"VWAP": bid_vwap, "Size": "0.5"}],
+            "Offers": [{"VWAP": "10149.31", "Size": "0"}, {"VWAP": ask_vwap, "Size": "0.5"}],
+            "ExchangeTime": "2019-09-17T17:46:31.335714Z",
+        }],
+    })
+
+
+async def test_fixed_point_quote_vwaps(tmp_path, monkeypatch, pubsub_events):
+    msgs, get_event_consumer = pubsub_events
+    config = get_config() | {'fixed_point': {'BTC-EUR': {'tick': 0.01, 'lot': 1e-8}}}
+    monkeypatch.chdir(tmp_path)  # the adapter reads its secrets from the working directory
+    (tmp_path / 'secrets.toml').write_text("[talos]\nsandbox = ''\nprod = ''\nprod_trade = ''\n")
+    ps = PubSub()
+    talos = Talos(ps, config)
+    asyncio.gather(ps.subscribe(AdapterTopic.QUOTE_UPDATE, get_event_consumer(AdapterTopic.QUOTE_UPDATE)))
+    await talos.on_payload_recv_in(quote_payload('10149.2988', '10149.3012'))
+    await asyncio.sleep(0.01)
+    quote = msgs[AdapterTopic.QUOTE_UPDATE][0]
+    assert (quote.tob_bid_price, quote.tob_ask_price) == (1014930, 1014931)
+    assert (quote.bid_price, quote.ask_price) == (1014929, 1014931), "bucket VWAPs must round to the passive side"
+    assert quote.size == 50_000_000 and quote.market == MarketName.KRAKEN and quote.pair == PAIR
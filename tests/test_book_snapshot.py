@@ -0,0 +1,49 @@
+import time
+
+import pytest
+
+from algotrade.broker import Broker
+from algotrade.common.data_models import BookUpdate, currency_pair_from_str
+from algotrade.common.enums import MarketName, Side
+from algotrade.order_book import snapshot
+from algotrade.order_book.order_book import L2OrderBook
+from algotrade.order_book.tick_order_book import TickL2OrderBook
+from algotrade.pubsub import PubSub
+
+PAIR = currency_pair_from_str('BTC-EUR')
+
+
+@pytest.mark.parametrize("make_book", [L2OrderBook, lambda: TickL2OrderBook(0.5)])
+def test_save_load(tmp_path, make_book):
+    book = make_book()
+    book.update(bids={100:1, 99.5:2}, asks={101:3})
+    empty = make_book()
+    path = str(tmp_path / 'books.bin')
+    snapshot.save(path, {(PAIR, MarketName.KRAKEN): book, (PAIR, MarketName.FTX): empty}, {(PAIR, MarketName.KRAKEN): 123.5})
+    kraken, ftx = snapshot.load(path)
+    assert (kraken.pair, kraken.market, kraken.updated_at) == (PAIR, MarketName.KRAKEN, 123.5)
+    assert list(kraken.bid_prices) == [100, 99.5], "bid levels are expected top of the book first"
+    restored = make_book()
+    kraken.restore_into(restored)
+    assert dict(restored.bids()) == dict(book.bids())
+    assert dict(restored.asks()) == dict(book.asks())
+    assert restored.get_tob(Side.BUY) == (100, 1)
+    assert len(ftx.bid_prices) == len(ftx.ask_prices) == 0
+
+
+async def test_broker_checkpoint_restore(tmp_path):
+    path = str(tmp_path / 'books.bin')
+    broker = Broker(PubSub())
+    await broker.on_book_update(BookUpdate(PAIR, MarketName.KRAKEN, bids={100:1}, asks={101:2}))
+    broker.checkpoint(path)
+    time.sleep(0.01)
+    restarted = Broker(PubSub())
+    assert restarted.get_book_age(PAIR, MarketName.KRAKEN) is None
+    assert restarted.restore(path) == 1
+    assert restarted.get_book(PAIR, MarketName.KRAKEN).get_tob(Side.SELL) == (101, 2)
+    assert restarted.get_book_age(PAIR, MarketName.KRAKEN) >= 0.01, "restored book must report the time since its last update"
+    await restarted.on_book_update(BookUpdate(PAIR, MarketName.KRAKEN, bids={100:5}, asks={}, sequence=2))
+    assert restarted.get_book(PAIR, MarketName.KRAKEN).get_tob(Side.BUY) == (100, 1), \
+        "a restored book must ignore incremental updates until a snapshot"
+    await restarted.on_book_update(BookUpdate(PAIR, MarketName.KRAKEN, bids={99:1}, asks={102:1}, snapshot=True))
+    assert restarted.get_book(PAIR, MarketName.KRAKEN).get_tob(Side.BUY) == (99, 1)
@@ -0,0 +1,87 @@
+import asyncio
+import zlib
+
+from algotrade.broker import Broker
+from algotrade.common.data_models import BookUpdate, Update, currency_pair_from_str
+from algotrade.common.enums import BrokerTopic, MarketName, Side
+from algotrade.order_book.order_book import L2OrderBook, kraken_checksum
+from algotrade.pubsub import PubSub
+from tests.common import pubsub_events
+
+PAIR = currency_pair_from_str('BTC-EUR')
+RESYNC_QID = (BrokerTopic.BOOK_RESYNC, MarketName.KRAKEN)
+
+
+def update(bids, asks, sequence, snapshot=False, checksum=None):
+    return BookUpdate(PAIR, MarketName.KRAKEN, bids, asks, snapshot=snapshot, sequence=sequence, checksum=checksum)
+
+
+async def test_sequence_gap_resync(pubsub_events):
+    msgs, get_event_consumer = pubsub_events
+    ps = PubSub()
+    broker = Broker(ps)
+    asyncio.gather(ps.subscribe(RESYNC_QID, get_event_consumer(RESYNC_QID)))
+    await broker.on_book_update(update({100:1}, {101:1}, 1, snapshot=True))
+    await broker.on_book_update(update({100:2}, {}, 2))
+    await broker.on_book_update(update({100:3}, {}, 2))
+    book = broker.get_book(PAIR, MarketName.KRAKEN)
+    assert book.get_tob(Side.BUY) == (100, 2), "a duplicate sequence must be ignored"
+    await broker.on_book_update(update({99:1}, {}, 4))
+    await asyncio.sleep(0.01)
+    assert msgs[RESYNC_QID] == [Update(PAIR, MarketName.KRAKEN)], "a sequence gap must request a resync of the book"
+    assert not book.has_tob(Side.BUY), "an out of sync book must be cleared"
+    await broker.on_book_update(update({99:1}, {}, 5))
+    assert not book.has_tob(Side.BUY), "incremental updates must be ignored until a snapshot arrives"
+    await broker.on_book_update(update({98:1}, {102:1}, 10, snapshot=True))
+    await broker.on_book_update(update({99:1}, {}, 11))
+    assert book.get_tob(Side.BUY) == (99, 1)
+
+
+async def test_checksum_resync(pubsub_events):
+    msgs, get_event_consumer = pubsub_events
+    ps = PubSub()
+    checksum = lambda pair, book: kraken_checksum(book, price_decimals=1, depth=2)
+    broker = Broker(ps, checksums={MarketName.KRAKEN: checksum})
+    asyncio.gather(ps.subscribe(RESYNC_QID, get_event_consumer(RESYNC_QID)))
+    expected = L2OrderBook()
+    expected.update({100:1, 99:2, 98:3}, {101:1})
+    await broker.on_book_update(update({100:1, 99:2, 98:3}, {101:1}, None, snapshot=True, checksum=checksum(PAIR, expected)))
+    await asyncio.sleep(0.01)
+    assert RESYNC_QID not in msgs
+    await broker.on_book_update(update({100:2}, {}, None, checksum=checksum(PAIR, expected)))
+    await asyncio.sleep(0.01)
+    assert msgs[RESYNC_QID] == [Update(PAIR, MarketName.KRAKEN)], "a checksum mismatch must request a resync of the book"
+
+
+def test_kraken_checksum():
+    book = L2OrderBook()
+    book.update(bids={0.05: 1.5, 0.04995: 2}, asks={0.05005: 0.000005})
+    digits = '5005' + '500' + '5000' + '150000000' + '4995' + '200000000'  # asks then bids, no point or leading 0
+    assert kraken_checksum(book, price_decimals=5) == zlib.crc32(digits.encode())
+
+
+async def test_book_updates_batch(pubsub_events):
+    msgs, get_event_consumer = pubsub_events
+    ps = PubSub()
+    broker = Broker(ps)
+    qid = BrokerTopic.CONSOLIDATED_BOOK_UPDATE
+    asyncio.gather(ps.subscribe(qid, get_event_consumer(qid)))
+    await asyncio.sleep(0)  # let the consumer subscribe
+    await broker.on_book_updates([
+        update({100:1}, {101:1}, 1, snapshot=True),
+        update({100:2}, {}, 2),
+        update({99:1}, {}, 4),  # gap
+    ])
+    await asyncio.sleep(0.01)
+    assert len(msgs[qid]) == 1, "the consolidated book must be published once per batch"
+    assert not broker.get_book(PAIR, MarketName.KRAKEN).has_tob(Side.BUY)
+
+
+async def test_consolidated_book_needs_consumers():
+    ps = PubSub()
+    broker = Broker(ps)
+    await broker.on_book_update(update({100:1}, {101:1}, 1, snapshot=True))
+    await broker.on_book_updates([update({100:2}, {}, 2)])
+    assert ps.queue_stats().get(BrokerTopic.CONSOLIDATED_BOOK_UPDATE) is None, \
+        "consolidated books nobody consumes must not be queued"
+    assert broker.get_consolidated_book(PAIR).get_tob(Side.BUY) == (100, 2)
@@ -1,4 +1,5 @@
 import asyncio
+import json
 from uuid import UUID
 
 import pytest
@@ -9,7 +10,10 @@ from colorama import Fore
 from algotrade.common.data_models import Order
 from algotrade.common.enums import (AdapterName, AdapterTopic, ConnectorTopic,
                                     MarketName)
-from algotrade.connect.connector.connector import Connector
+from algotrade.connect.adapter.talos import merge_payloads, peek_type
+from algotrade.connect.connector import connector as connector_module
+from algotrade.connect.connector.connector import Connector, backoff_delay
+from algotrade.connect.connector.pool import ConnectorPool
 from algotrade.pubsub import PubSub
 
 
@@ -114,3 +118,200 @@ async def test_connector(server: Server):
     await asyncio.sleep(0.1)
     asyncio.gather(con.connect())
     await asyncio.sleep(0.1)
+
+
+def request(rtype: str, *ids, **kw) -> str:
+    return json.dumps({"type": rtype, "data": [{"ClOrdID": i} for i in ids], **kw})
+
+
+def test_merge_payloads():
+    payloads = [
+        request("NewOrderSingle", 1),
+        request("NewOrderSingle", 2, 3),
+        request("OrderCancelRequest", 4),
+        '{"type": "subscribe"}',
+        request("OrderCancelRequest", 5),
+        request("OrderCancelReplaceRequest", 6, Comments="cancel replace"),
+        request("OrderCancelReplaceRequest", 7, Comments="other"),
+    ]
+    merged = merge_payloads(payloads)
+    assert merged[0] == request("NewOrderSingle", 1, 2, 3), "adjacent requests of a type must be merged"
+    assert merged[1:] == payloads[2:], "requests must not be merged across other payloads or with other fields"
+
+
+@pytest.mark.parametrize('payload, expected', [
+    ('{"reqid": 1, "type": "MarketDataSnapshot", "data": [{"type": "x"}]}', 'MarketDataSnapshot'),
+    (b'{"type":"hello","session_id":"s"}', 'hello'),
+    (memoryview(b'{ "type" : "error"}'), 'error'),
+    (b'{"data": []}', None),
+])
+def test_peek_type(payload, expected):
+    assert peek_type(payload) == expected
+
+
+class WebSocketMock:
+    def __init__(self, received=(), fail_at: int | None = None):
+        self.sent = []
+        self._received = list(received)
+        self._fail_at = fail_at  # number of messages sent before the connection breaks
+
+    async def send(self, payload):
+        if len(self.sent) == self._fail_at:
+            raise ConnectionResetError
+        self.sent.append(payload)
+        await asyncio.sleep(0)
+
+    async def recv(self):
+        if not self._received:
+            await asyncio.Future()
+        return self._received.pop(0)
+
+
+async def test_send_coalescing():
+    ws = WebSocketMock()
+    con = Connector("ws://localhost:8765", AdapterName.TALOS, PubSub(), merge_payloads=merge_payloads)
+    for i in range(3):
+        await con.on_payload_out(request("NewOrderSingle", i))
+    await con.on_payload_out('{"type": "subscribe"}')
+    task = asyncio.create_task(con._run_send(ws))
+    await asyncio.sleep(0.01)
+    await con.on_payload_out(request("NewOrderSingle", 3))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    assert ws.sent == [request("NewOrderSingle", 0, 1, 2), '{"type": "subscribe"}', request("NewOrderSingle", 3)]
+
+
+async def test_send_failure_keeps_unsent():
+    ws = WebSocketMock(fail_at=1)
+    con = Connector("ws://localhost:8765", AdapterName.TALOS, PubSub(), merge_payloads=merge_payloads)
+    payloads = [request("NewOrderSingle", 0), request("NewOrderSingle", 1), '{"type": "subscribe"}', request("NewOrderSingle", 2)]
+    for payload in payloads:
+        await con.on_payload_out(payload)
+    with pytest.raises(ConnectionResetError):
+        await con._run_send(ws)
+    assert ws.sent == [request("NewOrderSingle", 0, 1)]
+    ws = WebSocketMock()
+    task = asyncio.create_task(con._run_send(ws))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    assert ws.sent == ['{"type": "subscribe"}', request("NewOrderSingle", 2)], \
+        "the payloads not written before the failure must be sent first on the next connection"
+
+
+async def test_cancelled_send_counts_as_sent():
+    ws = WebSocketMock()
+    con = Connector("ws://localhost:8765", AdapterName.TALOS, PubSub(), max_send_batch=1)
+    for i in range(2):
+        await con.on_payload_out(request("NewOrderSingle", i))
+    task = asyncio.create_task(con._run_send(ws))
+    await asyncio.sleep(0)  # the first order is written and the send awaits the transport
+    task.cancel()
+    await asyncio.sleep(0)
+    assert ws.sent == [request("NewOrderSingle", 0)]
+    ws = WebSocketMock()
+    task = asyncio.create_task(con._run_send(ws))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    assert ws.sent == [request("NewOrderSingle", 1)], "an order written when the send was cancelled must not be resent"
+
+
+async def test_pool_sharding():
+    pairs = [f'PAIR-{i}' for i in range(20)]
+    pool = ConnectorPool(
+        "ws://localhost:8765", AdapterName.TALOS, PubSub(), lambda payload: payload.get('pair'), market_data_connections=3
+    )
+    for pair in pairs:
+        await pool.on_payload_out({'pair': pair})
+    await pool.on_payload_out({'order': 1})
+    sizes = {name: stats.size for name, stats in pool.queue_stats().items()}
+    assert sizes['orders'] == 1, "payloads without a shard key must go to the order connection"
+    assert sum(sizes.values()) == len(pairs) + 1 and all(sizes.values()), "subscriptions must be spread"
+    filters = [connector._established_msg for connector in pool._connectors()]
+    for pair in pairs:
+        assert [serves(pair) for serves in filters].count(True) == 1, "each pair must be served by one connection"
+    assert [serves(None) for serves in filters] == [True, False, False, False]
+    stats = pool.connection_stats()
+    assert list(stats) == ['orders', 'market_data-0', 'market_data-1', 'market_data-2']
+    assert not any(s.connected for s in stats.values())
+
+
+def test_backoff_delay():
+    assert backoff_delay(1, 0.1, 10) == 0, "the first reconnect attempt must be immediate"
+    assert 0.05 <= backoff_delay(2, 0.1, 10) <= 0.1
+    assert 0.2 <= backoff_delay(4, 0.1, 10) <= 0.4
+    assert 5 <= backoff_delay(30, 0.1, 10) <= 10, "the delay must be capped"
+
+
+async def test_subscription_registry():
+    subscribe = lambda pair, i: json.dumps({"reqid": i, "type": "subscribe", "streams": [{"Symbol": pair}]})
+    ws = WebSocketMock(received=['{"type": "hello"}', '{"type": "MarketDataSnapshot"}'])
+    con = Connector(
+        "ws://localhost:8765",
+        AdapterName.TALOS,
+        PubSub(),
+        get_subscription_key=lambda p: json.loads(p)["streams"][0]["Symbol"] if '"subscribe"' in p else None,
+        is_market_data=lambda p: "MarketDataSnapshot" in p,
+    )
+    for payload in (subscribe('BTC-EUR', 1), request("NewOrderSingle", 1), subscribe('BTC-USD', 2), subscribe('BTC-EUR', 3)):
+        await con.on_payload_out(payload)
+    task = asyncio.create_task(con._run_send(ws))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    assert list(con._subscriptions.values()) == [subscribe('BTC-EUR', 3), subscribe('BTC-USD', 2)], \
+        "the latest subscription payload of each key must be kept"
+    con._disconnected_at = 0  # a disconnect at monotonic time 0
+    task = asyncio.create_task(con._run_recieve(ws))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    stats = con.connection_stats()
+    assert stats.received == 2 and stats.blackout_ns['count'] == 1, "the first market data must end the blackout"
+    assert stats.last_blackout is not None and stats.last_blackout > 0
+
+
+class DroppingWebSocket(WebSocketMock):
+    """Accepted, then dropped by the server right away"""
+    async def recv(self):
+        await asyncio.sleep(0.001)
+        raise ConnectionResetError
+
+
+@pytest.mark.parametrize('healthy_after, expected_attempts', [(5.0, [1, 2, 3]), (0.0, [1, 1, 1])])
+async def test_reconnect_backoff(monkeypatch, healthy_after, expected_attempts):
+    sockets, attempts = [], []
+
+    class Stop(Exception):
+        pass
+
+    class FakeConnect:
+        def __init__(self, **kw):
+            if len(sockets) == 3:
+                raise Stop
+            sockets.append(DroppingWebSocket())
+
+        async def __aenter__(self):
+            return sockets[-1]
+
+        async def __aexit__(self, *exc):
+            return False
+
+    def renew(payload):
+        request = json.loads(payload)
+        request["reqid"] += 100
+        return json.dumps(request)
+
+    monkeypatch.setattr(connector_module.websockets, 'connect', FakeConnect)
+    monkeypatch.setattr(connector_module, 'backoff_delay', lambda attempt, *_: attempts.append(attempt) or 0)
+    con = Connector(
+        "ws://localhost:8765",
+        AdapterName.TALOS,
+        PubSub(),
+        get_subscription_key=lambda p: json.loads(p)["streams"][0]["Symbol"],
+        healthy_after=healthy_after,
+        renew_subscription=renew,
+    )
+    await con.on_payload_out(json.dumps({"reqid": 1, "type": "subscribe", "streams": [{"Symbol": "BTC-EUR"}]}))
+    with pytest.raises(Stop):
+        await con.connect()
+    assert attempts == expected_attempts, "connections dropped right away must not start the backoff over"
+    assert [json.loads(ws.sent[0])["reqid"] for ws in sockets] == [1, 101, 201], \
+        "replayed subscriptions must get fresh request ids"
@@ -0,0 +1,32 @@
+import pytest
+
+from algotrade.broker import Broker
+from algotrade.common.data_models import BookUpdate, currency_pair_from_str
+from algotrade.common.enums import MarketName, Side
+from algotrade.pubsub import PubSub
+
+PAIR = currency_pair_from_str('BTC-EUR')
+
+
+@pytest.mark.parametrize('tick_sizes', [None, {PAIR: 1.0}])
+async def test_consolidated_book(tick_sizes):
+    broker = Broker(PubSub(), consolidated_tick_sizes=tick_sizes)
+    await broker.on_book_update(BookUpdate(PAIR, MarketName.KRAKEN, {100:1, 99:1}, {102:1}, snapshot=True))
+    await broker.on_book_update(BookUpdate(PAIR, MarketName.FTX, {100:2, 98:5}, {101:1}, snapshot=True))
+    book = broker.get_consolidated_book(PAIR)
+    assert book.nbbo() == (100, 101)
+    assert book.get_tob(Side.BUY) == (100, 3)
+    assert book.get_venues(Side.BUY, 100) == {MarketName.KRAKEN: 1, MarketName.FTX: 2}
+    await broker.on_book_update(BookUpdate(PAIR, MarketName.FTX, {100:0}, {101:0}))
+    assert book.get_tob(Side.BUY) == (100, 1)
+    assert book.get_tob(Side.SELL) == (102, 1), "a removed level must leave the consolidated book"
+    assert book.vwap_for_size(Side.BUY, 2) == 99.5
+    assert book.best_venue_for_size(Side.BUY, 2) == (MarketName.KRAKEN, 99.5)
+    assert book.best_venue_for_size(Side.BUY, 3) == (MarketName.FTX, 98), "only FTX holds 3 on a single market"
+    assert book.best_venue_for_size(Side.BUY, 1) == (MarketName.KRAKEN, 100)
+    assert book.best_venue_for_size(Side.SELL, 2) is None
+    await broker.on_book_update(BookUpdate(PAIR, MarketName.KRAKEN, {97:1}, {103:1}, snapshot=True))
+    assert list(book.iter_levels(Side.BUY)) == [(98, 5), (97, 1)], "a snapshot must replace all of the market's levels"
+    assert book.price_for_size(Side.BUY, 6) == 97
+    assert book.vwap_for_size(Side.BUY, 6) == pytest.approx((98 * 5 + 97) / 6)
+    assert book.price_for_size(Side.BUY, 7) is None
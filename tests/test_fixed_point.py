@@ -0,0 +1,28 @@
+import pytest
+
+from algotrade.common.data_models import currency_pair_from_str
+from algotrade.common.enums import Side
+from algotrade.common.fixed_point import FixedPoint, fixed_points_from_config
+from algotrade.order_book.order_book import L2OrderBook
+
+
+def test_conversions():
+    fixed = FixedPoint(tick=0.1, lot=1e-8)
+    assert fixed.to_ticks('0.3') == fixed.to_ticks(0.1 + 0.2) == 3, "float rounding must not change the level"
+    assert fixed.from_ticks(3) == 0.3
+    assert fixed.to_lots('0.5') == 50_000_000
+    assert fixed.from_lots(50_000_001) == 0.50000001
+    assert fixed.round_ticks(10.5, Side.BUY) == 10, "a buy price must be rounded down"
+    assert fixed.round_ticks(10.5, Side.SELL) == 11, "a sell price must be rounded up"
+    assert fixed.round_ticks(10.0000000001, Side.SELL) == 10
+    with pytest.raises(ValueError):
+        fixed.to_ticks('0.35')
+
+
+def test_fixed_point_book():
+    fixed = fixed_points_from_config({'fixed_point': {'BTC-EUR': {'tick': 0.01, 'lot': 1e-8}}})[currency_pair_from_str('BTC-EUR')]
+    book = L2OrderBook(depth_tick_size=1)
+    book.update(bids={fixed.to_ticks('100.07'): fixed.to_lots('0.3')}, asks={fixed.to_ticks('100.1'): fixed.to_lots('1')})
+    book.update(bids={fixed.to_ticks(100.0 + 0.07): 0})
+    assert not book.has_tob(Side.BUY), "levels must be found regardless of how the price was computed"
+    assert book.get_tob(Side.SELL) == (10010, 100_000_000)
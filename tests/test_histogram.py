@@ -0,0 +1,24 @@
+import random
+
+from algotrade.common.histogram import LatencyHistogram
+
+
+def test_percentiles():
+    histogram = LatencyHistogram()
+    values = [random.randint(0, 10**9) for _ in range(10000)]
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    for p in (50, 90, 99):
+        exact = values[round(p / 100 * len(values)) - 1]
+        assert 0.96 * exact <= histogram.percentile(p) <= exact, "a percentile must be within the bucket precision"
+    assert (histogram.min, histogram.max, histogram.count) == (values[0], values[-1], len(values))
+
+
+def test_small_values_exact():
+    histogram = LatencyHistogram()
+    for value in range(64):
+        histogram.record(value)
+    assert histogram.percentile(50) == 31
+    assert histogram.percentile(100) == 63
+    assert LatencyHistogram().percentile(50) is None
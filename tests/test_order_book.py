@@ -1,7 +1,13 @@
+import random
+
 import pytest
 
-from algotrade.common.enums import Side
-from algotrade.order_book.order_book import L2OrderBook, diff
+from algotrade.common.data_models import currency_pair_from_str
+from algotrade.common.enums import MarketName, Side
+from algotrade.order_book.depth_index import DepthIndex
+from algotrade.order_book.factory import book_factories_from_config
+from algotrade.order_book.order_book import (BookDiffView, L2OrderBook,
+                                             OrderBookMissingLevelError, diff)
 
 
 @pytest.fixture()
@@ -67,4 +73,113 @@ def test_has_tob():
     assert not book.has_tob(Side.BUY)
     assert book.has_tob(Side.SELL)
     book.update(bids={1:1})
-    assert book.has_tob(Side.BUY)
\ No newline at end of file
+    assert book.has_tob(Side.BUY)
+
+
+def test_tob_fallback(book):
+    book.delta_update(bid_deltas={1.2:-0.1}, ask_deltas={1.3:-0.1})
+    assert book.get_tob(Side.BUY) == (1.1, 1), "TOB buy level removed by a delta but TOB did not fall back"
+    assert book.get_tob(Side.SELL) == (1.4, 1), "TOB sell level removed by a delta but TOB did not fall back"
+    book.update(bids={0.9:2}, asks={1.6:2}, snapshot=True)
+    assert book.get_tob(Side.BUY) == (0.9, 2), "TOB buy not replaced by snapshot"
+    assert book.get_tob(Side.SELL) == (1.6, 2), "TOB sell not replaced by snapshot"
+    book.update(bids={0.9:0})
+    assert not book.has_tob(Side.BUY), "last buy level removed but book still has a buy TOB"
+    with pytest.raises(OrderBookMissingLevelError):
+        book.get_tob(Side.BUY)
+
+
+def test_diff_view(book):
+    own = L2OrderBook()
+    own.update(bids={1.2:0.1, 1.1:0.5}, asks={1.3:0.05})
+    view = BookDiffView(book, own)
+    assert view.get_tob(Side.BUY) == (1.1, 0.5), "emptied TOB level not skipped by the view"
+    assert view.get_level(Side.BUY, nth_from_top=2) == (1, 1)
+    assert view.get_tob(Side.SELL) == (1.3, 0.05)
+    assert view.get_size(Side.BUY, 1.2) == 0
+    assert book.get_tob(Side.BUY) == (1.2, 0.1), "the view must not modify the base book"
+    own.update(asks={1.3:0.1})
+    assert view.get_tob(Side.SELL) == (1.4, 1), "the view must reflect changes of the subtrahend book"
+    own.update(bids={1:1})
+    with pytest.raises(OrderBookMissingLevelError):
+        view.get_level(Side.BUY, nth_from_top=2)
+
+def test_sweep_queries():
+    book = L2OrderBook(depth_tick_size=0.1)
+    book.update(bids={99.9:1, 99.8:2, 99.0:5}, asks={100.1:1, 100.2:2, 101.0:5})
+    assert book.price_for_size(Side.BUY, 2) == 99.8
+    assert book.price_for_size(Side.SELL, 3) == 100.2, "sweeping exactly two levels should stop at the second"
+    assert book.vwap_for_size(Side.SELL, 2) == pytest.approx((100.1 + 100.2) / 2)
+    assert book.price_for_size(Side.SELL, 8.5) is None, "not enough size in the book"
+    assert book.depth_within(Side.BUY, 25) == 3, "levels within 25bp of the mid 100"
+    assert book.depth_within(Side.SELL, 100) == 8
+    book.delta_update(bid_deltas={99.9:-1}, ask_deltas={100.1:-1})
+    assert book.price_for_size(Side.BUY, 2) == 99.8, "index not updated on delta"
+    assert book.vwap_for_size(Side.SELL, 3) == pytest.approx((2 * 100.2 + 101) / 3)
+
+def test_depth_index_shrinks_after_outlier():
+    index = DepthIndex(Side.SELL, 1, capacity=64)
+    for tick in range(100, 110):
+        index.set(tick, 1)
+    index.set(10**6, 1)  # a fat finger level inflates the grid
+    index.set(10**6, 0)
+    for _ in range(64):  # churn near the top
+        index.set(105, 0)
+        index.set(105, 1)
+    assert index._capacity == 64, "the grid must shrink back once the outlier is gone"
+    assert index.price_for_size(3) == 102
+    assert index.vwap_for_size(10) == 104.5
+
+
+def test_sweep_queries_index_matches_walk():
+    random.seed(1)
+    indexed, walked = L2OrderBook(depth_tick_size=0.5), L2OrderBook()
+    for i in range(3000):
+        bids = {0.5 * random.randint(1000, 1998): random.choice([0, 1, 2.5])}
+        asks = {0.5 * random.randint(2002, 3000): random.choice([0, 1, 2.5])}
+        snapshot = i % 1000 == 999
+        indexed.update(bids=bids, asks=asks, snapshot=snapshot)
+        walked.update(bids=bids, asks=asks, snapshot=snapshot)
+        if i % 50 == 0 and indexed.has_tob(Side.BUY) and indexed.has_tob(Side.SELL):
+            for side in Side:
+                for size in (0.5, 3, 40):
+                    assert indexed.price_for_size(side, size) == walked.price_for_size(side, size)
+                    assert indexed.vwap_for_size(side, size) == pytest.approx(walked.vwap_for_size(side, size))
+                assert indexed.depth_within(side, 20) == pytest.approx(walked.depth_within(side, 20))
+
+
+def test_max_depth():
+    book = L2OrderBook(max_depth=2, depth_reserve=1)
+    book.update(bids={100:1, 99:1, 98:1, 97:1}, asks={101:1, 102:1}, snapshot=True)
+    assert list(book.iter_levels(Side.BUY)) == [(100, 1), (99, 1), (98, 1)], "levels beyond max_depth + depth_reserve must be dropped"
+    assert book.is_complete(Side.BUY) and book.is_complete(Side.SELL)
+    book.update(bids={100:0})
+    assert book.is_complete(Side.BUY), "the reserve level keeps max_depth levels known"
+    book.update(bids={99:0})
+    assert not book.is_complete(Side.BUY), "level 97 was dropped and may be within max_depth now"
+    book.update(bids={100:1, 99:1}, snapshot=True)
+    assert book.is_complete(Side.BUY), "a snapshot restores completeness"
+
+
+def test_max_depth_ignores_levels_beyond_frontier():
+    book = L2OrderBook(max_depth=2)
+    book.update(bids={10:1, 9:1, 8:1, 7:1}, asks={11:1}, snapshot=True)
+    book.update(bids={10:0})
+    book.update(bids={7:2})
+    assert list(book.iter_levels(Side.BUY)) == [(9, 1)], "a level beyond the dropped ones must not fill the gap"
+    assert not book.is_complete(Side.BUY), "level 8 was dropped and is within max_depth now"
+    book.update(bids={9.5:1})
+    assert book.is_complete(Side.BUY), "levels above the worst one kept are known"
+
+
+def test_factories_from_config():
+    pair = currency_pair_from_str('ETH-EUR')
+    factories = book_factories_from_config(
+        {'order_book': {'ETH-EUR': {'max_depth': 2, 'markets': {'kraken': {'max_depth': 3}}}}}
+    )
+    levels = {100 - i: 1 for i in range(5)}
+    default, kraken = factories[pair](), factories[(pair, MarketName.KRAKEN)]()
+    default.update(bids=levels)
+    kraken.update(bids=levels)
+    assert len(list(default.bids())) == 2
+    assert len(list(kraken.bids())) == 3
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from algotrade.common.enums import Side
+from algotrade.order_book.order_book import L2OrderBook
+from algotrade.order_book.replay import BUY, SELL, apply_events, replay
+from algotrade.order_book.tick_order_book import TickL2OrderBook
+
+
+@pytest.fixture()
+def events():
+    rng = np.random.default_rng(0)
+    n = 5000
+    timestamps = np.sort(rng.integers(0, 1000, n))
+    sides = rng.choice([BUY, SELL], n)
+    prices = np.where(sides == BUY, rng.integers(100, 200, n), rng.integers(201, 300, n)) * 0.5
+    sizes = rng.choice([0.0, 0.0, 1.0, 2.5], n)
+    yield timestamps, sides, prices, sizes
+
+
+def sequential_tobs(book, sides, prices, sizes):
+    tobs = []
+    for side, price, size in zip(sides.tolist(), prices.tolist(), sizes.tolist()):
+        if side == BUY:
+            book.update(bids={price: size})
+        else:
+            book.update(asks={price: size})
+        tobs.append(tuple(book.get_tob(s) if book.has_tob(s) else (np.nan, np.nan) for s in Side))
+    return np.array(tobs).reshape(len(tobs), 4).T
+
+
+def make_book():
+    return TickL2OrderBook(0.5, capacity=16)
+
+
+def test_replay_same_as_sequential(events):
+    timestamps, sides, prices, sizes = events
+    sequential = L2OrderBook()
+    expected = sequential_tobs(sequential, sides, prices, sizes)
+    series = replay(make_book(), timestamps, sides, prices, sizes)
+    np.testing.assert_array_equal(series.timestamps, timestamps)
+    np.testing.assert_array_equal(np.vstack([series.bid_price, series.bid_size, series.ask_price, series.ask_size]), expected)
+
+    sample_times = np.array([10, 11, 500, 900])  # a short block between 10 and 11, events after 900
+    book = make_book()
+    sampled = replay(book, timestamps, sides, prices, sizes, sample_times=sample_times)
+    at = np.searchsorted(timestamps, sample_times, side='right') - 1
+    np.testing.assert_array_equal(sampled.bid_price, expected[0, at])
+    np.testing.assert_array_equal(sampled.ask_size, expected[3, at])
+    assert book.bids() == dict(sequential.bids()), "events after the last sample must be applied too"
+    assert book.asks() == dict(sequential.asks())
+
+
+def test_apply_events_same_as_sequential(events):
+    _, sides, prices, sizes = events
+    sequential = L2OrderBook()
+    sequential_tobs(sequential, sides, prices, sizes)
+    book = make_book()
+    apply_events(book, sides, prices, sizes)
+    assert dict(book.bids()) == dict(sequential.bids())
+    assert dict(book.asks()) == dict(sequential.asks())
+
+
+def test_replay_requires_tick_book(events):
+    with pytest.raises(TypeError):
+        replay(L2OrderBook(), *events)
+    with pytest.raises(ValueError):
+        replay(TickL2OrderBook(0.5, window=10), *events)
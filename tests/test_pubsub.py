@@ -7,7 +7,9 @@ import pytest
 import pytest_asyncio
 from colorama import Fore
 
-from algotrade.pubsub import PubSub
+from algotrade.common.enums import QueuePolicy, TopicPriority
+from algotrade.common.queues import QueueStats
+from algotrade.pubsub import ANY, PubSub
 
 
 @pytest_asyncio.fixture
@@ -75,4 +77,201 @@ async def test_three_consumers(ps: PubSub):
 #     await asyncio.sleep(0.1)
 #     coros = [cp.produce(qid, 'msg-stop-1'), cp.stop(qid), cp.produce(qid, 'msg-stop-1'), cp.stop(qid)]
 #     asyncio.gather(*coros)
-    
\ No newline at end of file
+    
+
+async def test_direct_dispatch(ps: PubSub):
+    qid = 'direct'
+    consumed = []
+    async def consumer(msg):
+        consumed.append(msg)
+        if msg == 'msg-1':
+            await ps.publish(qid, 'msg-2')  # the topic is busy, so this one is queued
+            await asyncio.sleep(0.01)
+            consumed.append('msg-1 done')
+    asyncio.gather(ps.subscribe(qid, consumer))
+    await asyncio.sleep(0)
+    ps.set_direct(qid)
+    await ps.publish(qid, 'msg-1')
+    assert consumed == ['msg-1', 'msg-1 done'], "an event of an idle direct topic must be consumed inline"
+    await ps.publish(qid, 'msg-3')
+    await asyncio.sleep(0.01)
+    assert consumed == ['msg-1', 'msg-1 done', 'msg-2', 'msg-3'], "direct dispatch must keep FIFO order"
+
+
+async def test_conflate(ps: PubSub):
+    qid = 'quotes'
+    consumed = []
+    async def consumer(msg):
+        consumed.append(msg)
+    ps.conflate(qid, key=lambda msg: msg[0])
+    for msg in [('a', 1), ('b', 1), ('a', 2), ('a', 3), ('b', 2)]:
+        await ps.publish(qid, msg)
+    asyncio.gather(ps.subscribe(qid, consumer))
+    await asyncio.sleep(0.01)
+    assert consumed == [('a', 3), ('b', 2)], "only the latest pending event per key must be consumed"
+    assert ps.conflated(qid) == 3
+    with pytest.raises(ValueError):
+        ps.conflate(qid, key=lambda msg: msg[0])
+
+
+@pytest.mark.parametrize("policy, expected", [
+    (QueuePolicy.DROP_OLDEST, [3, 4]),
+    (QueuePolicy.DROP_NEWEST, [0, 1]),
+])
+async def test_drop_policies(ps: PubSub, policy, expected):
+    consumed = []
+    async def consumer(msg):
+        consumed.append(msg)
+    ps.set_capacity('q', 2, policy)
+    for i in range(5):
+        await ps.publish('q', i)
+    assert ps.queue_stats()['q'] == QueueStats(size=2, maxsize=2, high_water=2, dropped=3)
+    asyncio.gather(ps.subscribe('q', consumer))
+    await asyncio.sleep(0.01)
+    assert consumed == expected
+
+
+async def test_block_policy(ps: PubSub):
+    ps.set_capacity('q', 1)
+    await ps.publish('q', 0)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(ps.publish('q', 1), 0.01)
+
+
+async def test_set_capacity_below_pending(ps: PubSub):
+    for i in range(3):
+        await ps.publish('q', i)
+    with pytest.raises(ValueError):
+        ps.set_capacity('q', 2)
+    ps.set_capacity('q', 2, QueuePolicy.DROP_OLDEST)
+    assert ps.queue_stats()['q'] == QueueStats(size=2, maxsize=2, high_water=2, dropped=1)
+
+
+async def test_pattern_subscription(ps: PubSub):
+    msgs = {}
+    def get_consumer(name):
+        async def consumer(msg):
+            msgs.setdefault(name, []).append(msg)
+        return consumer
+    asyncio.gather(
+        ps.subscribe_pattern(('panic',), get_consumer('panic')),
+        ps.subscribe_pattern(('orders', ANY, 'kraken'), get_consumer('kraken orders')),
+        ps.subscribe(('orders', 'btc', 'kraken'), get_consumer('exact')),
+    )
+    await asyncio.sleep(0)
+    await ps.publish('panic', 1)
+    await ps.publish(('panic', 'btc', 'kraken'), 2)
+    await ps.publish(('orders', 'btc', 'kraken'), 3)
+    await ps.publish(('orders', 'eth', 'kraken'), 4)
+    await ps.publish(('orders', 'eth', 'ftx'), 5)
+    await ps.publish(('orders', 'btc', 'kraken'), 6)
+    await asyncio.sleep(0.01)
+    assert msgs['panic'] == [1, 2], "a prefix pattern must match the bare topic and longer topics"
+    assert msgs['kraken orders'] == [3, 4, 6], "a wildcard must match any element"
+    assert msgs['exact'] == [3, 6], "exact subscribers must keep receiving their topic"
+
+
+async def test_partition(ps: PubSub):
+    consumed = []
+    async def consumer(msg):
+        pair, i = msg
+        if pair == 'slow':
+            await asyncio.sleep(0.05)
+        consumed.append(msg)
+    ps.partition('quotes', key=lambda msg: msg[0], max_in_flight=2)
+    asyncio.gather(ps.subscribe('quotes', consumer))
+    for msg in [('slow', 0), ('fast', 0), ('slow', 1), ('fast', 1)]:
+        await ps.publish('quotes', msg)
+    await asyncio.sleep(0.01)
+    assert consumed == [('fast', 0), ('fast', 1)], "a slow partition must not block other partitions"
+    await asyncio.sleep(0.15)
+    assert consumed[2:] == [('slow', 0), ('slow', 1)], "events of a partition must be consumed in order"
+
+
+async def test_subscribe_batch(ps: PubSub):
+    batches = []
+    async def consumer(batch):
+        batches.append(batch)
+        await asyncio.sleep(0.01)
+    asyncio.gather(ps.subscribe_batch('q', consumer, max_batch=3))
+    await asyncio.sleep(0)
+    for i in range(6):
+        await ps.publish('q', i)
+    await asyncio.sleep(0.05)
+    assert batches == [[0, 1, 2], [3, 4, 5]], "queued events must be handed over together, up to max_batch"
+    with pytest.raises(ValueError):
+        await ps.subscribe('q', consumer)
+
+
+async def test_metrics(ps: PubSub):
+    async def consumer(msg):
+        await asyncio.sleep(0.001)
+    assert ps.metrics_snapshot() == {}, "metrics must be empty while disabled"
+    ps.enable_metrics()
+    for i in range(3):
+        await ps.publish('q', i)
+    asyncio.gather(ps.subscribe('q', consumer))
+    await asyncio.sleep(0.05)
+    snapshot = ps.metrics_snapshot(reset=True)['q']
+    assert (snapshot['published'], snapshot['consumed'], snapshot['depth'], snapshot['high_water']) == (3, 3, 0, 3)
+    assert snapshot['queue_wait_ns']['count'] == 3
+    handler = snapshot['handlers_ns']['test_metrics.<locals>.consumer']
+    assert handler['count'] == 3 and handler['min'] >= 1e6, "consumer execution time must be recorded"
+    assert ps.metrics_snapshot()['q']['published'] == 0, "a reset must start counting over"
+    ps.disable_metrics()
+    await ps.publish('q', 3)
+    assert ps.metrics_snapshot() == {}
+
+
+async def test_priority(ps: PubSub):
+    log = []
+    async def consumer(msg):
+        log.append(msg)
+        await asyncio.sleep(0)
+    ps.set_priority('orders', TopicPriority.HIGH)
+    asyncio.gather(ps.subscribe('quotes', consumer), ps.subscribe('orders', consumer))
+    await asyncio.sleep(0)
+    for i in range(10):
+        await ps.publish('quotes', i)
+    await ps.publish('orders', 'reject')
+    await asyncio.sleep(0.01)
+    assert log[0] == 'reject', "pending high priority events must be consumed first"
+    assert log[1:] == list(range(10))
+
+
+async def test_priority_keeps_direct_fifo(ps: PubSub):
+    log = []
+    async def consumer(msg):
+        log.append(msg)
+    async def control_consumer(msg):
+        if msg == 1:  # 'quotes' 1 is held by its feed, yielding to this topic
+            await ps.publish('quotes', 2)
+        await asyncio.sleep(0)
+    ps.set_direct('quotes')
+    ps.set_priority('orders', TopicPriority.HIGH)
+    asyncio.gather(ps.subscribe('quotes', consumer), ps.subscribe('orders', control_consumer))
+    await asyncio.sleep(0)
+    await ps.publish('orders', 0)
+    await ps.publish('orders', 1)
+    await ps.publish('quotes', 1)
+    await asyncio.sleep(0.01)
+    assert log == [1, 2], "a direct dispatch must not overtake an event its feed holds while yielding"
+
+
+async def test_priority_starvation():
+    ps = PubSub(starvation_limit=3)
+    ps.enable_metrics()
+    log = []
+    async def slow_consumer(msg):
+        log.append(msg)
+        await asyncio.sleep(0.005)
+    ps.set_priority('orders', TopicPriority.HIGH)
+    asyncio.gather(ps.subscribe('quotes', slow_consumer), ps.subscribe('orders', slow_consumer))
+    await asyncio.sleep(0)
+    await ps.publish('quotes', 'quote')
+    for i in range(5):
+        await ps.publish('orders', i)
+    await asyncio.sleep(0.05)
+    assert log.index('quote') < 4, "a lower priority event must not wait for all higher priority events"
+    snapshot = ps.metrics_snapshot()['quotes']
+    assert (snapshot['preempted'], snapshot['starved']) == (1, 1)
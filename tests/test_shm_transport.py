@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+
+from algotrade.common import codec
+from algotrade.common.data_models import (BookUpdate, Frame, Order,
+                                          OrderStatusUpdate,
+                                          OrderStatusUpdateType, Quote,
+                                          currency_pair_from_str)
+from algotrade.common.enums import (AdapterName, BrokerTopic, ConnectorTopic,
+                                    MarketName, Side)
+from algotrade.common.shm_ring import ShmRing
+from algotrade.pubsub import PubSub
+from algotrade.shm_bridge import ShmPublisher, ShmSubscriber
+from tests.common import pubsub_events
+
+PAIR = currency_pair_from_str('BTC-EUR')
+NOW = datetime(2022, 5, 1, 12, 30, 15, 123456)
+
+
+@pytest.fixture
+def ring():
+    ring = ShmRing.create(None, 256)
+    yield ring
+    ring.close()
+    ring.unlink()
+
+
+@pytest.mark.parametrize('topic, data', [
+    ((BrokerTopic.QUOTE_UPDATE, PAIR, MarketName.KRAKEN), Quote(100.5, 101.5, 100.0, 102.0, MarketName.KRAKEN, PAIR, 0.5, NOW)),
+    ((BrokerTopic.QUOTE_UPDATE, PAIR, MarketName.KRAKEN), Quote(1005, 1015, 1000, 1020, MarketName.KRAKEN, PAIR, 50, NOW)),
+    ((BrokerTopic.QUOTE_UPDATE, PAIR, MarketName.KRAKEN), Quote(1005, 1015, 1000, 1020, MarketName.KRAKEN, PAIR, 50, NOW, 7)),
+    (BrokerTopic.BOOK_UPDATE, BookUpdate(PAIR, MarketName.KRAKEN, {100.5: 1.0, 100.0: 2.5}, {101: 3}, NOW, True, 7, 123)),
+    (BrokerTopic.BOOK_UPDATE, BookUpdate(PAIR, MarketName.KRAKEN, {}, {101.0: 0.0})),
+    (BrokerTopic.ORDER_STATUS_UPDATE, OrderStatusUpdate(
+        MarketName.KRAKEN, PAIR, uuid4(), OrderStatusUpdateType.REJECTED, NOW, reject_reason='no funds', size=2,
+        side=Side.SELL, limit_price=99.5, live=False)),
+    (BrokerTopic.ORDER_STATUS_UPDATE, OrderStatusUpdate(MarketName.KRAKEN, PAIR, uuid4(), OrderStatusUpdateType.TRADE, NOW)),
+    ((BrokerTopic.ORDERS_OUT, MarketName.KRAKEN), [
+        Order(uuid4(), 1.5, PAIR, Side.BUY, 100.0, MarketName.KRAKEN),
+        Order(uuid4(), 3, PAIR, Side.SELL, 1010, MarketName.KRAKEN, timeout=2.5, filled_size=1, cum_fee=0.1),
+    ]),
+    ((BrokerTopic.CANCEL_ORDERS_OUT, MarketName.KRAKEN), [uuid4(), uuid4()]),
+    ((ConnectorTopic.PAYLOAD_IN, AdapterName.TALOS), '{"type": "MarketDataSnapshot"}'),
+    ((ConnectorTopic.PAYLOAD_IN, AdapterName.TALOS), b'{"type": "MarketDataSnapshot"}'),
+    ((ConnectorTopic.PAYLOAD_IN, AdapterName.TALOS), Frame('{"type": "hello"}', 123456789)),
+    ((ConnectorTopic.PAYLOAD_IN, AdapterName.TALOS), Frame(b'{"type": "hello"}', 123456789)),
+    ((BrokerTopic.PANIC, 'reason', 3), None),
+    ('pickled', {'any': 'object'}),
+])
+def test_codec_round_trip(topic, data):
+    assert codec.decode(codec.encode(topic, data)) == (topic, data)
+
+
+def test_codec_keeps_number_types():
+    quote = Quote(1005, 101.5, 1000, 1020, MarketName.KRAKEN, PAIR, 50, NOW)
+    _, decoded = codec.decode(codec.encode(BrokerTopic.QUOTE_UPDATE, quote))
+    assert type(decoded.bid_price) is int and type(decoded.ask_price) is float, "fixed-point ints must stay ints"
+
+
+def test_ring_wraps(ring):
+    assert ring.try_read() is None
+    records = [bytes([i]) * (10 + i) for i in range(40)]
+    written = read = 0
+    while read < len(records):
+        while written < len(records) and ring.try_write(records[written]):
+            written += 1
+        record = ring.try_read()
+        assert record == records[read], "records must be read in the order they were written"
+        read += 1
+    assert ring.used() == 0
+
+
+def test_ring_full(ring):
+    while ring.try_write(b'x' * 20):
+        pass
+    assert ring.used() <= ring.capacity
+    assert ring.try_read() == b'x' * 20
+    assert ring.try_write(b'x' * 20), "a read must make room for a record of the same size"
+    with pytest.raises(ValueError):
+        ring.try_write(b'x' * ring.capacity)
+
+
+async def test_bridge(ring, pubsub_events):
+    msgs, get_event_consumer = pubsub_events
+    topic = (BrokerTopic.QUOTE_UPDATE, PAIR, MarketName.KRAKEN)
+    quotes = [Quote(100 + i, 101 + i, 100, 101, MarketName.KRAKEN, PAIR, 1, NOW) for i in range(30)]
+    ps_out, ps_in = PubSub(), PubSub()
+    reader = ShmRing.attach(ring.name)
+    publisher = ShmPublisher(ps_out, ring, [topic])
+    subscriber = ShmSubscriber(ps_in, reader)
+    tasks = [
+        asyncio.create_task(publisher.run()),
+        asyncio.create_task(subscriber.run()),
+        asyncio.create_task(ps_in.subscribe(topic, get_event_consumer(topic))),
+    ]
+    for quote in quotes:
+        await ps_out.publish(topic, quote)
+    for _ in range(100):
+        await asyncio.sleep(0.005)
+        if len(msgs.get(topic, [])) == len(quotes):
+            break
+    for task in tasks:
+        task.cancel()
+    reader.close()
+    assert msgs[topic] == quotes, "events must arrive in order, even when the ring fills up"
@@ -0,0 +1,105 @@
+import random
+
+import numpy as np
+import pytest
+
+from algotrade.common.enums import Side
+from algotrade.order_book.order_book import L2OrderBook
+from algotrade.order_book.tick_order_book import TickL2OrderBook
+
+
+@pytest.fixture()
+def book():
+    book = TickL2OrderBook(tick_size=0.1, capacity=8)
+    book.update(bids={1:1, 1.1:1, 1.2:0.1}, asks={1.3:0.1, 1.4:1, 1.5:1})
+    yield book
+
+def test_remove_level(book):
+    book.update(bids={1:0}, asks={})
+    assert 1 not in book.bids(), "zero size update for level 1, but level still in book"
+    assert book.get_size(Side.BUY, 1) == 0, "size at price level 1 on buy side should be considered 0"
+    assert book.get_size(Side.BUY, 1.1) == 1, "size at price level 1.1 on buy side should be 1"
+    assert book.get_tob(Side.BUY) == (1.2, 0.1), "TOB should not have been changed"
+
+def test_tob(book):
+    book.update(bids={1.2: 0}, asks={1.3:0})
+    assert book.get_tob(Side.BUY) == (1.1, 1), "TOB buy level removed but new TOB buy is wrong"
+    assert book.get_tob(Side.SELL) == (1.4, 1), "TOB sell level removed but new TOB sell is wrong"
+    book.update(bids={1.2:0.2}, asks={1.3:0.2})
+    assert book.get_tob(Side.BUY) == (1.2, 0.2), "TOB buy level surpassed but new TOB buy is wrong"
+    assert book.get_tob(Side.SELL) == (1.3, 0.2), "TOB sell level surpassed but new TOB sell is wrong"
+
+def test_get_level(book):
+    assert book.get_level(Side.BUY, nth_from_top=2) == (1.1, 1), "get_level for 2nd level from TOB got wrong results"
+    assert book.get_level(Side.SELL, nth_from_top=2) == (1.4, 1), "get_level for 2nd level from TOB got wrong results"
+
+def test_reanchor(book):
+    book.update(bids={0.1:1}, asks={9.9:2})  # far outside of the initial 8 ticks ladder
+    assert book.get_level(Side.BUY, nth_from_top=4) == (0.1, 1), "level set outside of the ladder is missing"
+    assert book.get_level(Side.SELL, nth_from_top=4) == (9.9, 2), "level set outside of the ladder is missing"
+    assert book.get_tob(Side.BUY) == (1.2, 0.1), "re-anchoring changed the TOB"
+    assert book.get_tob(Side.SELL) == (1.3, 0.1), "re-anchoring changed the TOB"
+
+def test_off_tick_price(book):
+    with pytest.raises(ValueError):
+        book.update(bids={1.05:1})
+
+def test_same_as_sorted_book():
+    random.seed(0)
+    tick_book, sorted_book = TickL2OrderBook(tick_size=0.5, capacity=4), L2OrderBook()
+    for _ in range(2000):
+        bids = {0.5 * random.randint(100, 200): random.choice([0, 0, 1, 2.5])}
+        asks = {0.5 * random.randint(201, 300): random.choice([0, 0, 1, 2.5])}
+        tick_book.update(bids=bids, asks=asks)
+        sorted_book.update(bids=bids, asks=asks)
+        for side in Side:
+            assert tick_book.has_tob(side) == sorted_book.has_tob(side)
+            if sorted_book.has_tob(side):
+                assert tick_book.get_tob(side) == sorted_book.get_tob(side)
+    assert tick_book.bids() == dict(sorted_book.bids())
+    assert tick_book.asks() == dict(sorted_book.asks())
+
+def test_max_depth_same_as_sorted_book():
+    random.seed(1)
+    tick_book = TickL2OrderBook(tick_size=0.5, capacity=4, max_depth=3, depth_reserve=2)
+    sorted_book = L2OrderBook(max_depth=3, depth_reserve=2)
+    for i in range(2000):
+        bids = {0.5 * random.randint(100, 200): random.choice([0, 0, 1, 2.5])}
+        asks = {0.5 * random.randint(201, 300): random.choice([0, 0, 1, 2.5])}
+        snapshot = i % 100 == 0
+        tick_book.update(bids=bids, asks=asks, snapshot=snapshot)
+        sorted_book.update(bids=bids, asks=asks, snapshot=snapshot)
+        for side in Side:
+            assert tick_book.is_complete(side) == sorted_book.is_complete(side)
+            assert list(tick_book.iter_levels(side)) == list(sorted_book.iter_levels(side))
+
+def test_window():
+    book = TickL2OrderBook(tick_size=1, capacity=8, window=3)
+    book.update(bids={100:1, 99:1, 98:1}, asks={101:1})
+    book.update(bids={10**6:0, 1:1}, asks={10**6:1})  # far levels are dropped rather than growing the ladder
+    assert list(book.iter_levels(Side.BUY)) == [(100, 1), (99, 1), (98, 1)]
+    assert list(book.iter_levels(Side.SELL)) == [(101, 1)]
+    assert book.is_complete(Side.BUY) and book.is_complete(Side.SELL), "the windows do not reach the dropped levels"
+    book.update(bids={}, asks={101:0})
+    assert not book.is_complete(Side.SELL), "the asks beyond the window are unknown"
+    book.update(bids={101:1}, asks={})
+    assert list(book.iter_levels(Side.BUY)) == [(101, 1), (100, 1), (99, 1)], "a new best level moves the window"
+    book.update(bids={101:0}, asks={})
+    assert not book.is_complete(Side.BUY), "level 98 was dropped and is within the window again"
+    book.update(bids={98:1}, asks={})
+    assert book.get_size(Side.BUY, 98) == 0, "updates beyond the dropped levels must be ignored"
+    book.update(bids={100:1}, asks={101:1}, snapshot=True)
+    assert book.is_complete(Side.BUY) and book.is_complete(Side.SELL), "a snapshot restores completeness"
+    assert len(book._ladders[Side.SELL].sizes) == 8, "the window must bound the ladder"
+
+def test_scan_bounded_by_worst_level(monkeypatch):
+    book = TickL2OrderBook(tick_size=1, capacity=8)
+    book.update(bids={1:1, **{10**6 - i: 1 for i in range(10)}})
+    book.update(bids={1:0})  # leaves a wide and sparse ladder
+    scanned = []
+    argmax = np.argmax
+    monkeypatch.setattr(np, 'argmax', lambda a: scanned.append(len(a)) or argmax(a))
+    for i in range(9):
+        book.update(bids={10**6 - i: 0})
+        assert book.get_tob(Side.BUY) == (10**6 - i - 1, 1)
+    assert max(scanned) <= 10, "removing the top must not scan beyond the worst level"
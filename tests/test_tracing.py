@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime
+from uuid import uuid4
+
+from algotrade.broker import Broker
+from algotrade.common.data_models import (Frame, Order, Quote, Trace,
+                                          currency_pair_from_str)
+from algotrade.common.enums import (AdapterName, AdapterTopic, BrokerTopic,
+                                    ConnectorTopic, MarketName, Side,
+                                    TraceStage)
+from algotrade.common.tracing import LatencyTracer
+from algotrade.connect.connector.connector import Connector
+from algotrade.pubsub import PubSub
+from tests.test_connector import WebSocketMock
+
+PAIR = currency_pair_from_str('BTC-EUR')
+
+
+async def test_tick_to_trade():
+    ps = PubSub()
+    tracer = LatencyTracer()
+    broker = Broker(ps, tracer=tracer)
+    con = Connector("ws://localhost:8765", AdapterName.TALOS, ps, tracer=tracer)
+    frames, orders = [], []
+
+    async def on_payload_recv_in(frame: Frame):  # stands in for the adapter
+        frames.append(frame)
+        trace = tracer.on_parsed(frame.recv_ns)
+        await ps.publish(AdapterTopic.QUOTE_UPDATE, Quote(100, 101, 100, 101, MarketName.KRAKEN, PAIR, 1, datetime.utcnow(), trace=trace))
+
+    async def on_quote_update(quote: Quote):  # stands in for the algorithm
+        order = Order(uuid4(), 1, PAIR, Side.BUY, 100, MarketName.KRAKEN)
+        tracer.on_decision([order])
+        orders.append(order)
+        tracer.expect(f'order {order.uuid}', order.trace)  # type: ignore
+        await con.on_payload_out(f'order {order.uuid}')
+
+    tasks = [
+        asyncio.create_task(ps.subscribe((ConnectorTopic.PAYLOAD_IN, AdapterName.TALOS), on_payload_recv_in)),
+        asyncio.create_task(ps.subscribe(AdapterTopic.QUOTE_UPDATE, broker.on_quote_update)),
+        asyncio.create_task(ps.subscribe(BrokerTopic.QUOTE_UPDATE, tracer.traced(on_quote_update))),
+    ]
+    ws = WebSocketMock(received=['{"type": "MarketDataSnapshot"}'])
+    tasks += [asyncio.create_task(con._run_recieve(ws)), asyncio.create_task(con._run_send(ws))]
+    await asyncio.sleep(0.01)
+    for task in tasks:
+        task.cancel()
+    assert frames[0].payload == '{"type": "MarketDataSnapshot"}', "received messages must be published stamped"
+    assert ws.sent == [f'order {orders[0].uuid}']
+    trace = orders[0].trace
+    assert trace is not None and trace.recv_ns == frames[0].recv_ns, "orders must carry the stamp of their origin"
+    assert trace.recv_ns <= trace.parsed_ns <= trace.broker_ns <= trace.decision_ns  # type: ignore
+    summary = tracer.summary()
+    assert all(summary[stage]['count'] == 1 for stage in TraceStage), "each stage must be recorded once"
+    assert summary[TraceStage.TICK_TO_TRADE]['min'] >= summary[TraceStage.DECISION_TO_WIRE]['min']
+
+
+async def test_untraced_orders():
+    tracer = LatencyTracer(max_pending=2)
+    order = Order(uuid4(), 1, PAIR, Side.BUY, 100, MarketName.KRAKEN)
+    tracer.on_decision([order])
+    assert order.trace is None, "orders published outside a traced handler must not be traced"
+    for i in range(3):
+        tracer.expect(i, Trace(0, 0, 0, 0))
+    tracer.on_sent([0, 1, 2])
+    assert tracer.summary(reset=True)[TraceStage.DECISION_TO_WIRE]['count'] == 2, "the oldest pending must be forgotten"
+    assert tracer.summary()[TraceStage.DECISION_TO_WIRE]['count'] == 0